@@ -50,18 +50,21 @@ class CartAdmin(admin.ModelAdmin):
     list_select_related = ('user',)
     
     def store_list(self, obj):
-        stores = obj.get_stores()
-        if stores.exists():
-            return ", ".join([store.name for store in stores])
+        store_totals = obj.get_store_totals()
+        if store_totals:
+            return ", ".join([totals['store'].name for totals in store_totals.values()])
         return "No stores"
     store_list.short_description = 'Stores'
     
     def get_grand_total_display(self, obj):
-        return f"${obj.get_grand_total():.2f}" if obj.get_grand_total() is not None else "N/A"
+        grand_total = obj.get_grand_total()
+        return f"${grand_total:.2f}" if grand_total is not None else "N/A"
     get_grand_total_display.short_description = 'Grand Total'
     
     def get_queryset(self, request):
-        return super().get_queryset(request).prefetch_related('items')
+        # Totals are built from this prefetch, so the changelist costs the
+        # same number of queries however many stores each cart spans.
+        return super().get_queryset(request).prefetch_related('items__variant__product__store')
     
     def get_user(self, obj):
         if obj.user:
@@ -2,33 +2,69 @@ from rest_framework import status
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny
+from django.http import Http404
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags, quote_etag
 from django.shortcuts import get_object_or_404
 from django.db import transaction
 from django.conf import settings
+from django.utils.decorators import method_decorator
 
 from .models import Cart, CartItem
-from .serializers import CartSerializer, AddToCartSerializer, CartItemSerializer
+from .serializers import (
+    CartSerializer, AddToCartSerializer, CartItemSerializer, BatchCartSerializer
+)
+from order.idempotency import idempotent
 from product.models import Variant
 from store.models import Store
 
+def serialize_cart(cart):
+    """
+    Serialize ``cart`` after reloading it through ``Cart.objects.for_api()``,
+    so the payload costs a fixed number of queries regardless of item count.
+    """
+    if not cart.is_guest:
+        cart = Cart.objects.for_api().get(pk=cart.pk)
+    return CartSerializer(cart).data
+
+def cart_etag(version_key):
+    return 'W/' + quote_etag(f'cart-{version_key}')
+
+
+def etag_matches(request, etag):
+    """Weak If-None-Match comparison, as used for GET revalidation."""
+    header = request.headers.get('If-None-Match')
+    if not header:
+        return False
+    return any(
+        candidate == '*' or candidate.removeprefix('W/') == etag.removeprefix('W/')
+        for candidate in parse_etags(header)
+    )
+
+
+@method_decorator(idempotent('cart-api'), name='dispatch')
 class CartAPIView(APIView):
     permission_classes = [AllowAny]
     
     def get(self, request):
-        """Get the user's active cart with all items"""
-        # Get the store - you might want to get this from the current store context
-        store = Store.objects.first()
-        if not store:
-            return Response(
-                {'error': 'No store available'}, 
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        # Get or create cart for the user/session
-        cart = Cart.objects.get_or_create_cart(request, store)
-        
-        serializer = CartSerializer(cart)
-        return Response(serializer.data)
+        """
+        Get the user's active cart with all items.
+
+        Sends a weak ETag built from the cart version; a matching
+        ``If-None-Match`` gets a 304 after a single version lookup, without
+        loading or serializing the items.
+        """
+        version_key = Cart.objects.get_version_key(request)
+        if version_key is not None and etag_matches(request, cart_etag(version_key)):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            # Get or create cart for the user/session
+            cart = Cart.objects.get_or_create_cart(request)
+            response = Response(serialize_cart(cart))
+            version_key = cart.version_key
+        response['ETag'] = cart_etag(version_key)
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
     
     def post(self, request):
         """Add item to cart"""
@@ -41,36 +77,19 @@ class CartAPIView(APIView):
         
         try:
             with transaction.atomic():
-                variant = get_object_or_404(Variant, id=variant_id)
-                store = variant.product.store
+                variant = get_object_or_404(Variant.objects.select_related('product'), id=variant_id)
                 
                 # Get or create cart for the user/session
-                cart = Cart.objects.get_or_create_cart(request, store)
-                
-                # Get or create cart item
-                cart_item, created = CartItem.objects.get_or_create(
-                    cart=cart,
-                    variant=variant,
-                    defaults={
-                        'unit_price': variant.sale_price if variant.is_on_sale else variant.default_price,
-                        'quantity': 0
-                    }
-                )
-                
-                # Update quantity
-                if not created:
-                    cart_item.quantity += quantity
-                else:
-                    cart_item.quantity = quantity
-                cart_item.save()
+                cart = Cart.objects.get_or_create_cart(request)
+                cart.add_variant(variant, quantity)
                 
                 # Return updated cart
-                cart_serializer = CartSerializer(cart)
+                cart_data = serialize_cart(cart)
                 return Response({
                     'success': True,
                     'message': 'Item added to cart',
-                    'cart': cart_serializer.data,
-                    'item_count': cart.items.count()
+                    'cart': cart_data,
+                    'item_count': cart_data['item_count']
                 }, status=status.HTTP_200_OK)
                 
         except Exception as e:
@@ -79,27 +98,48 @@ class CartAPIView(APIView):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+    def patch(self, request):
+        """
+        Apply a batch of ``{variant_id, quantity, op}`` operations
+        (op: add, set or remove) in one transaction.
+        """
+        serializer = BatchCartSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            cart = Cart.objects.get_or_create_cart(request)
+            cart.apply_operations(
+                serializer.validated_data['operations'],
+                serializer.context['variants']
+            )
+            cart_data = serialize_cart(cart)
+            return Response({
+                'success': True,
+                'message': 'Cart updated',
+                'cart': cart_data,
+                'item_count': cart_data['item_count']
+            }, status=status.HTTP_200_OK)
+
+        except Exception as e:
+            return Response(
+                {'error': str(e)}, 
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+@method_decorator(idempotent('cart-api'), name='dispatch')
 class CartItemAPIView(APIView):
     permission_classes = [AllowAny]
     
     def get_cart_item(self, request, item_id):
         """Helper method to get cart item with proper permissions"""
-        if request.user.is_authenticated:
-            return get_object_or_404(
-                CartItem,
-                id=item_id,
-                cart__user=request.user,
-                cart__is_active=True
-            )
-        else:
-            if not request.session.session_key:
-                return None
-            return get_object_or_404(
-                CartItem,
-                id=item_id,
-                cart__session_key=request.session.session_key,
-                cart__is_active=True
-            )
+        cart = Cart.objects.get_cart(request)
+        if cart is None:
+            return None
+        cart_item = cart.get_item(item_id)
+        if cart_item is None:
+            raise Http404('No cart item matches the given query.')
+        return cart_item
             
     def delete(self, request, item_id):
         """Remove item from cart"""
@@ -145,12 +185,12 @@ class CartItemAPIView(APIView):
             cart_item.quantity = quantity
             cart_item.save()
             
-            cart_serializer = CartSerializer(cart_item.cart)
+            cart_data = serialize_cart(cart_item.cart)
             return Response({
                 'success': True,
                 'message': 'Cart updated',
-                'cart': cart_serializer.data,
-                'item_count': cart_item.cart.items.count()
+                'cart': cart_data,
+                'item_count': cart_data['item_count']
             })
             
         except Exception as e:
@@ -159,28 +199,14 @@ class CartItemAPIView(APIView):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+@method_decorator(idempotent('cart-api'), name='dispatch')
 class ClearCartAPIView(APIView):
     permission_classes = [AllowAny]
     
     def post(self, request):
         """Clear all items from cart"""
         try:
-            if request.user.is_authenticated:
-                cart = Cart.objects.filter(
-                    user=request.user, 
-                    is_active=True
-                ).first()
-            else:
-                if not request.session.session_key:
-                    return Response({
-                        'success': True,
-                        'message': 'No active cart',
-                        'item_count': 0
-                    })
-                cart = Cart.objects.filter(
-                    session_key=request.session.session_key,
-                    is_active=True
-                ).first()
+            cart = Cart.objects.get_cart(request)
             
             if not cart:
                 return Response({
@@ -190,7 +216,7 @@ class ClearCartAPIView(APIView):
                 })
                 
             item_count = cart.items.count()
-            cart.items.all().delete()
+            cart.clear()
             
             return Response({
                 'success': True,
@@ -6,4 +6,6 @@ class CartConfig(AppConfig):
     
     def ready(self):
         # This ensures the template tags are loaded
-        import cart.templatetags  # noqa
\ No newline at end of file
+        import cart.templatetags  # noqa
+        # Import signals to register them
+        import cart.signals  # noqa
\ No newline at end of file
@@ -0,0 +1,11 @@
+from django.utils.functional import SimpleLazyObject
+
+from .summary import get_cart_summary
+
+
+def cart_summary(request):
+    """
+    Expose the cached cart summary as ``cart_summary`` in every template.
+    Evaluated lazily, so pages that never render it pay nothing.
+    """
+    return {'cart_summary': SimpleLazyObject(lambda: get_cart_summary(request))}
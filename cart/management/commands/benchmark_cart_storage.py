@@ -0,0 +1,122 @@
+"""
+Compare how many rows each anonymous-cart storage mode writes.
+
+Simulates browse sessions against the real cart code path: every page view
+reads the header cart summary, and a fraction of sessions add an item. Each
+mode runs inside a transaction that is rolled back, so nothing is left
+behind in the database.
+
+Usage:
+    python manage.py benchmark_cart_storage --sessions 10000 --add-ratio 0.05
+"""
+import random
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from cart.models import Cart, CartItem
+from cart.summary import get_cart_summary
+from product.models import Variant
+
+WRITE_PREFIXES = ('INSERT', 'UPDATE', 'DELETE')
+
+
+class Command(BaseCommand):
+    help = 'Benchmark rows written per browse sessions for each anonymous cart storage mode'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sessions', type=int, default=10000,
+                            help='Number of simulated browse sessions per mode')
+        parser.add_argument('--pages', type=int, default=3,
+                            help='Page views per session')
+        parser.add_argument('--add-ratio', type=float, default=0.05,
+                            help='Fraction of sessions that add an item to the cart')
+        parser.add_argument('--modes', default='database,session,cache',
+                            help='Comma separated storage modes to compare')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        variants = list(Variant.objects.all()[:50])
+        if not variants:
+            raise CommandError('No variants found; run seed_data first.')
+
+        self.stdout.write(
+            f"{options['sessions']} sessions × {options['pages']} pages, "
+            f"{options['add_ratio']:.0%} add to cart\n"
+        )
+        self.stdout.write(
+            f"{'mode':<10}{'carts':>10}{'items':>10}{'sessions':>10}"
+            f"{'writes':>10}{'seconds':>10}"
+        )
+        for mode in options['modes'].split(','):
+            result = self.run_mode(mode.strip(), variants, options)
+            self.stdout.write(
+                f"{mode:<10}{result['carts']:>10}{result['items']:>10}"
+                f"{result['sessions']:>10}{result['writes']:>10}"
+                f"{result['seconds']:>10.2f}"
+            )
+
+    def run_mode(self, mode, variants, options):
+        rng = random.Random(options['seed'])
+        factory = RequestFactory()
+        session_table = self._session_table()
+
+        def page(request, add):
+            get_cart_summary(request)  # header badge on every page
+            if add:
+                cart = Cart.objects.get_or_create_cart(request)
+                cart.add_variant(rng.choice(variants), 1)
+            return HttpResponse()
+
+        with override_settings(CART_ANONYMOUS_STORAGE=mode), transaction.atomic():
+            before = self._counts(session_table)
+            started = time.perf_counter()
+            with CaptureQueriesContext(connection) as queries:
+                for _ in range(options['sessions']):
+                    adds_on = rng.randrange(options['pages']) if rng.random() < options['add_ratio'] else None
+                    cookie = None
+                    for page_no in range(options['pages']):
+                        request = factory.get('/')
+                        request.user = AnonymousUser()
+                        if cookie:
+                            request.COOKIES[settings.SESSION_COOKIE_NAME] = cookie
+                        response = SessionMiddleware(
+                            lambda r: page(r, page_no == adds_on)
+                        )(request)
+                        if settings.SESSION_COOKIE_NAME in response.cookies:
+                            cookie = response.cookies[settings.SESSION_COOKIE_NAME].value
+            seconds = time.perf_counter() - started
+            after = self._counts(session_table)
+            transaction.set_rollback(True)
+
+        writes = sum(
+            1 for query in queries.captured_queries
+            if query['sql'].lstrip().upper().startswith(WRITE_PREFIXES)
+        )
+        return {
+            'carts': after['carts'] - before['carts'],
+            'items': after['items'] - before['items'],
+            'sessions': after['sessions'] - before['sessions'],
+            'writes': writes,
+            'seconds': seconds,
+        }
+
+    def _session_table(self):
+        if settings.SESSION_ENGINE.endswith(('.db', '.cached_db')):
+            from django.contrib.sessions.models import Session
+            return Session
+        return None
+
+    def _counts(self, session_table):
+        return {
+            'carts': Cart.objects.count(),
+            'items': CartItem.objects.count(),
+            'sessions': session_table.objects.count() if session_table else 0,
+        }
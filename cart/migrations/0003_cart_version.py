@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-18 20:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0002_cart_cart_cart_updated_6737cf_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='version',
+            field=models.PositiveIntegerField(default=0, help_text='Bumped on every item change; backs the cart API ETag.'),
+        ),
+    ]
@@ -2,18 +2,97 @@ from django.db import models
 
 # Create your models here.
 
-from django.db import models
+from decimal import Decimal
+
+from django.db import IntegrityError, connections, models, transaction
+from django.db.models import F, Sum
 from django.conf import settings
+from django.utils import timezone
 from store.models import Store
-from product.models import Variant
+from product.models import Image, Variant
+from .summary import SESSION_KEY as CART_SESSION_KEY, invalidate_cart_summary, remember_cart
+
+
+def first_image_prefetch(lookup):
+    """
+    Prefetch only the first image of each product at ``lookup`` into
+    ``first_images``, using a sliced (window function) prefetch.
+    """
+    return models.Prefetch(
+        lookup,
+        queryset=Image.objects.order_by('pk')[:1],
+        to_attr='first_images'
+    )
+
+
+def cart_version_key(cart_id, version):
+    return f'{cart_id}.{version}'
+
+
+def bump_cart_version(*cart_ids):
+    """
+    Record that the items of these carts changed: bump ``version`` and
+    ``updated_at`` in one UPDATE and drop the cached summaries.
+    """
+    cart_ids = [cart_id for cart_id in cart_ids if cart_id]
+    if not cart_ids:
+        return
+    Cart.objects.filter(pk__in=cart_ids).update(
+        version=F('version') + 1, updated_at=timezone.now()
+    )
+    invalidate_cart_summary(*cart_ids)
+
+
+class CartQuerySet(models.QuerySet):
+    def for_api(self):
+        """
+        Carts with everything ``CartSerializer`` reads: item count and
+        subtotal annotations, plus items, variants, products, stores and the
+        first product image, so serializing costs a fixed number of queries
+        however many items the cart holds.
+        """
+        return self.annotate(
+            item_count=models.Count('items'),
+            subtotal=Sum(
+                F('items__unit_price') * F('items__quantity'),
+                output_field=models.DecimalField(max_digits=12, decimal_places=2)
+            ),
+        ).prefetch_related(
+            models.Prefetch(
+                'items',
+                queryset=CartItem.objects.select_related('variant__product__store')
+            ),
+            first_image_prefetch('items__variant__product__images'),
+        )
+
+    def delete(self):
+        cart_ids = list(self.values_list('id', flat=True))
+        result = super().delete()
+        invalidate_cart_summary(*cart_ids)
+        return result
 
 
-class CartManager(models.Manager):
+class CartManager(models.Manager.from_queryset(CartQuerySet)):
     def get_or_create_cart(self, request):
         """
         Get or create a cart for the current session/user.
         Now handles items from multiple stores in a single cart.
+
+        With ``CART_ANONYMOUS_STORAGE`` set to ``'session'`` or ``'cache'``,
+        anonymous visitors get a ``GuestCart`` that writes no rows; it is
+        turned into a real cart once the visitor authenticates.
         """
+        from .storage import get_guest_cart, materialize_guest_cart, uses_guest_storage
+
+        if not request.user.is_authenticated and uses_guest_storage():
+            return get_guest_cart(request)
+
+        if request.user.is_authenticated:
+            cart = materialize_guest_cart(request, request.user)
+            if cart is not None:
+                remember_cart(request, cart)
+                return cart
+
         if not request.session.session_key:
             request.session.save()
             
@@ -58,9 +137,232 @@ class CartManager(models.Manager):
                     is_active=True
                 )
         
+        remember_cart(request, cart)
+        return cart
+
+    def merge_session_cart(self, request, user):
+        """
+        On login, fold the anonymous database cart remembered in the session
+        into ``user``'s active cart (or hand it over if they have none).
+        The session key has already been rotated by then, so the cart is
+        found through the id ``remember_cart`` stored in the session.
+        Returns the user's cart, or None when there was no session cart.
+        """
+        remembered = request.session.get(CART_SESSION_KEY)
+        if not remembered or not remembered.get('id') or remembered.get('user') is not None:
+            return None
+        session_cart = self.filter(
+            pk=remembered['id'],
+            user__isnull=True,
+            is_active=True
+        ).first()
+        if session_cart is None:
+            return None
+
+        with transaction.atomic():
+            cart = self.select_for_update().filter(user=user, is_active=True).first()
+            if cart is None:
+                session_cart.user = user
+                session_cart.session_key = None
+                session_cart.save(update_fields=['user', 'session_key', 'updated_at'])
+                return session_cart
+            cart.merge_cart(session_cart)
         return cart
 
-class Cart(models.Model):
+    def get_cart(self, request):
+        """
+        Return the visitor's active cart without creating one, or None.
+        Never saves the session.
+        """
+        from .storage import get_guest_cart, uses_guest_storage
+
+        if request.user.is_authenticated:
+            return self.filter(user=request.user, is_active=True).first()
+        if uses_guest_storage():
+            return get_guest_cart(request)
+        if not request.session.session_key:
+            return None
+        return self.filter(
+            session_key=request.session.session_key,
+            is_active=True
+        ).first()
+
+    def get_version_key(self, request):
+        """
+        Return the ``version_key`` of the visitor's active cart, or None when
+        there is none. Costs one narrow query for database carts and none for
+        guest carts; never creates a cart or saves the session.
+        """
+        from .storage import get_guest_cart, uses_guest_storage
+
+        if request.user.is_authenticated:
+            carts = self.filter(user=request.user, is_active=True)
+        elif uses_guest_storage():
+            return get_guest_cart(request).version_key
+        elif not request.session.session_key:
+            return None
+        else:
+            carts = self.filter(session_key=request.session.session_key, is_active=True)
+        row = carts.values_list('pk', 'version').first()
+        return cart_version_key(*row) if row else None
+
+
+CART_OPERATIONS = ('add', 'set', 'remove')
+
+
+def resolve_cart_operations(quantities, operations):
+    """
+    Fold a list of ``{'variant_id', 'quantity', 'op'}`` operations into
+    ``quantities`` (variant id -> current quantity) and return the final
+    quantity per touched variant. ``add`` increments, ``set`` replaces and
+    ``remove`` drops the line; a final quantity of 0 means delete.
+    """
+    result = {}
+    for operation in operations:
+        variant_id = operation['variant_id']
+        current = result.get(variant_id, quantities.get(variant_id, 0))
+        if operation['op'] == 'add':
+            current += operation['quantity']
+        elif operation['op'] == 'set':
+            current = operation['quantity']
+        else:
+            current = 0
+        result[variant_id] = max(current, 0)
+    return result
+
+
+MERGE_BATCH_SIZE = 500
+
+
+def _cart_item_sql_names(connection):
+    """Quoted table name and column names of ``CartItem`` for raw upserts."""
+    meta = CartItem._meta
+    qn = connection.ops.quote_name
+    column = {name: qn(meta.get_field(name).column) for name in (
+        'id', 'cart', 'variant', 'quantity', 'unit_price', 'added_at', 'updated_at'
+    )}
+    return qn(meta.db_table), column
+
+
+def _cart_item_params(connection, values):
+    """Adapt ``(field name, value)`` pairs to database parameters."""
+    meta = CartItem._meta
+    return [
+        meta.get_field(name).get_db_prep_save(value, connection)
+        for name, value in values
+    ]
+
+
+def _merge_upsert_sql(table, column, source):
+    """
+    ``INSERT ... <source> ON CONFLICT`` that sums quantities and keeps the
+    newer price snapshot. ``source`` yields (cart, variant, quantity,
+    unit_price, added_at, updated_at) rows.
+    """
+    newer = f"EXCLUDED.{column['added_at']} > {table}.{column['added_at']}"
+    return (
+        f"INSERT INTO {table} ({column['cart']}, {column['variant']}, {column['quantity']}, "
+        f"{column['unit_price']}, {column['added_at']}, {column['updated_at']}) "
+        f"{source} "
+        f"ON CONFLICT ({column['cart']}, {column['variant']}) DO UPDATE SET "
+        f"{column['quantity']} = {table}.{column['quantity']} + EXCLUDED.{column['quantity']}, "
+        f"{column['unit_price']} = CASE WHEN {newer} "
+        f"THEN EXCLUDED.{column['unit_price']} ELSE {table}.{column['unit_price']} END, "
+        f"{column['added_at']} = CASE WHEN {newer} "
+        f"THEN EXCLUDED.{column['added_at']} ELSE {table}.{column['added_at']} END, "
+        f"{column['updated_at']} = EXCLUDED.{column['updated_at']}"
+    )
+
+
+class CartTotalsMixin:
+    """
+    Per-store totals shared by ``Cart`` and the row-less ``GuestCart``
+    (see cart/storage.py).
+    """
+    is_guest = False
+
+    def _loaded_items(self):
+        """Items already in memory, or None to aggregate in the database."""
+        return getattr(self, '_prefetched_objects_cache', {}).get('items')
+
+    def _aggregate_store_subtotals(self):
+        raise NotImplementedError
+
+    def get_store_totals(self):
+        """
+        Per-store breakdown of subtotal, tax, shipping and total, keyed by store id.
+
+        Uses the prefetched ``items__variant__product__store`` cache when the
+        cart was loaded with it, otherwise a single grouped aggregate plus one
+        store lookup, so the cost does not grow with the number of stores.
+        """
+        items = self._loaded_items()
+        subtotals = {}
+        if items is not None:
+            stores = {}
+            for item in items:
+                store = item.variant.product.store
+                stores[store.id] = store
+                subtotals[store.id] = subtotals.get(store.id, 0) + item.get_subtotal()
+        else:
+            subtotals, stores = self._aggregate_store_subtotals()
+
+        totals = {}
+        for store in sorted(stores.values(), key=lambda s: s.name):
+            subtotal = subtotals[store.id]
+            tax = self.calculate_tax(store, subtotal)
+            shipping = self.calculate_shipping(store)
+            totals[store.id] = {
+                'store': store,
+                'subtotal': subtotal,
+                'tax': tax,
+                'shipping': shipping,
+                'total': subtotal + tax + shipping,
+            }
+        return totals
+
+    def calculate_tax(self, store, subtotal):
+        """Tax owed on ``subtotal`` for items from ``store``"""
+        # return subtotal * (store.tax_rate / 100) if store.tax_rate else 0
+        return subtotal * 1
+
+    def calculate_shipping(self, store):
+        """Shipping cost charged by ``store``"""
+        # return store.shipping_cost or 0
+        return 0
+
+    def _totals_for_store(self, store):
+        return self.get_store_totals().get(store.id, {
+            'subtotal': 0, 'tax': 0, 'shipping': 0, 'total': 0,
+        })
+
+    def get_subtotal_for_store(self, store):
+        """Get subtotal for items from a specific store"""
+        return self._totals_for_store(store)['subtotal']
+
+    def get_tax_for_store(self, store):
+        """Calculate tax for items from a specific store"""
+        return self._totals_for_store(store)['tax']
+
+    def get_shipping_for_store(self, store):
+        """Get shipping cost for a specific store"""
+        return self._totals_for_store(store)['shipping']
+
+    def get_total_for_store(self, store):
+        """Get total for items from a specific store"""
+        return self._totals_for_store(store)['total']
+
+    def get_grand_total(self, store_totals=None):
+        """
+        Get grand total for all items in cart across all stores.
+        Pass a result of ``get_store_totals()`` to avoid recomputing it.
+        """
+        if store_totals is None:
+            store_totals = self.get_store_totals()
+        return sum(totals['total'] for totals in store_totals.values())
+
+
+class Cart(CartTotalsMixin, models.Model):
     """
     A shopping cart for a user or guest session, scoped to a specific store.
     """
@@ -84,7 +386,11 @@ class Cart(models.Model):
         default=True,
         help_text='If false, this cart is archived after checkout or cancellation.'
     )
-    
+    version = models.PositiveIntegerField(
+        default=0,
+        help_text='Bumped on every item change; backs the cart API ETag.'
+    )
+
     objects = CartManager()
 
     def __str__(self):
@@ -92,6 +398,26 @@ class Cart(models.Model):
             return f"Cart for {self.user.username} (ID: {self.id})"
         return f"Session cart {self.session_key} (ID: {self.id})"
 
+    def save(self, *args, **kwargs):
+        # ``version`` only moves in the database (bump_cart_version); keep
+        # full saves of an existing cart from writing back a stale value.
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'version'
+            ]
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        cart_id = self.pk
+        result = super().delete(*args, **kwargs)
+        invalidate_cart_summary(cart_id)
+        return result
+
+    @property
+    def version_key(self):
+        return cart_version_key(self.pk, self.version)
+
     def get_stores(self):
         """Get all unique stores in this cart"""
         store_ids = self.items.values_list('variant__product__store', flat=True).distinct()
@@ -106,38 +432,244 @@ class Cart(models.Model):
             store_items[item.variant.product.store].append(item)
         return dict(store_items)
 
-    def get_subtotal_for_store(self, store):
-        """Get subtotal for items from a specific store"""
-        return sum(
-            item.get_subtotal()
-            for item in self.items.filter(variant__product__store=store)
+    def _aggregate_store_subtotals(self):
+        rows = (
+            self.items.order_by()
+            .values('variant__product__store')
+            .annotate(subtotal=Sum(
+                F('unit_price') * F('quantity'),
+                output_field=models.DecimalField(max_digits=12, decimal_places=2)
+            ))
         )
+        subtotals = {
+            row['variant__product__store']: row['subtotal'] or 0
+            for row in rows
+        }
+        stores = Store.objects.in_bulk(list(subtotals)) if subtotals else {}
+        return subtotals, stores
 
-    def get_tax_for_store(self, store):
-        """Calculate tax for items from a specific store"""
-        subtotal = self.get_subtotal_for_store(store)
-        store.tax_rate = 0.5
-        # return subtotal * (store.tax_rate / 100) if store.tax_rate else 0
-        return subtotal * 1
+    def get_item(self, item_id):
+        """Return this cart's item with the given id, or None."""
+        return self.items.filter(id=item_id).first()
 
-    def get_shipping_for_store(self, store):
-        """Get shipping cost for a specific store"""
-        # return store.shipping_cost or 0
-        return 0
+    def add_variant(self, variant, quantity=1, unit_price=None):
+        """
+        Add ``quantity`` units of ``variant``, snapshotting its current price
+        (or ``unit_price``) when the line is new.
 
-    def get_total_for_store(self, store):
-        """Get total for items from a specific store"""
-        subtotal = self.get_subtotal_for_store(store)
-        tax = self.get_tax_for_store(store)
-        shipping = self.get_shipping_for_store(store)
-        return subtotal + tax + shipping
-
-    def get_grand_total(self):
-        """Get grand total for all items in cart across all stores"""
-        return sum(
-            self.get_total_for_store(store)
-            for store in self.get_stores()
+        Runs as one ``INSERT ... ON CONFLICT DO UPDATE`` on backends that
+        support it, otherwise as an ``F()`` increment with an insert fallback,
+        so concurrent adds to the same line never lose an increment or trip
+        the (cart, variant) unique constraint.
+        """
+        if unit_price is None:
+            unit_price = variant.price
+        features = connections[CartItem.objects.db].features
+        if features.supports_update_conflicts_with_target and features.can_return_columns_from_insert:
+            cart_item = self._upsert_item(variant, quantity, unit_price)
+        else:
+            cart_item = self._increment_item(variant, quantity, unit_price)
+        bump_cart_version(self.pk)
+        return cart_item
+
+    def _upsert_item(self, variant, quantity, unit_price):
+        connection = connections[CartItem.objects.db]
+        table, column = _cart_item_sql_names(connection)
+        now = timezone.now()
+        params = _cart_item_params(connection, (
+            ('cart', self.pk),
+            ('variant', variant.pk),
+            ('quantity', quantity),
+            ('unit_price', unit_price),
+            ('added_at', now),
+            ('updated_at', now),
+        ))
+        sql = (
+            f"INSERT INTO {table} ({column['cart']}, {column['variant']}, {column['quantity']}, "
+            f"{column['unit_price']}, {column['added_at']}, {column['updated_at']}) "
+            f"VALUES (%s, %s, %s, %s, %s, %s) "
+            f"ON CONFLICT ({column['cart']}, {column['variant']}) DO UPDATE SET "
+            f"{column['quantity']} = {table}.{column['quantity']} + EXCLUDED.{column['quantity']}, "
+            f"{column['updated_at']} = EXCLUDED.{column['updated_at']} "
+            f"RETURNING {column['id']}, {column['quantity']}, {column['unit_price']}"
         )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            item_id, new_quantity, snapshot_price = cursor.fetchone()
+
+        cart_item = CartItem(
+            id=item_id,
+            cart=self,
+            variant=variant,
+            quantity=new_quantity,
+            unit_price=Decimal(str(snapshot_price)),
+        )
+        cart_item._state.adding = False
+        cart_item._state.db = connection.alias
+        return cart_item
+
+    def _increment_item(self, variant, quantity, unit_price):
+        lookup = {'cart': self, 'variant': variant}
+        increment = {'quantity': F('quantity') + quantity, 'updated_at': timezone.now()}
+        if not CartItem.objects.filter(**lookup).update(**increment):
+            try:
+                with transaction.atomic():
+                    return CartItem.objects.create(
+                        quantity=quantity, unit_price=unit_price, **lookup
+                    )
+            except IntegrityError:
+                # Another request inserted the line first
+                CartItem.objects.filter(**lookup).update(**increment)
+        return CartItem.objects.get(**lookup)
+
+    def merge_cart(self, other):
+        """
+        Fold ``other``'s items into this cart, then empty and deactivate it.
+
+        Quantities of lines present in both carts are summed and the newer
+        price snapshot (later ``added_at``) wins. On backends with
+        ``ON CONFLICT`` this is one ``INSERT ... SELECT`` whatever the
+        number of items; otherwise one read plus a bulk_create/bulk_update.
+        """
+        connection = connections[CartItem.objects.db]
+        with transaction.atomic():
+            if connection.features.supports_update_conflicts_with_target:
+                table, column = _cart_item_sql_names(connection)
+                params = _cart_item_params(connection, (
+                    ('cart', self.pk),
+                    ('updated_at', timezone.now()),
+                    ('cart', other.pk),
+                ))
+                source = (
+                    f"SELECT %s, {column['variant']}, {column['quantity']}, {column['unit_price']}, "
+                    f"{column['added_at']}, %s FROM {table} WHERE {column['cart']} = %s"
+                )
+                with connection.cursor() as cursor:
+                    cursor.execute(_merge_upsert_sql(table, column, source), params)
+            else:
+                self._merge_lines_python([
+                    (item.variant_id, item.quantity, item.unit_price, item.added_at)
+                    for item in other.items.all()
+                ])
+            other.items.all().delete()
+            Cart.objects.filter(pk=other.pk).update(is_active=False, updated_at=timezone.now())
+            other.is_active = False
+        invalidate_cart_summary(other.pk)
+        bump_cart_version(self.pk)
+
+    def merge_lines(self, lines):
+        """
+        Fold ``(variant_id, quantity, unit_price, added_at)`` lines, e.g. from a
+        guest cart, into this cart with the same rules as ``merge_cart``: one
+        multi-row upsert per ``MERGE_BATCH_SIZE`` lines.
+        """
+        lines = list(lines)
+        if not lines:
+            return
+        connection = connections[CartItem.objects.db]
+        with transaction.atomic():
+            if connection.features.supports_update_conflicts_with_target:
+                table, column = _cart_item_sql_names(connection)
+                now = timezone.now()
+                for start in range(0, len(lines), MERGE_BATCH_SIZE):
+                    batch = lines[start:start + MERGE_BATCH_SIZE]
+                    params = []
+                    for variant_id, quantity, unit_price, added_at in batch:
+                        params.extend(_cart_item_params(connection, (
+                            ('cart', self.pk),
+                            ('variant', variant_id),
+                            ('quantity', quantity),
+                            ('unit_price', unit_price),
+                            ('added_at', added_at),
+                            ('updated_at', now),
+                        )))
+                    source = 'VALUES ' + ', '.join(['(%s, %s, %s, %s, %s, %s)'] * len(batch))
+                    with connection.cursor() as cursor:
+                        cursor.execute(_merge_upsert_sql(table, column, source), params)
+            else:
+                self._merge_lines_python(lines)
+        bump_cart_version(self.pk)
+
+    def _merge_lines_python(self, lines):
+        existing = {
+            item.variant_id: item
+            for item in self.items.select_for_update().filter(
+                variant_id__in=[line[0] for line in lines]
+            )
+        }
+        now = timezone.now()
+        to_create, to_update = [], []
+        for variant_id, quantity, unit_price, added_at in lines:
+            item = existing.get(variant_id)
+            if item is None:
+                to_create.append(CartItem(
+                    cart=self, variant_id=variant_id, quantity=quantity,
+                    unit_price=unit_price, added_at=added_at, updated_at=now,
+                ))
+                continue
+            item.quantity += quantity
+            if added_at > item.added_at:
+                item.unit_price = unit_price
+                item.added_at = added_at
+            item.updated_at = now
+            to_update.append(item)
+        if to_create:
+            CartItem.objects.bulk_create(to_create)
+        if to_update:
+            CartItem.objects.bulk_update(
+                to_update, ['quantity', 'unit_price', 'added_at', 'updated_at']
+            )
+
+    def clear(self):
+        """Remove every item from the cart."""
+        self.items.all().delete()
+
+    def apply_operations(self, operations, variants):
+        """
+        Apply a batch of cart operations in one transaction: one read of the
+        touched lines, then at most one bulk_create, one bulk_update and one
+        delete. ``variants`` maps variant id to an already-fetched Variant.
+        """
+        variant_ids = {operation['variant_id'] for operation in operations}
+        now = timezone.now()
+        with transaction.atomic():
+            existing = {
+                item.variant_id: item
+                for item in self.items.select_for_update().filter(variant_id__in=variant_ids)
+            }
+            final = resolve_cart_operations(
+                {vid: item.quantity for vid, item in existing.items()},
+                operations
+            )
+
+            to_create, to_update, to_delete = [], [], []
+            for variant_id, quantity in final.items():
+                item = existing.get(variant_id)
+                if quantity == 0:
+                    if item is not None:
+                        to_delete.append(item.id)
+                elif item is None:
+                    variant = variants[variant_id]
+                    to_create.append(CartItem(
+                        cart=self,
+                        variant=variant,
+                        quantity=quantity,
+                        unit_price=variant.price,
+                    ))
+                elif item.quantity != quantity:
+                    item.quantity = quantity
+                    item.updated_at = now
+                    to_update.append(item)
+
+            if to_create:
+                CartItem.objects.bulk_create(to_create)
+            if to_update:
+                CartItem.objects.bulk_update(to_update, ['quantity', 'updated_at'])
+            if to_delete:
+                # The queryset delete bumps the version itself
+                CartItem.objects.filter(id__in=to_delete).delete()
+            else:
+                bump_cart_version(self.pk)
 
     @property
     def total_items(self):
@@ -148,9 +680,18 @@ class Cart(models.Model):
         indexes = [
             models.Index(fields=['user', 'session_key', 'is_active']),
             models.Index(fields=['is_active']),
+            models.Index(fields=['updated_at', 'id']),
         ]
 
 
+class CartItemQuerySet(models.QuerySet):
+    def delete(self):
+        cart_ids = set(self.values_list('cart_id', flat=True))
+        result = super().delete()
+        bump_cart_version(*cart_ids)
+        return result
+
+
 class CartItem(models.Model):
     """
     An item in a shopping cart, linking a Variant with quantity and snapshot of price.
@@ -177,6 +718,8 @@ class CartItem(models.Model):
     added_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = CartItemQuerySet.as_manager()
+
     class Meta:
         unique_together = ('cart', 'variant')
         ordering = ['-added_at']
@@ -184,6 +727,16 @@ class CartItem(models.Model):
     def __str__(self):
         return f"{self.quantity} × {self.variant} in cart {self.cart.pk}"
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        bump_cart_version(self.cart_id)
+
+    def delete(self, *args, **kwargs):
+        cart_id = self.cart_id
+        result = super().delete(*args, **kwargs)
+        bump_cart_version(cart_id)
+        return result
+
     def get_subtotal(self):
         """
         Returns price × quantity for this item.
@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import Cart, CartItem
+from .models import Cart, CartItem, CART_OPERATIONS
 from product.models import Variant
 
 class CartItemSerializer(serializers.ModelSerializer):
@@ -11,7 +11,9 @@ class CartItemSerializer(serializers.ModelSerializer):
     name = serializers.CharField(source='variant.product.name', read_only=True)
     variant_name = serializers.CharField(source='variant.name', read_only=True)
     unit_price = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
-    subtotal = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
+    subtotal = serializers.DecimalField(
+        max_digits=10, decimal_places=2, source='get_subtotal', read_only=True
+    )
     image = serializers.SerializerMethodField()
 
     class Meta:
@@ -23,19 +25,35 @@ class CartItemSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'name', 'variant_name', 'unit_price', 'subtotal', 'image']
 
     def get_image(self, obj):
-        if obj.variant.product.images.exists():
-            return obj.variant.product.images.first().image.url
-        return None
+        # Reads the first_image_prefetch() cache set up by Cart.objects.for_api()
+        images = getattr(obj.variant.product, 'first_images', None)
+        if images is None:
+            image = obj.variant.product.images.order_by('pk').first()
+        else:
+            image = images[0] if images else None
+        return image.image.url if image else None
 
 class CartSerializer(serializers.ModelSerializer):
+    """
+    Expects a cart from ``Cart.objects.for_api()`` (or a guest cart); totals
+    are then computed from the prefetched items without further queries.
+    """
     items = CartItemSerializer(many=True, read_only=True)
-    total = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
-    item_count = serializers.IntegerField(read_only=True)
+    total = serializers.DecimalField(
+        max_digits=12, decimal_places=2, source='get_grand_total', read_only=True
+    )
+    item_count = serializers.SerializerMethodField()
 
     class Meta:
         model = Cart
-        fields = ['id', 'created_at', 'items', 'total', 'item_count']
-        read_only_fields = ['id', 'created_at', 'items', 'total', 'item_count']
+        fields = ['id', 'created_at', 'version', 'items', 'total', 'item_count']
+        read_only_fields = ['id', 'created_at', 'version', 'items', 'total', 'item_count']
+
+    def get_item_count(self, obj):
+        item_count = getattr(obj, 'item_count', None)
+        if item_count is None:
+            item_count = len(obj.items.all())
+        return item_count
 
 class AddToCartSerializer(serializers.Serializer):
     variant_id = serializers.IntegerField(required=True)
@@ -45,3 +63,25 @@ class AddToCartSerializer(serializers.Serializer):
         if not Variant.objects.filter(id=value).exists():
             raise serializers.ValidationError("Invalid variant ID")
         return value
+
+
+class CartOperationSerializer(serializers.Serializer):
+    variant_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(default=1, min_value=0)
+    op = serializers.ChoiceField(choices=CART_OPERATIONS, default='add')
+
+
+class BatchCartSerializer(serializers.Serializer):
+    operations = CartOperationSerializer(many=True, allow_empty=False)
+
+    def validate_operations(self, operations):
+        """Resolve every referenced variant with a single query."""
+        variant_ids = {operation['variant_id'] for operation in operations}
+        variants = Variant.objects.select_related('product__store').in_bulk(variant_ids)
+        missing = sorted(variant_ids - set(variants))
+        if missing:
+            raise serializers.ValidationError(
+                f"Invalid variant ID(s): {', '.join(map(str, missing))}"
+            )
+        self.context['variants'] = variants
+        return operations
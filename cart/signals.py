@@ -0,0 +1,21 @@
+from django.contrib.auth.signals import user_logged_in
+from django.dispatch import receiver
+
+from .models import Cart
+from .storage import materialize_guest_cart
+from .summary import remember_cart
+
+
+@receiver(user_logged_in)
+def merge_cart_on_login(sender, request, user, **kwargs):
+    """
+    Fold the visitor's anonymous cart into their user cart on login: the
+    row-less guest cart, or the session ``Cart`` row in database mode.
+    """
+    if request is None:
+        return
+    cart = materialize_guest_cart(request, user)
+    if cart is None:
+        cart = Cart.objects.merge_session_cart(request, user)
+    if cart is not None:
+        remember_cart(request, cart)
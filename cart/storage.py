@@ -0,0 +1,371 @@
+"""
+Row-less storage for anonymous carts.
+
+``CART_ANONYMOUS_STORAGE`` picks where guest carts live:
+
+* ``'database'`` - a ``Cart`` row per session (the original behaviour).
+* ``'session'``  - inside the session data itself (pairs well with the
+  signed-cookie session engine).
+* ``'cache'``    - in the configured cache, keyed by a random token kept in
+  the session so it survives the session-key rotation on login.
+
+Guest carts expose the same surface the views and templates use on
+``Cart``/``CartItem`` and are written to the database only when the visitor
+logs in (``cart.signals``) or reaches checkout (``get_or_create_cart``).
+"""
+import secrets
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from product.models import Variant
+from .models import Cart, CartTotalsMixin, first_image_prefetch, resolve_cart_operations
+
+GUEST_CART_SESSION_KEY = '_guest_cart'
+GUEST_CART_TOKEN_SESSION_KEY = '_guest_cart_token'
+
+
+def anonymous_storage():
+    return getattr(settings, 'CART_ANONYMOUS_STORAGE', 'database')
+
+
+def uses_guest_storage():
+    return anonymous_storage() in BACKENDS
+
+
+class SessionCartBackend:
+    """Keeps the guest cart inside ``request.session``."""
+
+    def __init__(self, request):
+        self.request = request
+
+    def load(self):
+        return self.request.session.get(GUEST_CART_SESSION_KEY)
+
+    def save(self, data):
+        self.request.session[GUEST_CART_SESSION_KEY] = data
+
+    def delete(self):
+        self.request.session.pop(GUEST_CART_SESSION_KEY, None)
+
+
+class CacheCartBackend:
+    """Keeps the guest cart in the cache under a token stored in the session."""
+
+    def __init__(self, request):
+        self.request = request
+
+    @property
+    def timeout(self):
+        return getattr(settings, 'CART_GUEST_CACHE_TIMEOUT', settings.SESSION_COOKIE_AGE)
+
+    def _key(self, token):
+        return f'cart:guest:{token}'
+
+    def load(self):
+        token = self.request.session.get(GUEST_CART_TOKEN_SESSION_KEY)
+        return cache.get(self._key(token)) if token else None
+
+    def save(self, data):
+        token = self.request.session.get(GUEST_CART_TOKEN_SESSION_KEY)
+        if not token:
+            token = secrets.token_urlsafe(24)
+            self.request.session[GUEST_CART_TOKEN_SESSION_KEY] = token
+        cache.set(self._key(token), data, self.timeout)
+
+    def delete(self):
+        token = self.request.session.pop(GUEST_CART_TOKEN_SESSION_KEY, None)
+        if token:
+            cache.delete(self._key(token))
+
+
+BACKENDS = {
+    'session': SessionCartBackend,
+    'cache': CacheCartBackend,
+}
+
+
+class GuestCartItem:
+    """In-memory stand-in for ``CartItem``; its id is the variant id."""
+
+    def __init__(self, cart, variant_id, quantity, unit_price, added_at=None):
+        self.cart = cart
+        self.variant_id = variant_id
+        self.quantity = quantity
+        self.unit_price = unit_price
+        self.added_at = added_at or timezone.now()
+
+    def __str__(self):
+        return f"{self.quantity} × {self.variant} in guest cart"
+
+    @property
+    def id(self):
+        return self.variant_id
+
+    pk = id
+
+    @property
+    def variant(self):
+        return self.cart._get_variants()[self.variant_id]
+
+    def get_subtotal(self):
+        if self.unit_price is None or self.quantity is None:
+            return 0
+        return self.unit_price * self.quantity
+
+    def save(self, *args, **kwargs):
+        self.cart._items[self.variant_id] = self
+        self.cart.save()
+
+    def delete(self, *args, **kwargs):
+        self.cart._items.pop(self.variant_id, None)
+        self.cart.save()
+
+
+class GuestCartItems:
+    """The slice of the ``cart.items`` related-manager API guest carts need."""
+
+    def __init__(self, cart):
+        self.cart = cart
+
+    def all(self):
+        return self
+
+    def select_related(self, *fields):
+        return self
+
+    def prefetch_related(self, *lookups):
+        return self
+
+    def count(self):
+        return len(self.cart._items)
+
+    def exists(self):
+        return bool(self.cart._items)
+
+    def delete(self):
+        self.cart.clear()
+
+    def __iter__(self):
+        self.cart._get_variants()
+        items = sorted(self.cart._items.values(), key=lambda i: i.added_at, reverse=True)
+        return iter(items)
+
+    def __len__(self):
+        return self.count()
+
+    def __bool__(self):
+        return self.exists()
+
+
+class GuestCart(CartTotalsMixin):
+    """
+    A cart for an anonymous visitor that lives in the session or cache.
+    ``id`` is None until ``materialize`` turns it into a ``Cart`` row.
+    """
+    is_guest = True
+    id = pk = None
+    user = None
+    user_id = None
+    is_active = True
+
+    def __init__(self, request, backend):
+        self.request = request
+        self.backend = backend
+        self._variants = {}
+        data = backend.load() or {}
+        self.created_at = parse_datetime(data['created_at']) if data.get('created_at') else timezone.now()
+        self.updated_at = self.created_at
+        self.version = data.get('version', 0)
+        self._summary = data.get('summary')
+        self._items = {}
+        for row in data.get('items', []):
+            item = GuestCartItem(
+                self,
+                row['variant_id'],
+                row['quantity'],
+                Decimal(row['unit_price']),
+                parse_datetime(row['added_at']),
+            )
+            self._items[item.variant_id] = item
+
+    def __str__(self):
+        return f"Guest cart ({len(self._items)} items)"
+
+    @property
+    def session_key(self):
+        return self.request.session.session_key
+
+    @property
+    def items(self):
+        return GuestCartItems(self)
+
+    @property
+    def version_key(self):
+        # An emptied guest cart drops its storage, so all empty carts share a key
+        if not self._items:
+            return 'guest.empty'
+        return f'guest.{self.created_at.timestamp():.6f}.{self.version}'
+
+    @property
+    def total_items(self):
+        return len(self._items)
+
+    @property
+    def item_count(self):
+        return len(self._items)
+
+    def _get_variants(self):
+        missing = [vid for vid in self._items if vid not in self._variants]
+        if missing:
+            self._variants.update(
+                Variant.objects.select_related('product__store')
+                .prefetch_related(first_image_prefetch('product__images'))
+                .in_bulk(missing)
+            )
+            # Drop lines whose variant has since been deleted
+            for vid in missing:
+                if vid not in self._variants:
+                    self._items.pop(vid, None)
+        return self._variants
+
+    def _loaded_items(self):
+        return list(self.items)
+
+    def get_stores(self):
+        stores = {item.variant.product.store for item in self.items}
+        return sorted(stores, key=lambda s: s.name)
+
+    def get_items_by_store(self):
+        store_items = {}
+        for item in self.items:
+            store_items.setdefault(item.variant.product.store, []).append(item)
+        return store_items
+
+    def get_item(self, item_id):
+        try:
+            return self._items.get(int(item_id))
+        except (TypeError, ValueError):
+            return None
+
+    def add_variant(self, variant, quantity=1, unit_price=None):
+        item = self._items.get(variant.id)
+        if item is None:
+            item = GuestCartItem(
+                self,
+                variant.id,
+                0,
+                variant.price if unit_price is None else unit_price,
+            )
+            self._items[variant.id] = item
+        self._variants[variant.id] = variant
+        item.quantity += quantity
+        self.save()
+        return item
+
+    def clear(self):
+        self._items = {}
+        self.save()
+
+    def apply_operations(self, operations, variants):
+        final = resolve_cart_operations(
+            {vid: item.quantity for vid, item in self._items.items()},
+            operations
+        )
+        for variant_id, quantity in final.items():
+            if quantity == 0:
+                self._items.pop(variant_id, None)
+                continue
+            item = self._items.get(variant_id)
+            if item is None:
+                variant = variants[variant_id]
+                self._variants[variant_id] = variant
+                item = self._items[variant_id] = GuestCartItem(
+                    self, variant_id, 0, variant.price
+                )
+            item.quantity = quantity
+        self.save()
+
+    def get_summary(self):
+        if self._summary is None:
+            self._summary = self._build_summary()
+        return {
+            'item_count': self._summary['item_count'],
+            'grand_total': Decimal(self._summary['grand_total']),
+        }
+
+    def _build_summary(self):
+        return {
+            'item_count': len(self._items),
+            'grand_total': str(self.get_grand_total()),
+        }
+
+    def save(self, *args, **kwargs):
+        """Persist to the backend, refreshing the stored summary."""
+        if not self._items:
+            self.backend.delete()
+            self._summary = None
+            return
+        self.updated_at = timezone.now()
+        self.version += 1
+        self._summary = self._build_summary()
+        self.backend.save({
+            'created_at': self.created_at.isoformat(),
+            'version': self.version,
+            'summary': self._summary,
+            'items': [
+                {
+                    'variant_id': item.variant_id,
+                    'quantity': item.quantity,
+                    'unit_price': str(item.unit_price),
+                    'added_at': item.added_at.isoformat(),
+                }
+                for item in self._items.values()
+            ],
+        })
+
+    def discard(self):
+        self._items = {}
+        self._summary = None
+        self.backend.delete()
+
+    def materialize(self, user):
+        """
+        Write this guest cart into ``user``'s active ``Cart`` (creating it if
+        needed), empty the guest storage and return the cart.
+        """
+        with transaction.atomic():
+            cart = Cart.objects.filter(user=user, is_active=True).first()
+            if cart is None:
+                cart = Cart.objects.create(user=user, is_active=True)
+            cart.merge_lines(
+                (item.variant_id, item.quantity, item.unit_price, item.added_at)
+                for item in self.items
+            )
+        self.discard()
+        return cart
+
+
+def get_guest_cart(request):
+    return GuestCart(request, BACKENDS[anonymous_storage()](request))
+
+
+def materialize_guest_cart(request, user):
+    """
+    Move any guest cart held for this request into ``user``'s database cart.
+    Returns the cart, or None when there was nothing to move.
+    """
+    if not uses_guest_storage():
+        return None
+    backend = BACKENDS[anonymous_storage()](request)
+    if not backend.load():
+        return None
+    guest_cart = GuestCart(request, backend)
+    if not guest_cart.items.exists():
+        guest_cart.discard()
+        return None
+    return guest_cart.materialize(user)
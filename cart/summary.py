@@ -0,0 +1,104 @@
+"""
+Cached cart summary (item count and grand total).
+
+The header badge, the add-to-cart AJAX response and the ``cart_summary``
+context processor read from here instead of the database. Entries are keyed
+by cart id; the session remembers which cart belongs to the visitor so a
+cache hit needs no query at all. ``Cart``/``CartItem`` writes drop the entry
+through ``invalidate_cart_summary``.
+"""
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+
+SESSION_KEY = '_cart'
+CACHE_TIMEOUT = getattr(settings, 'CART_SUMMARY_CACHE_TIMEOUT', 60 * 60)
+
+
+def empty_summary():
+    return {'item_count': 0, 'grand_total': Decimal('0.00')}
+
+
+def summary_cache_key(cart_id):
+    return f'cart:summary:{cart_id}'
+
+
+def invalidate_cart_summary(*cart_ids):
+    """Drop the cached summary for the given carts."""
+    keys = [summary_cache_key(cart_id) for cart_id in cart_ids if cart_id]
+    if keys:
+        cache.delete_many(keys)
+
+
+def _request_user_id(request):
+    return request.user.pk if request.user.is_authenticated else None
+
+
+def remember_cart(request, cart):
+    """
+    Record which cart belongs to this session/user. Pass ``None`` to record
+    that the visitor has no cart yet.
+    """
+    value = {
+        'id': cart.pk if cart else None,
+        'user': cart.user_id if cart else _request_user_id(request),
+    }
+    if request.session.get(SESSION_KEY) != value:
+        request.session[SESSION_KEY] = value
+
+
+def build_cart_summary(cart):
+    return {
+        'item_count': cart.items.count(),
+        'grand_total': cart.get_grand_total(),
+    }
+
+
+def get_cart_summary(request, cart=None):
+    """
+    Return ``{'item_count', 'grand_total'}`` for the visitor's cart.
+
+    On a cache hit this touches neither the database nor the session store
+    beyond the already-loaded session. A miss recomputes from the cart and
+    writes the result back. Guest carts (cart/storage.py) carry their own
+    summary and never hit the database.
+    """
+    from .models import Cart
+    from .storage import get_guest_cart, uses_guest_storage
+
+    if cart is None and not request.user.is_authenticated and uses_guest_storage():
+        cart = get_guest_cart(request)
+    if cart is not None and cart.is_guest:
+        return cart.get_summary()
+
+    if cart is None:
+        remembered = request.session.get(SESSION_KEY)
+        if remembered and remembered.get('user') == _request_user_id(request):
+            cart_id = remembered['id']
+        elif not request.user.is_authenticated and not request.session.session_key:
+            return empty_summary()
+        else:
+            found = Cart.objects.get_cart(request)
+            remember_cart(request, found)
+            cart_id = found.pk if found else None
+            cart = found
+        if cart_id is None:
+            return empty_summary()
+    else:
+        cart_id = cart.pk
+
+    key = summary_cache_key(cart_id)
+    summary = cache.get(key)
+    if summary is not None:
+        return summary
+
+    if cart is None:
+        cart = Cart.objects.filter(pk=cart_id, is_active=True).first()
+        if cart is None:
+            remember_cart(request, None)
+            return empty_summary()
+
+    summary = build_cart_summary(cart)
+    cache.set(key, summary, CACHE_TIMEOUT)
+    return summary
@@ -1,3 +1,249 @@
-from django.test import TestCase
+import threading
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import DatabaseError, connection
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from product.models import Image, Product, Variant
+from store.models import Store
+from .models import Cart, CartItem
+
+User = get_user_model()
+
+
+def run_threads(count, target):
+    """Run ``target()`` in ``count`` threads started together; returns their exceptions."""
+    barrier = threading.Barrier(count)
+    errors = []
+
+    def work():
+        try:
+            barrier.wait()
+            target()
+        except Exception as e:
+            errors.append(e)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=work) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return errors
+
+
+class ConcurrentCartLineTests(TransactionTestCase):
+    THREADS = 8
+    ADDS_PER_THREAD = 5
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('needs a test database file on SQLite (set DB_TEST_NAME)')
+        cache.clear()
+        owner = User.objects.create_user('owner', 'owner@example.com', 'pw')
+        store = Store.objects.create(name='Shop', tagline='t', owner=owner)
+        product = Product.objects.create(store=store, name='Tee', slug='tee')
+        self.variant = Variant.objects.create(product=product, name='M', sku='TEE-M', default_price='10.00', stock=100)
+        self.cart = Cart.objects.create(user=owner)
+
+    def test_concurrent_add_variant_keeps_one_line_with_every_unit(self):
+        def add():
+            cart = Cart.objects.get(pk=self.cart.pk)
+            variant = Variant.objects.get(pk=self.variant.pk)
+            for _ in range(self.ADDS_PER_THREAD):
+                cart.add_variant(variant, 2)
+
+        errors = run_threads(self.THREADS, add)
+
+        self.assertEqual(errors, [])
+        item = CartItem.objects.get(cart=self.cart, variant=self.variant)
+        self.assertEqual(item.quantity, self.THREADS * self.ADDS_PER_THREAD * 2)
+        self.assertEqual(item.unit_price, Decimal('10.00'))
+
+    def test_concurrent_merge_lines_keeps_one_line_with_every_unit(self):
+        def merge():
+            cart = Cart.objects.get(pk=self.cart.pk)
+            for _ in range(self.ADDS_PER_THREAD):
+                cart.merge_lines([(self.variant.pk, 3, Decimal('10.00'), timezone.now())])
+
+        errors = run_threads(self.THREADS, merge)
+
+        self.assertEqual(errors, [])
+        item = CartItem.objects.get(cart=self.cart, variant=self.variant)
+        self.assertEqual(item.quantity, self.THREADS * self.ADDS_PER_THREAD * 3)
+
+
+class CartAPIQueryCountTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('buyer', 'buyer@example.com', 'pw')
+        owner = User.objects.create_user('owner', 'owner@example.com', 'pw')
+        stores = [Store.objects.create(name=f'Shop {n}', tagline='t', owner=owner) for n in range(5)]
+        # Items from several stores, each product with an image
+        self.variants = []
+        for n in range(50):
+            product = Product.objects.create(store=stores[n % len(stores)], name=f'P{n}', slug=f'p-{n}')
+            Image.objects.create(product=product, image=f'product_images/p-{n}.jpg')
+            self.variants.append(Variant.objects.create(
+                product=product, name='M', sku=f'P-{n}', default_price='10.00', stock=10,
+            ))
+        self.client.force_login(self.user)
+        self.url = reverse('cart:api_cart')
+
+    def make_cart(self, items):
+        cart = Cart.objects.create(user=self.user)
+        for variant in self.variants[:items]:
+            cart.add_variant(variant, 2)
+        return cart
+
+    def get_cart(self):
+        # session, user, version key, cart, cart for the API, items with
+        # variant/product/store, first images, session save (savepoint,
+        # update, release)
+        with self.assertNumQueries(10):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_query_count_does_not_grow_with_items(self):
+        cart = self.make_cart(1)
+        self.assertEqual(len(self.get_cart()['items']), 1)
+
+        cart.delete()
+        self.make_cart(50)
+        self.assertEqual(len(self.get_cart()['items']), 50)
+
+
+class CartBatchAPITests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('buyer', 'buyer@example.com', 'pw')
+        owner = User.objects.create_user('owner', 'owner@example.com', 'pw')
+        store = Store.objects.create(name='Shop', tagline='t', owner=owner)
+        product = Product.objects.create(store=store, name='Tee', slug='tee')
+        self.small, self.medium, self.large, self.extra = [
+            Variant.objects.create(product=product, name=name, sku=f'TEE-{name}', default_price='10.00', stock=10)
+            for name in ('S', 'M', 'L', 'XL')
+        ]
+        self.cart = Cart.objects.create(user=self.user)
+        self.cart.add_variant(self.small, 1)
+        self.cart.add_variant(self.medium, 2)
+        self.cart.add_variant(self.large, 3)
+        self.client.force_login(self.user)
+        self.url = reverse('cart:api_cart')
+
+    def patch(self, operations):
+        return self.client.patch(self.url, {'operations': operations}, content_type='application/json')
+
+    def quantities(self):
+        return dict(self.cart.items.values_list('variant_id', 'quantity'))
+
+    def test_mixed_batch_applies_every_operation(self):
+        response = self.patch([
+            {'variant_id': self.small.pk, 'quantity': 2},
+            {'variant_id': self.medium.pk, 'quantity': 5, 'op': 'set'},
+            {'variant_id': self.large.pk, 'op': 'remove'},
+            {'variant_id': self.extra.pk, 'quantity': 1, 'op': 'add'},
+            {'variant_id': self.extra.pk, 'quantity': 1, 'op': 'add'},
+        ])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['item_count'], 3)
+        self.assertEqual(self.quantities(), {self.small.pk: 3, self.medium.pk: 5, self.extra.pk: 2})
+
+    def test_failure_part_way_leaves_the_cart_untouched(self):
+        before = self.quantities()
+        with mock.patch.object(CartItem.objects, 'bulk_update', side_effect=DatabaseError('boom')):
+            response = self.patch([
+                {'variant_id': self.extra.pk, 'quantity': 1},
+                {'variant_id': self.medium.pk, 'quantity': 5, 'op': 'set'},
+                {'variant_id': self.large.pk, 'op': 'remove'},
+            ])
+
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(self.quantities(), before)
+
+    def test_invalid_operation_rejects_the_whole_batch(self):
+        before = self.quantities()
+        for operation in (
+            {'variant_id': self.medium.pk, 'op': 'double'},
+            {'variant_id': self.medium.pk, 'quantity': -1, 'op': 'set'},
+            {'variant_id': 0, 'quantity': 1},
+        ):
+            with self.subTest(operation=operation):
+                response = self.patch([{'variant_id': self.small.pk, 'quantity': 4, 'op': 'set'}, operation])
+
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('operations', response.json())
+                self.assertEqual(self.quantities(), before)
+
+    def test_empty_batch_is_rejected(self):
+        self.assertEqual(self.patch([]).status_code, 400)
+
+
+class CartETagTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('buyer', 'buyer@example.com', 'pw')
+        owner = User.objects.create_user('owner', 'owner@example.com', 'pw')
+        store = Store.objects.create(name='Shop', tagline='t', owner=owner)
+        product = Product.objects.create(store=store, name='Tee', slug='tee')
+        self.variant = Variant.objects.create(product=product, name='M', sku='TEE-M', default_price='10.00', stock=10)
+        self.cart = Cart.objects.create(user=self.user)
+        self.cart.add_variant(self.variant, 1)
+        self.client.force_login(self.user)
+        self.url = reverse('cart:api_cart')
+
+    def get(self, etag=None):
+        headers = {'If-None-Match': etag} if etag else {}
+        return self.client.get(self.url, headers=headers)
+
+    def test_matching_etag_gets_304_without_loading_the_cart(self):
+        etag = self.get()['ETag']
+
+        # session, user, version key
+        with self.assertNumQueries(3):
+            response = self.get(etag)
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['ETag'], etag)
+        self.assertIn('no-cache', response['Cache-Control'])
+
+    def test_etag_matching_is_weak_and_accepts_lists(self):
+        etag = self.get()['ETag']
+
+        self.assertEqual(self.get(etag.removeprefix('W/')).status_code, 304)
+        self.assertEqual(self.get(f'"other", {etag}').status_code, 304)
+        self.assertEqual(self.get('"other"').status_code, 200)
+
+    def test_mutation_bumps_the_version_and_the_etag(self):
+        first = self.get()
+        etag = first['ETag']
+
+        response = self.client.patch(
+            self.url,
+            {'operations': [{'variant_id': self.variant.pk, 'quantity': 2, 'op': 'set'}]},
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200)
+
+        response = self.get(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['version'], first.json()['version'] + 1)
+        self.assertEqual(self.get(response['ETag']).status_code, 304)
+
+    def test_item_change_outside_the_api_changes_the_etag(self):
+        etag = self.get()['ETag']
+        self.cart.items.get().delete()
+
+        response = self.get(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['items'], [])
@@ -1,5 +1,5 @@
 from django.shortcuts import get_object_or_404, redirect, render
-from django.http import JsonResponse, HttpResponseRedirect
+from django.http import Http404, JsonResponse, HttpResponseRedirect
 from django.views.decorators.http import require_POST, require_http_methods
 from django.contrib import messages
 from django.views.generic import View
@@ -10,41 +10,30 @@ from django.conf import settings
 from product.models import Variant, Image as ProductImage
 from store.models import Store
 from .models import Cart, CartItem
+from .storage import uses_guest_storage
+from .summary import get_cart_summary
 
 @require_POST
 def add_to_cart(request, variant_id):
     try:
-        variant = get_object_or_404(Variant, id=variant_id)
-        store = variant.product.store
+        variant = get_object_or_404(Variant.objects.select_related('product'), id=variant_id)
         quantity = int(request.POST.get('quantity', 1))
         
         # Get or create cart for the user/session
         cart = Cart.objects.get_or_create_cart(request)
         
-        # Get or create cart item
-        cart_item, created = CartItem.objects.get_or_create(
-            cart=cart,
-            variant=variant,
-            defaults={
-                'unit_price': variant.sale_price if variant.is_on_sale else variant.default_price,
-                'quantity': 0
-            }
-        )
-        
-        # Update quantity
-        cart_item.quantity += quantity
-        cart_item.save()
-        
-        # Update cart timestamp
-        cart.save()
+        # Single-statement, race-free add
+        cart.add_variant(variant, quantity)
         
         is_ajax = request.headers.get('X-Requested-With') == 'XMLHttpRequest'
         
         if is_ajax:
+            summary = get_cart_summary(request, cart)
             return JsonResponse({
                 'success': True,
                 'message': 'Item added to cart',
-                'cart_count': cart.items.count()
+                'cart_count': summary['item_count'],
+                'cart_total': summary['grand_total'],
             })
             
         messages.success(request, f"Added {variant.product.name} to your cart.")
@@ -62,11 +51,12 @@ from django.views.decorators.csrf import ensure_csrf_cookie
 @ensure_csrf_cookie
 def cart_count(request):
     try:
-        count = 0
-        cart = Cart.objects.get_or_create_cart(request)
-        if cart:
-            count = cart.items.count()
-        return JsonResponse({'count': count, 'status': 'success'})
+        summary = get_cart_summary(request)
+        return JsonResponse({
+            'count': summary['item_count'],
+            'total': summary['grand_total'],
+            'status': 'success'
+        })
     except Exception as e:
         return JsonResponse({'count': 0, 'status': 'error', 'message': str(e)})
 
@@ -83,12 +73,15 @@ class CartView(View):
             
             # Get all items for backward compatibility
             all_items = cart.items.select_related('variant__product__store').all()
+            store_totals = cart.get_store_totals()
             
             context = {
                 'cart': cart,
                 'items': all_items,  # For backward compatibility
                 'store_items': store_items,
-                'stores': store_items.keys()
+                'stores': store_items.keys(),
+                'store_totals': store_totals,
+                'grand_total': cart.get_grand_total(store_totals),
             }
             return render(request, self.template_name, context)
             
@@ -99,23 +92,13 @@ class CartView(View):
 @require_http_methods(["POST"])
 def update_cart_item(request, item_id):
     try:
-        if request.user.is_authenticated:
-            cart_item = get_object_or_404(
-                CartItem,
-                id=item_id,
-                cart__user=request.user,
-                cart__is_active=True
-            )
-        else:
-            if not request.session.session_key:
-                return JsonResponse({'error': 'No active session'}, status=400)
-                
-            cart_item = get_object_or_404(
-                CartItem,
-                id=item_id,
-                cart__session_key=request.session.session_key,
-                cart__is_active=True
-            )
+        cart = Cart.objects.get_cart(request)
+        if cart is None:
+            return JsonResponse({'error': 'No active session'}, status=400)
+
+        cart_item = cart.get_item(item_id)
+        if cart_item is None:
+            raise Http404('No cart item matches the given query.')
         
         action = request.POST.get('action')
     
@@ -148,6 +131,8 @@ def update_cart_item(request, item_id):
 def clear_cart(request):
     if request.user.is_authenticated:
         Cart.objects.filter(user=request.user, is_active=True).delete()
+    elif uses_guest_storage():
+        Cart.objects.get_cart(request).clear()
     elif request.session.session_key:
         Cart.objects.filter(
             session_key=request.session.session_key, 
@@ -10,6 +10,7 @@ from django.contrib.auth.mixins import LoginRequiredMixin
 
 from .models import Customer, Address
 from order.models import Order
+from order.pagination import CURSOR_PARAM, CursorPaginator
 
 
 @login_required
@@ -133,6 +134,12 @@ class OrderHistoryView(LoginRequiredMixin, ListView):
             customer=self.request.user
         ).select_related('store', 'shipping_address', 'billing_address')
 
+    def paginate_queryset(self, queryset, page_size):
+        """Keyset pagination on (placed_at, id) instead of page numbers"""
+        paginator = CursorPaginator(queryset, page_size)
+        page = paginator.get_page(self.request.GET.get(CURSOR_PARAM))
+        return paginator, page, page.object_list, page.has_other_pages()
+
 
 class OrderDetailView(LoginRequiredMixin, DetailView):
     """Display order details"""
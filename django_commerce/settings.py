@@ -72,6 +72,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'store_admin.middleware.StoreMembershipMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -93,6 +94,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'cart.context_processors.cart_summary',
             ],
         },
     },
@@ -133,6 +135,41 @@ else:
         }
     }
 
+# Test database name (default: Django's). The threaded cart/checkout tests
+# are skipped on SQLite's in-memory test database, whose shared cache fails
+# at once on lock contention; point this at a file to run them there.
+DATABASES["default"].setdefault("TEST", {}).setdefault("NAME", env("DB_TEST_NAME", default=None))
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+
+# The cart summary, store memberships, dashboard counters and the
+# process_orders checkpoint are invalidated through this cache, so with more
+# than one worker process CACHE_URL must name a cache they share (Redis or
+# Memcached); the per-process locmem default only suits a single process.
+# ``manage.py check --deploy`` warns when it is left unset.
+CACHES = {
+    "default": env.cache("CACHE_URL", default="locmemcache://"),
+}
+
+# Seconds a cart's item count / grand total stays cached (see cart/summary.py)
+CART_SUMMARY_CACHE_TIMEOUT = env.int("CART_SUMMARY_CACHE_TIMEOUT", default=60 * 60)
+
+# Where anonymous carts live until login/checkout: "database" (a Cart row
+# per session), or opt in to "session" or "cache" (see cart/storage.py)
+CART_ANONYMOUS_STORAGE = env("CART_ANONYMOUS_STORAGE", default="database")
+
+# Seconds an idempotency key and its stored response are kept (see order/idempotency.py)
+IDEMPOTENCY_KEY_TTL = env.int("IDEMPOTENCY_KEY_TTL", default=24 * 60 * 60)
+
+# Seconds the store dashboard's per-status order counters live in the cache
+# between full recomputations (see order/stats.py)
+STORE_STATS_CACHE_TIMEOUT = env.int("STORE_STATS_CACHE_TIMEOUT", default=60 * 60)
+
+# Seconds a user's store memberships stay cached; Store/StoreStaff changes
+# invalidate them earlier (see store/membership.py)
+STORE_MEMBERSHIP_CACHE_TIMEOUT = env.int("STORE_MEMBERSHIP_CACHE_TIMEOUT", default=24 * 60 * 60)
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -186,3 +223,7 @@ os.makedirs(os.path.join(BASE_DIR, 'static'), exist_ok=True)
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# The product edit form posts seven fields per variant; allow products with
+# well over a thousand variants (Django's default limit is 1000 fields)
+DATA_UPLOAD_MAX_NUMBER_FIELDS = env.int("DATA_UPLOAD_MAX_NUMBER_FIELDS", default=10000)
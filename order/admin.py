@@ -2,7 +2,9 @@ from django.contrib import admin
 from django.utils.html import format_html
 from django.urls import reverse
 from django.utils.safestring import mark_safe
+from .cancellation import cancel_orders
 from .models import Order, OrderItem
+from .stats import apply_deltas, status_change_deltas
 
 
 class OrderItemInline(admin.TabularInline):
@@ -71,6 +73,11 @@ class OrderAdmin(admin.ModelAdmin):
     def get_queryset(self, request):
         return super().get_queryset(request).prefetch_related('items')
 
+    def save_related(self, request, form, formsets, change):
+        # Recalculate the totals once after all inline items are saved
+        with Order.deferred_totals():
+            super().save_related(request, form, formsets, change)
+
     def get_customer(self, obj):
         url = reverse('admin:customer_customer_change', args=[obj.customer.id])
         return mark_safe(f'<a href="{url}">{obj.customer}</a>')
@@ -168,20 +175,24 @@ class OrderAdmin(admin.ModelAdmin):
 
     @admin.action(description='Mark selected orders as Processing')
     def mark_as_processing(self, request, queryset):
-        updated = queryset.filter(
-            status__in=['pending', 'confirmed']).update(status='processing')
+        orders = queryset.filter(status__in=['pending', 'confirmed'])
+        deltas = status_change_deltas(orders, 'processing')
+        updated = orders.update(status='processing')
+        apply_deltas(deltas)
         self.message_user(request, f'{updated} orders marked as Processing.')
 
     @admin.action(description='Mark selected orders as Completed')
     def mark_as_completed(self, request, queryset):
-        updated = queryset.filter(
-            status__in=['processing', 'confirmed']).update(status='completed')
+        orders = queryset.filter(status__in=['processing', 'confirmed'])
+        deltas = status_change_deltas(orders, 'completed')
+        updated = orders.update(status='completed')
+        apply_deltas(deltas)
         self.message_user(request, f'{updated} orders marked as Completed.')
 
     @admin.action(description='Mark selected orders as Cancelled')
     def mark_as_cancelled(self, request, queryset):
-        updated = queryset.exclude(
-            status='cancelled').update(status='cancelled')
+        # Only pending/processing orders can be cancelled; their stock is returned
+        updated = cancel_orders(queryset, user=request.user)
         self.message_user(request, f'{updated} orders marked as Cancelled.')
 
 
@@ -0,0 +1,111 @@
+"""
+Order cancellation service.
+
+Every cancel path (``Order.cancel``, the order views, the admin action and
+``process_orders`` expiry) goes through ``cancel_orders``, or through
+``cancel_locked_orders`` when the caller has locked the orders itself. Orders are taken
+in id-ordered batches, each in its own transaction: the still-cancellable
+orders of the batch are locked, their lines are put back into the live
+``product.Variant`` stock with one grouped ``F()`` UPDATE, and the orders are
+marked cancelled with one more UPDATE. Orders that are no longer cancellable
+(e.g. cancelled concurrently) are skipped, so stock is never returned twice.
+"""
+from django.db import transaction
+from django.db.models import Case, F, Sum, Value, When
+from django.utils import timezone
+
+from product.models import Variant
+from .models import Order, OrderItem
+from .stats import apply_deltas, status_change_deltas
+
+CANCEL_BATCH_SIZE = 500
+
+
+def restock_orders(order_ids):
+    """
+    Put the items of ``order_ids`` back into stock: one grouped read of the
+    quantities per live variant and one ``UPDATE ... SET stock = stock + n``.
+    Variants are locked in id order first, matching checkout's reservation.
+    Returns the number of variants restocked.
+    """
+    quantities = dict(
+        OrderItem.objects.filter(order__in=order_ids, product_variant__isnull=False)
+        .values('product_variant')
+        .annotate(quantity=Sum('quantity'))
+        .values_list('product_variant', 'quantity')
+    )
+    if not quantities:
+        return 0
+    variant_ids = list(
+        Variant.objects.select_for_update()
+        .filter(pk__in=quantities, manage_stock=True)
+        .order_by('pk')
+        .values_list('pk', flat=True)
+    )
+    if not variant_ids:
+        return 0
+    return Variant.objects.filter(pk__in=variant_ids).update(
+        stock=F('stock') + Case(
+            *[When(pk=pk, then=Value(quantities[pk])) for pk in variant_ids],
+            default=Value(0),
+        )
+    )
+
+
+def _cancel_changes(user=None, payment_status=None, notes=None):
+    changes = {'status': 'cancelled', 'cancelled_by': user}
+    if payment_status is not None:
+        changes['payment_status'] = payment_status
+    if notes is not None:
+        changes['notes'] = notes
+    return changes
+
+
+def cancel_locked_orders(order_ids, user=None, payment_status=None, notes=None):
+    """
+    Restock and cancel ``order_ids``, which the caller has already locked
+    (in its transaction) and checked to be cancellable. Returns the number
+    of orders cancelled.
+    """
+    if not order_ids:
+        return 0
+    restock_orders(order_ids)
+    orders = Order.objects.filter(pk__in=order_ids)
+    deltas = status_change_deltas(orders, 'cancelled')
+    now = timezone.now()
+    cancelled = orders.update(
+        cancelled_at=now, updated_at=now,
+        **_cancel_changes(user, payment_status, notes)
+    )
+    apply_deltas(deltas)
+    return cancelled
+
+
+def cancel_orders(orders, user=None, payment_status=None, notes=None,
+                  batch_size=CANCEL_BATCH_SIZE):
+    """
+    Cancel the cancellable orders in the ``orders`` queryset and restock
+    their items. ``payment_status`` and ``notes``, when given, are written
+    too. Bypasses ``Order.save`` and its signals. Returns the number of
+    orders cancelled.
+    """
+    cancellable = orders.filter(status__in=Order.CANCELLABLE_STATUSES).order_by('pk')
+
+    cancelled = 0
+    last_pk = 0
+    while True:
+        batch = list(
+            cancellable.filter(pk__gt=last_pk).values_list('pk', flat=True)[:batch_size]
+        )
+        if not batch:
+            return cancelled
+        last_pk = batch[-1]
+        with transaction.atomic():
+            # Re-check under lock: another request may have cancelled some
+            order_ids = list(
+                Order.objects.select_for_update()
+                .filter(pk__in=batch, status__in=Order.CANCELLABLE_STATUSES)
+                .order_by('pk')
+                .values_list('pk', flat=True)
+            )
+            cancelled += cancel_locked_orders(order_ids, user, payment_status, notes)
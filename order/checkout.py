@@ -0,0 +1,332 @@
+"""
+Checkout pipeline: turns a cart into orders with a fixed number of queries.
+
+A cart may hold items from several stores. ``place_checkout`` records one
+``Checkout`` and splits the cart into one ``Order`` per store under it, all
+bulk-inserted in the caller's transaction.
+
+Each cart line points at an immutable ``OrderProductVariant`` snapshot
+addressed by a hash of (variant id, sku, name, product, price, currency),
+under an ``OrderProduct`` addressed by a hash of its store, sku, name and
+description, so renaming a product snapshots it afresh. A line
+identical to one sold before reuses that snapshot, found with a single
+query: by primary key for ids remembered in the in-process
+``snapshot_cache``, on the unique ``content_hash`` index for the rest.
+Only never-seen lines are written, with
+bulk inserts, so the query count does not grow with the number of lines or
+stores, and a price change creates a new snapshot instead of rewriting the
+price of past orders. Order items are bulk-created and each order's totals
+are computed once, from its lines, when the orders are inserted.
+
+Before anything is written, ``reserve_stock`` locks the stock-managed
+variants in id order and decrements them with one conditional UPDATE, so
+concurrent checkouts can neither oversell nor deadlock on each other.
+"""
+import hashlib
+import threading
+from collections import OrderedDict, defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, Q, Value, When
+
+from product.models import Variant
+from .models import (
+    Checkout, Order, OrderItem, OrderProduct, OrderProductPrice, OrderProductVariant
+)
+from .stats import record_orders_created
+
+SNAPSHOT_CURRENCY = 'USD'
+
+
+class InsufficientStock(Exception):
+    """Raised when a checkout asks for more units than a variant has in stock."""
+
+    def __init__(self, shortfalls):
+        # {variant_id: (requested, available)}
+        self.shortfalls = shortfalls
+        super().__init__(
+            'Insufficient stock for variant(s) ' + ', '.join(str(pk) for pk in sorted(shortfalls))
+        )
+
+
+def reserve_stock(quantities):
+    """
+    Take ``{variant_id: quantity}`` units out of stock for variants with
+    ``manage_stock`` set, or raise ``InsufficientStock`` without changing
+    anything. Two statements whatever the number of lines: a
+    ``SELECT ... FOR UPDATE`` in id order (a deterministic lock order, so
+    checkouts sharing variants cannot deadlock) and a single conditional
+    ``UPDATE ... SET stock = stock - n WHERE stock >= n``. The conditional
+    update keeps this safe on backends without row locks. Call inside the
+    checkout transaction.
+    """
+    quantities = {pk: quantity for pk, quantity in quantities.items() if quantity > 0}
+    if not quantities:
+        return
+    stock = dict(
+        Variant.objects.select_for_update()
+        .filter(pk__in=quantities, manage_stock=True)
+        .order_by('pk')
+        .values_list('pk', 'stock')
+    )
+    shortfalls = {
+        pk: (quantities[pk], available)
+        for pk, available in stock.items()
+        if available < quantities[pk]
+    }
+    if shortfalls:
+        raise InsufficientStock(shortfalls)
+    if not stock:
+        return
+
+    enough = Q()
+    for pk in stock:
+        enough |= Q(pk=pk, stock__gte=quantities[pk])
+    updated = Variant.objects.filter(enough).update(
+        stock=F('stock') - Case(
+            *[When(pk=pk, then=Value(quantities[pk])) for pk in stock],
+            default=Value(0),
+        )
+    )
+    if updated != len(stock):
+        # Stock moved between the read and the update (no row locks); the
+        # caller's transaction rolls the partial decrement back
+        raise InsufficientStock({
+            pk: (quantities[pk], available)
+            for pk, available in Variant.objects.filter(pk__in=stock).values_list('pk', 'stock')
+            if available < quantities[pk]
+        })
+
+
+def snapshot_sku(variant):
+    """Sku the snapshot rows are keyed by; sku-less variants get a stable stand-in."""
+    return variant.sku or f'VARIANT-{variant.pk}'
+
+
+class SnapshotCache:
+    """
+    Thread-safe, in-process LRU of snapshot ``content_hash`` to
+    ``OrderProductVariant`` id. Snapshot rows never change, but they can be
+    deleted by another process, a raw delete, a restore or a rolled-back
+    transaction, so ``snapshot_variants`` confirms every id it takes from
+    here against the database.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, keys):
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    found[key] = self._entries[key]
+        return found
+
+    def set_many(self, mapping):
+        with self._lock:
+            for key, value in mapping.items():
+                self._entries[key] = value
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+snapshot_cache = SnapshotCache(getattr(settings, 'ORDER_SNAPSHOT_CACHE_SIZE', 4096))
+
+
+def _hash(parts):
+    return hashlib.sha256('\0'.join(str(part) for part in parts).encode()).hexdigest()
+
+
+def product_snapshot_hash(variant):
+    """Content address of the ``OrderProduct`` snapshot of ``variant``'s product."""
+    product = variant.product
+    return _hash((product.store_id, snapshot_sku(variant), product.name, product.description))
+
+
+def snapshot_hash(variant, unit_price, currency=SNAPSHOT_CURRENCY):
+    """Content address of the snapshot of ``variant`` sold at ``unit_price``."""
+    return _hash((
+        variant.pk, snapshot_sku(variant), variant.name, product_snapshot_hash(variant),
+        f'{Decimal(unit_price):.2f}', currency,
+    ))
+
+
+def _get_or_create_by_hash(model, objs):
+    """
+    Return ``{content_hash: row}`` for ``objs``, inserting the ones that do
+    not exist yet. Conflicts with rows a concurrent checkout just inserted
+    are ignored and those rows are picked up by the re-read.
+    """
+    rows = model.objects.in_bulk([obj.content_hash for obj in objs], field_name='content_hash')
+    missing = [obj for obj in objs if obj.content_hash not in rows]
+    if missing:
+        model.objects.bulk_create(missing, ignore_conflicts=True)
+        rows.update(model.objects.in_bulk(
+            [obj.content_hash for obj in missing], field_name='content_hash'
+        ))
+    return rows, missing
+
+
+def _create_snapshots(lines):
+    """
+    Insert the snapshots for ``{content_hash: (variant, unit_price)}``, with
+    their products and prices, and return ``{content_hash: snapshot_id}``.
+    A snapshot a concurrent checkout inserted first wins the unique index
+    and is picked up by the re-read.
+    """
+    product_hashes = {variant.pk: product_snapshot_hash(variant) for variant, _ in lines.values()}
+    products, new_products = _get_or_create_by_hash(OrderProduct, list({
+        product_hashes[variant.pk]: OrderProduct(
+            store_id=variant.product.store_id,
+            sku=snapshot_sku(variant),
+            name=variant.product.name,
+            description=variant.product.description,
+            content_hash=product_hashes[variant.pk],
+        )
+        for variant, _ in lines.values()
+    }.values()))
+    if new_products:
+        # The default variant OrderProduct.save() would have added
+        OrderProductVariant.objects.bulk_create([
+            OrderProductVariant(
+                product=products[product.content_hash],
+                name=f"{product.name} - Default",
+                sku=f"{product.sku}-DEFAULT",
+            )
+            for product in new_products
+        ])
+
+    OrderProductVariant.objects.bulk_create([
+        OrderProductVariant(
+            product=products[product_hashes[variant.pk]],
+            sku=snapshot_sku(variant),
+            name=variant.name,
+            content_hash=content_hash,
+        )
+        for content_hash, (variant, _) in lines.items()
+    ], ignore_conflicts=True)
+    snapshot_ids = dict(
+        OrderProductVariant.objects.filter(content_hash__in=lines)
+        .values_list('content_hash', 'pk')
+    )
+    OrderProductPrice.objects.bulk_create([
+        OrderProductPrice(
+            variant_id=snapshot_ids[content_hash], amount=unit_price, currency=SNAPSHOT_CURRENCY
+        )
+        for content_hash, (_, unit_price) in lines.items()
+    ], ignore_conflicts=True)
+    return snapshot_ids
+
+
+def snapshot_variants(lines):
+    """
+    Resolve the snapshot ``OrderProductVariant`` for each ``(variant,
+    unit_price)`` line and return ``{variant_id: snapshot_id}``. One query
+    finds them: ids from ``snapshot_cache`` by primary key, the rest by
+    content hash. A cached id whose row is gone (or now holds another
+    snapshot) is dropped and looked up again by hash; only snapshots never
+    seen before are written. Existing snapshots and their prices are never
+    modified.
+    """
+    hashes = {variant.pk: snapshot_hash(variant, unit_price) for variant, unit_price in lines}
+    if not hashes:
+        return {}
+
+    cached = snapshot_cache.get_many(hashes.values())
+    lookup = Q(content_hash__in=[key for key in hashes.values() if key not in cached])
+    if cached:
+        lookup |= Q(pk__in=cached.values())
+    found = dict(OrderProductVariant.objects.filter(lookup).values_list('content_hash', 'pk'))
+    stale = [key for key, pk in cached.items() if found.get(key) != pk]
+    if stale:
+        for key in stale:
+            snapshot_cache.discard(key)
+        found.update(
+            OrderProductVariant.objects.filter(content_hash__in=stale).values_list('content_hash', 'pk')
+        )
+
+    unseen = {
+        hashes[variant.pk]: (variant, unit_price)
+        for variant, unit_price in lines
+        if hashes[variant.pk] not in found
+    }
+    if unseen:
+        found.update(_create_snapshots(unseen))
+    resolved = {key: found[key] for key in hashes.values() if key not in cached or key in stale}
+    if resolved:
+        # Only remember ids once the rows behind them are committed
+        transaction.on_commit(lambda: snapshot_cache.set_many(resolved))
+
+    return {variant_id: found[key] for variant_id, key in hashes.items()}
+
+
+def place_checkout(cart, **order_fields):
+    """
+    Check ``cart`` out: reserve stock, then create a ``Checkout`` with one
+    order per store and empty the cart. ``order_fields`` (customer, contact,
+    addresses, status, tax, shipping_cost, ...) are applied to every order;
+    each order's subtotal and total come from its own lines. Raises
+    ``InsufficientStock`` before writing anything. Call inside a transaction.
+    """
+    cart_items = list(cart.items.select_related('variant__product'))
+    reserve_stock({item.variant_id: item.quantity for item in cart_items})
+    snapshot_ids = snapshot_variants(
+        [(item.variant, item.unit_price) for item in cart_items]
+    )
+
+    items_by_store = defaultdict(list)
+    for item in cart_items:
+        items_by_store[item.variant.product.store_id].append(item)
+
+    orders = []
+    for store_id, items in sorted(items_by_store.items()):
+        order = Order(store_id=store_id, **order_fields)
+        order.subtotal = sum(item.unit_price * item.quantity for item in items)
+        # bulk_create skips Order.save(), which normally derives the total
+        order.total = order.subtotal + order.tax + order.shipping_cost - order.discount_total
+        orders.append(order)
+
+    checkout = Checkout.objects.create(
+        customer=order_fields.get('customer'),
+        customer_email=order_fields.get('customer_email', ''),
+        subtotal=sum(order.subtotal for order in orders),
+        total=sum(order.total for order in orders),
+    )
+    for order in orders:
+        order.checkout = checkout
+    Order.objects.bulk_create(orders)
+    record_orders_created(orders)
+    if orders and orders[0].pk is None:
+        # Backends that cannot return ids from a bulk insert
+        orders = list(checkout.orders.order_by('store_id'))
+
+    order_for_store = {order.store_id: order for order in orders}
+    OrderItem.objects.bulk_create([
+        OrderItem(
+            order=order_for_store[store_id],
+            variant_id=snapshot_ids[item.variant_id],
+            product_variant_id=item.variant_id,
+            quantity=item.quantity,
+            unit_price=item.unit_price,
+        )
+        for store_id, items in items_by_store.items()
+        for item in items
+    ])
+
+    cart.clear()
+    return checkout
@@ -1,3 +1,5 @@
+import uuid
+
 from django.http import HttpResponse
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
@@ -9,8 +11,11 @@ from django.utils import timezone
 
 from cart.models import Cart, CartItem
 from customer.models import Customer, Address
+from product.models import Variant
 from store.models import Store
-from .models import Order, OrderItem, OrderProduct, OrderProductVariant, OrderProductPrice
+from .checkout import InsufficientStock, place_checkout
+from .idempotency import idempotent, retryable
+from .models import Checkout, Order
 
 @login_required
 def checkout_view(request):
@@ -40,35 +45,46 @@ def checkout_view(request):
     shipping_address = Address.objects.filter(customer=customer, address_type='shipping').first()
     billing_address = Address.objects.filter(customer=customer, address_type='billing').first()
     
-    # Group cart items by store and calculate store totals
+    # Group cart items by store and calculate store totals in one pass
     items_by_store = cart.get_items_by_store()
-    store_totals = {}
-    
-    # Calculate totals for each store
-    for store, items in items_by_store.items():
-        store_totals[store.id] = {
-            'subtotal': cart.get_subtotal_for_store(store),
-            'tax': cart.get_tax_for_store(store),
-            'shipping': cart.get_shipping_for_store(store),
-            'total': cart.get_total_for_store(store)
-        }
+    store_totals = cart.get_store_totals()
 
     context = {
         'cart': cart,
         'items_by_store': items_by_store,
         'store_totals': store_totals,
-        'grand_total': cart.get_grand_total(),
+        'grand_total': cart.get_grand_total(store_totals),
         'shipping_address': shipping_address,
         'billing_address': billing_address,
         'customer': customer,
+        # Lets process_checkout recognise a resubmission of this page
+        'idempotency_key': uuid.uuid4().hex,
     }
     
     return render(request, 'order/checkout.html', context)
 
+def checkout_conflict(request, status, message):
+    """
+    Answer a resubmitted checkout form with a redirect and a message rather
+    than the JSON error ``idempotent`` gives API clients.
+    """
+    if status == 409:
+        # The first submission is still placing the order
+        messages.info(request, "Your order is already being placed. It will appear here in a moment.")
+        return redirect('order:order_history')
+    messages.error(request, "This checkout form was already submitted. Please review your order and try again.")
+    return redirect('order:checkout')
+
 @login_required
+@idempotent('checkout', conflict=checkout_conflict)
 def process_checkout(request):
     """
     Process the checkout and create an order from the cart.
+    A double-submitted form (same ``idempotency_key``) gets the first
+    submission's redirect instead of a second order, or, while that one
+    is still running, a redirect to the order history. Only a placed order
+    is replayed: a failed attempt releases the key so the form can be
+    submitted again.
     """
     if request.method != 'POST':
         return redirect('cart:view')
@@ -78,7 +94,7 @@ def process_checkout(request):
     
     if not cart.items.exists():
         messages.warning(request, "Your cart is empty.")
-        return redirect('cart:view')
+        return retryable(redirect('cart:view'))
     
     # Get or create customer profile
     store = Store.objects.first()  # In a multi-store setup, you'd get the appropriate store
@@ -101,7 +117,7 @@ def process_checkout(request):
         billing_address = Address.objects.get(id=billing_address_id, customer=customer)
     except (Address.DoesNotExist, ValueError):
         messages.error(request, "Please provide valid shipping and billing addresses.")
-        return redirect('order:checkout')
+        return retryable(redirect('order:checkout'))
     
     # Get email and phone from the request
     email = request.POST.get('email', '')
@@ -109,22 +125,14 @@ def process_checkout(request):
     
     if not email or not phone:
         messages.error(request, "Email and phone are required.")
-        return redirect('order:checkout')
+        return retryable(redirect('order:checkout'))
     
-    # Start a transaction to ensure data consistency
-    with transaction.atomic():
-        try:
-            # Calculate order totals
-            subtotal = sum(item.get_subtotal() for item in cart.items.all())
-            # tax = sum(cart.get_tax_for_store(store) for store in cart.get_stores())
-            tax=0
-            # shipping_cost = sum(cart.get_shipping_for_store(store) for store in cart.get_stores())
-            shipping_cost=0
-            total = cart.get_grand_total()
-            
-            # Create the order with the user object and contact info
-            order = Order.objects.create(
-                store=store,
+    try:
+        # Split the cart into one order per store in one transaction;
+        # totals come from the lines
+        with transaction.atomic():
+            checkout = place_checkout(
+                cart,
                 customer=request.user if request.user.is_authenticated else None,
                 customer_email=email,
                 customer_phone=phone,
@@ -132,62 +140,41 @@ def process_checkout(request):
                 billing_address=billing_address,
                 status='pending',
                 placed_at=timezone.now(),
-                subtotal=subtotal,
-                tax=tax,
-                shipping_cost=shipping_cost,
-                total=total,
+                tax=0,
+                shipping_cost=0,
             )
-            # Create order items from cart items
-            for item in cart.items.all():
-                # Create or get order product
-                product, _ = OrderProduct.objects.get_or_create(
-                    store=store,
-                    sku=item.variant.sku,
-                    defaults={
-                        'name': item.variant.product.name,
-                        'description': item.variant.product.description,
-                    }
-                )
-                
-                # Check if variant already exists
-                variant, created = OrderProductVariant.objects.get_or_create(
-                    sku=item.variant.sku,
-                    defaults={
-                        'product': product,
-                        'name': item.variant.name,
-                    }
-                )
-                
-                # Create or update price for the variant
-                OrderProductPrice.objects.update_or_create(
-                    variant=variant,
-                    defaults={
-                        'amount': item.unit_price,
-                        'currency': 'USD',  # You might want to make this dynamic
-                    }
-                )
-                
-                # Create order item
-                OrderItem.objects.create(
-                    order=order,
-                    variant=variant,
-                    quantity=item.quantity,
-                    unit_price=item.unit_price,
-                )
-            # Clear the cart
-            cart.items.all().delete()
-            cart.updated_at = timezone.now()
-            cart.save()
-            
-            # Redirect to order confirmation page
-            messages.success(request, "Your order has been placed successfully!")
-            return redirect('order:order_confirmation', order_id=order.id)
             
-        except Exception as e:
-            # Log the error
-            print(f"Error during checkout: {str(e)}")
-            messages.error(request, "An error occurred while processing your order. Please try again.")
-            return redirect('order:checkout')
+        # Redirect to order confirmation page
+        messages.success(request, "Your order has been placed successfully!")
+        return redirect('order:checkout_confirmation', checkout_id=checkout.id)
+        
+    except InsufficientStock as e:
+        short = Variant.objects.select_related('product').in_bulk(e.shortfalls)
+        messages.error(request, "Not enough stock for: " + ", ".join(
+            f"{variant} ({e.shortfalls[pk][1]} left)" for pk, variant in short.items()
+        ))
+        return retryable(redirect('cart:view'))
+
+    except Exception as e:
+        # Log the error
+        print(f"Error during checkout: {str(e)}")
+        messages.error(request, "An error occurred while processing your order. Please try again.")
+        return retryable(redirect('order:checkout'))
+
+@login_required
+def checkout_confirmation(request, checkout_id):
+    """
+    Confirm a checkout: straight to the invoice when the cart came from a
+    single store, otherwise a list of the per-store orders.
+    """
+    checkout = get_object_or_404(Checkout, id=checkout_id, customer=request.user)
+    orders = list(checkout.orders.select_related('store').order_by('store__name'))
+    if len(orders) == 1:
+        return redirect('order:order_confirmation', order_id=orders[0].id)
+    return render(request, 'order/checkout_confirmation.html', {
+        'checkout': checkout,
+        'orders': orders,
+    })
 
 @login_required
 def order_confirmation(request, order_id):
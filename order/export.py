@@ -0,0 +1,138 @@
+"""
+Streaming order export (CSV or JSON Lines).
+
+Orders are read with ``.iterator(chunk_size=...)``, so only one chunk of
+orders and their prefetched items is held in memory at a time, and the
+output is produced line by line for a ``StreamingHttpResponse`` or a file.
+Memory use therefore stays flat however many orders a store has.
+
+* CSV: one row per order item, the order's columns repeated on each row
+  (an order without items gets one row with empty item columns).
+* JSONL: one JSON object per order, with its items in an ``items`` list.
+
+Used by ``store_admin.views.order_export`` and the ``export_orders``
+management command.
+"""
+import csv
+import json
+from datetime import datetime, time, timedelta
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Prefetch
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .models import Order, OrderItem
+
+FORMATS = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+EXPORT_CHUNK_SIZE = 2000
+
+ORDER_FIELDS = (
+    'id', 'placed_at', 'status', 'payment_status', 'payment_method',
+    'customer_email', 'customer_phone', 'subtotal', 'tax', 'shipping_cost',
+    'discount_total', 'total',
+)
+ITEM_FIELDS = ('sku', 'name', 'quantity', 'unit_price', 'line_total')
+
+
+def filter_orders(queryset, date_from=None, date_to=None, status=None):
+    """
+    Narrow ``queryset`` to orders placed between the ``date_from`` and
+    ``date_to`` dates (``YYYY-MM-DD``, both inclusive) whose status is one
+    of the comma-separated ``status`` values. Raises ``ValueError`` for a
+    malformed date or unknown status.
+    """
+    if date_from:
+        queryset = queryset.filter(placed_at__gte=_day_start(date_from))
+    if date_to:
+        queryset = queryset.filter(placed_at__lt=_day_start(date_to) + timedelta(days=1))
+    if status:
+        statuses = [value.strip() for value in status.split(',') if value.strip()]
+        unknown = set(statuses) - set(dict(Order.STATUS_CHOICES))
+        if unknown:
+            raise ValueError(f"Unknown status: {', '.join(sorted(unknown))}")
+        queryset = queryset.filter(status__in=statuses)
+    return queryset
+
+
+def _day_start(value):
+    try:
+        day = parse_date(value)
+    except ValueError:
+        day = None
+    if day is None:
+        raise ValueError(f'Invalid date: {value!r} (expected YYYY-MM-DD)')
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def iter_orders(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield the orders of ``queryset`` by id, with items prefetched per chunk."""
+    orders = (
+        queryset.order_by('pk')
+        .only(*ORDER_FIELDS)
+        .prefetch_related(Prefetch(
+            'items',
+            queryset=OrderItem.objects.select_related('variant').order_by('pk'),
+        ))
+        .iterator(chunk_size=chunk_size)
+    )
+    for order in orders:
+        yield order
+        # Prefetched items point back at their order; break the cycle so a
+        # finished chunk is freed right away instead of at the next GC pass
+        order._prefetched_objects_cache.clear()
+
+
+def _item_row(item):
+    return {
+        'sku': item.variant.sku,
+        'name': item.variant.name,
+        'quantity': item.quantity,
+        'unit_price': item.unit_price,
+        'line_total': item.unit_price * item.quantity,
+    }
+
+
+def _order_row(order):
+    return {field: getattr(order, field) for field in ORDER_FIELDS}
+
+
+class _Echo:
+    """File-like object whose ``write`` hands the line back to the caller."""
+
+    def write(self, value):
+        return value
+
+
+def export_csv(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield the CSV export of ``queryset``, one line at a time."""
+    writer = csv.writer(_Echo())
+    yield writer.writerow(
+        [f'order_{field}' for field in ORDER_FIELDS] + [f'item_{field}' for field in ITEM_FIELDS]
+    )
+    for order in iter_orders(queryset, chunk_size):
+        order_values = list(_order_row(order).values())
+        items = order.items.all()
+        if not items:
+            yield writer.writerow(order_values + [''] * len(ITEM_FIELDS))
+        for item in items:
+            yield writer.writerow(order_values + list(_item_row(item).values()))
+
+
+def export_jsonl(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield the JSON Lines export of ``queryset``, one order per line."""
+    for order in iter_orders(queryset, chunk_size):
+        row = _order_row(order)
+        row['items'] = [_item_row(item) for item in order.items.all()]
+        yield json.dumps(row, cls=DjangoJSONEncoder) + '\n'
+
+
+def export_orders(queryset, fmt='csv', chunk_size=EXPORT_CHUNK_SIZE):
+    """Return a line iterator exporting ``queryset`` in ``fmt`` (a key of FORMATS)."""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format: {fmt!r} (choose from {', '.join(FORMATS)})")
+    exporter = export_csv if fmt == 'csv' else export_jsonl
+    return exporter(queryset, chunk_size)
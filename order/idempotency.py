@@ -0,0 +1,157 @@
+"""
+Idempotency keys for state-changing requests.
+
+A client sends an ``Idempotency-Key`` header (or an ``idempotency_key`` form
+field) with a POST/PATCH/PUT/DELETE. The first request with a key claims it
+by inserting an ``IdempotencyKey`` row, runs the view and stores the
+response. Repeats of the key by the same user/session within
+``IDEMPOTENCY_KEY_TTL`` get that stored response back without running the
+view again. A repeat that arrives while the first request is still running
+gets 409; reusing a key for a different request gets 422. Both are JSON
+unless the view passes its own ``conflict`` handler, as the checkout form
+does to answer a browser with a page instead. Server errors are not stored, so they can be retried; neither is a response the view passed
+through ``retryable()``, such as a failed checkout's redirect back to the
+form.
+
+Usage::
+
+    @idempotent('checkout', conflict=checkout_conflict)
+    def process_checkout(request): ...
+
+    @method_decorator(idempotent('cart-api'), name='dispatch')
+    class CartAPIView(APIView): ...
+"""
+import hashlib
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse, JsonResponse
+from django.utils import timezone
+
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+FORM_FIELD = 'idempotency_key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+STORED_HEADERS = ('Content-Type', 'Location', 'ETag')
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+# A claim with no stored outcome after this long belongs to a crashed request
+STALE_CLAIM_AFTER = timedelta(minutes=5)
+
+
+def key_ttl():
+    return timedelta(seconds=getattr(settings, 'IDEMPOTENCY_KEY_TTL', 24 * 60 * 60))
+
+
+def request_owner(request):
+    """Who a key belongs to, or None when the request has no identity."""
+    if request.user.is_authenticated:
+        return f'user:{request.user.pk}'
+    if request.session.session_key:
+        return f'session:{request.session.session_key}'
+    return None
+
+
+def request_fingerprint(request):
+    digest = hashlib.sha256()
+    for part in (request.method, request.get_full_path()):
+        digest.update(part.encode())
+        digest.update(b'\0')
+    digest.update(request.body)
+    return digest.hexdigest()
+
+
+def claim_key(owner, scope, key, fingerprint):
+    """
+    Insert the claim for ``key``. Returns ``(record, created)``; an expired
+    or abandoned record is replaced by a fresh claim. ``record`` is None if
+    the key kept changing hands under us.
+    """
+    now = timezone.now()
+    for _ in range(2):
+        try:
+            with transaction.atomic():
+                return IdempotencyKey.objects.create(
+                    owner=owner, scope=scope, key=key, fingerprint=fingerprint,
+                    expires_at=now + key_ttl(),
+                ), True
+        except IntegrityError:
+            record = IdempotencyKey.objects.filter(owner=owner, scope=scope, key=key).first()
+            if record is None:
+                continue
+            abandoned = record.status_code is None and record.created_at < now - STALE_CLAIM_AFTER
+            if record.expires_at > now and not abandoned:
+                return record, False
+            IdempotencyKey.objects.filter(pk=record.pk).delete()
+    return None, False
+
+
+def retryable(response):
+    """Mark ``response`` as a failure to release the key for, not to replay."""
+    response.idempotency_retryable = True
+    return response
+
+
+def stored_response(record):
+    response = HttpResponse(record.response_body, status=record.status_code)
+    for name, value in record.response_headers.items():
+        response[name] = value
+    response[REPLAYED_HEADER] = 'true'
+    return response
+
+
+def json_conflict(request, status, message):
+    return JsonResponse({'error': message}, status=status)
+
+
+def idempotent(scope, conflict=json_conflict):
+    """
+    View decorator honouring idempotency keys for unsafe methods.
+    ``conflict(request, status, message)`` builds the 409/422 response.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method in SAFE_METHODS:
+                return view(request, *args, **kwargs)
+            # Read the raw body before any form parsing consumes the stream
+            fingerprint = request_fingerprint(request)
+            key = request.headers.get(HEADER) or request.POST.get(FORM_FIELD)
+            owner = request_owner(request)
+            if not key or owner is None:
+                return view(request, *args, **kwargs)
+
+            record, created = claim_key(owner, scope, key[:255], fingerprint)
+            if not created:
+                if record is not None and record.fingerprint != fingerprint:
+                    return conflict(
+                        request, 422, f'{HEADER} was already used for a different request.'
+                    )
+                if record is None or record.status_code is None:
+                    return conflict(
+                        request, 409, f'A request with this {HEADER} is still being processed.'
+                    )
+                return stored_response(record)
+
+            try:
+                response = view(request, *args, **kwargs)
+                if hasattr(response, 'render') and not response.is_rendered:
+                    response.render()
+            except BaseException:
+                record.delete()
+                raise
+            if (response.status_code >= 500 or response.streaming
+                    or getattr(response, 'idempotency_retryable', False)):
+                record.delete()
+                return response
+            record.status_code = response.status_code
+            record.response_body = response.content.decode(response.charset or 'utf-8')
+            record.response_headers = {
+                name: response[name] for name in STORED_HEADERS if response.has_header(name)
+            }
+            record.save(update_fields=['status_code', 'response_body', 'response_headers'])
+            return response
+        return wrapper
+    return decorator
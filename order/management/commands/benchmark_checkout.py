@@ -0,0 +1,59 @@
+"""
+Show that checkout's query count stays flat as the cart grows.
+
+For each cart size, fills a throwaway cart and runs ``place_checkout`` twice:
+the first run creates any missing snapshot rows, the repeat run resolves
+the snapshots the first one left behind. Each size runs inside a
+transaction that is rolled back.
+
+Usage:
+    python manage.py benchmark_checkout --sizes 1,10,30,100
+"""
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import F
+from django.test.utils import CaptureQueriesContext
+
+from cart.models import Cart
+from order.checkout import place_checkout
+from product.models import Variant
+
+
+class Command(BaseCommand):
+    help = 'Benchmark queries per checkout for growing cart sizes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1,10,30,100',
+                            help='Comma separated cart sizes (lines per order)')
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',')]
+        variants = list(Variant.objects.select_related('product')[:max(sizes)])
+        if len(variants) < max(sizes):
+            raise CommandError(f'Need at least {max(sizes)} variants; run seed_data first.')
+
+        self.stdout.write(f"{'lines':>8}{'run':>10}{'queries':>10}{'ms':>10}")
+        for size in sizes:
+            with transaction.atomic():
+                user = get_user_model().objects.create_user('benchmark-checkout')
+                # Enough stock for both runs; rolled back with everything else
+                Variant.objects.filter(pk__in=[v.pk for v in variants[:size]]).update(
+                    stock=F('stock') + 2
+                )
+                for run in ('first', 'repeat'):
+                    cart = Cart.objects.create(user=user)
+                    cart.merge_lines(
+                        (variant.pk, 1, variant.price, variant.created_at)
+                        for variant in variants[:size]
+                    )
+                    started = time.perf_counter()
+                    with CaptureQueriesContext(connection) as queries:
+                        place_checkout(cart, customer=user, customer_email='benchmark@example.com')
+                    elapsed = (time.perf_counter() - started) * 1000
+                    self.stdout.write(
+                        f"{size:>8}{run:>10}{len(queries.captured_queries):>10}{elapsed:>10.1f}"
+                    )
+                transaction.set_rollback(True)
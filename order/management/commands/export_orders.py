@@ -0,0 +1,59 @@
+"""
+Export orders with their items as CSV or JSON Lines.
+
+Streams from the database in chunks (see order/export.py), so it can dump
+any number of orders with flat memory use.
+
+Usage:
+    python manage.py export_orders --store 1 --format csv --output orders.csv
+    python manage.py export_orders --from 2025-01-01 --to 2025-01-31 --status completed,processing --format jsonl
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from order.export import EXPORT_CHUNK_SIZE, FORMATS, export_orders, filter_orders
+from order.models import Order
+
+
+class Command(BaseCommand):
+    help = 'Stream orders and their items to CSV or JSONL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--store', type=int, default=None,
+                            help='Only orders of this store id (default: all stores)')
+        parser.add_argument('--format', choices=sorted(FORMATS), default='csv')
+        parser.add_argument('--from', dest='date_from', default=None,
+                            help='First day to include (YYYY-MM-DD)')
+        parser.add_argument('--to', dest='date_to', default=None,
+                            help='Last day to include (YYYY-MM-DD)')
+        parser.add_argument('--status', default=None,
+                            help=f"Comma-separated statuses to include ({', '.join(dict(Order.STATUS_CHOICES))})")
+        parser.add_argument('--output', default=None,
+                            help='File to write (default: stdout)')
+        parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        orders = Order.objects.all()
+        if options['store'] is not None:
+            orders = orders.filter(store_id=options['store'])
+        try:
+            orders = filter_orders(
+                orders,
+                date_from=options['date_from'],
+                date_to=options['date_to'],
+                status=options['status'],
+            )
+        except ValueError as e:
+            raise CommandError(e)
+
+        lines = export_orders(orders, options['format'], options['chunk_size'])
+        if options['output'] is None:
+            for line in lines:
+                self.stdout.write(line, ending='')
+            return
+
+        count = 0
+        with open(options['output'], 'w', newline='', encoding='utf-8') as output:
+            for line in lines:
+                output.write(line)
+                count += 1
+        self.stderr.write(self.style.SUCCESS(f"Wrote {count} line(s) to {options['output']}."))
@@ -1,105 +1,252 @@
-from django.core.management.base import BaseCommand
-from django.utils import timezone
+"""
+Process orders (abandoned carts, pending payments, expired orders).
+
+Each phase walks the matching orders in id order, ``--batch-size`` at a
+time. A batch is claimed with ``SELECT ... FOR UPDATE SKIP LOCKED`` and
+handled in its own transaction, so ``--workers`` threads (and, on backends
+with SKIP LOCKED, several copies of the command) share the work without
+processing an order twice. Backends without SKIP LOCKED (SQLite) run a
+single worker.
+
+Progress is checkpointed in the cache after every batch. Every copy of
+the command records the last id below which all of its batches were
+handled. A new run resumes from the lowest of those, so a batch that a
+crashed or still-running copy never finished is picked up again. Use a
+shared ``CACHE_URL`` for checkpoints to outlive the process.
+``--restart`` ignores the checkpoints.
+
+Usage:
+    python manage.py process_orders
+    python manage.py process_orders --batch-size 1000 --workers 4
+"""
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
 from datetime import timedelta
-from django.db.models import Q
 
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, router, transaction
+from django.utils import timezone
+
+from order.cancellation import cancel_locked_orders
 from order.models import Order
 
+CHECKPOINT_TIMEOUT = 7 * 24 * 60 * 60
+# A run whose checkpoint has not moved for this long is taken to have died;
+# the next run adopts its range
+STALE_RUN_AFTER = 60 * 60
+LOCK_TIMEOUT = 10
+LOCK_WAIT = 30
+
+
+class Checkpoint:
+    """
+    Hands out id-ordered batches of a phase and tracks how far it got.
+
+    Claims are serialized within the process, so workers never receive
+    overlapping batches even on backends without row locks. Each run saves
+    the lowest bound of any batch it still has in flight, next to the
+    marks of the other runs of the phase, in one cache entry updated under
+    a cache lock. A new run starts from the lowest mark, so a batch that
+    failed or never finished in any copy is picked up again.
+    """
+
+    def __init__(self, phase, restart=False):
+        self.key = f'process_orders:checkpoints:{phase}'
+        self.run_id = uuid.uuid4().hex
+        with self.runs() as runs:
+            if restart:
+                runs.clear()
+            self.resumed_from = min((mark for mark, _ in runs.values()), default=0)
+            # Runs that stopped saving progress are covered from here on
+            for run_id, (_, saved_at) in list(runs.items()):
+                if saved_at < time.time() - STALE_RUN_AFTER:
+                    del runs[run_id]
+            runs[self.run_id] = (self.resumed_from, time.time())
+        self.high = self.resumed_from
+        self.in_flight = set()
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def runs(self):
+        """``{run_id: (mark, saved_at)}`` of the phase, saved on exit."""
+        lock_key = f'{self.key}:lock'
+        deadline = time.monotonic() + LOCK_WAIT
+        while not cache.add(lock_key, self.run_id, LOCK_TIMEOUT):
+            if time.monotonic() > deadline:
+                raise CommandError(f'Timed out waiting for the checkpoint lock {lock_key!r}')
+            time.sleep(0.01)
+        try:
+            runs = cache.get(self.key) or {}
+            yield runs
+            cache.set(self.key, runs, CHECKPOINT_TIMEOUT)
+        finally:
+            cache.delete(lock_key)
+
+    def claim(self, queryset, size):
+        """Lock the next batch; returns ``(lower_bound, ids)`` or None when done."""
+        with self.lock:
+            ids = list(
+                queryset.select_for_update(skip_locked=True)
+                .filter(pk__gt=self.high)
+                .order_by('pk')
+                .values_list('pk', flat=True)[:size]
+            )
+            if not ids:
+                return None
+            lower, self.high = self.high, ids[-1]
+            self.in_flight.add(lower)
+            return lower, ids
+
+    def done(self, lower):
+        with self.lock:
+            self.in_flight.discard(lower)
+            mark = min(self.in_flight, default=self.high)
+            with self.runs() as runs:
+                runs[self.run_id] = (mark, time.time())
+
+    def finish(self):
+        with self.runs() as runs:
+            runs.pop(self.run_id, None)
+
+
 class Command(BaseCommand):
     help = 'Process orders (abandoned carts, pending payments, etc.)'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Threads processing batches in parallel (needs SKIP LOCKED support)')
+        parser.add_argument('--restart', action='store_true',
+                            help='Ignore saved checkpoints and start from the first order')
+
     def handle(self, *args, **options):
-        self.process_abandoned_carts()
-        self.process_pending_payments()
-        self.process_expired_orders()
+        self.options = options
+        self.output_lock = threading.Lock()
+        self.workers = max(options['workers'], 1)
+        connection = connections[router.db_for_write(Order)]
+        if self.workers > 1 and not connection.features.has_select_for_update_skip_locked:
+            # Parallel batch transactions would only fail on the database lock
+            self.stderr.write(self.style.WARNING(
+                f'{connection.vendor} has no SELECT ... FOR UPDATE SKIP LOCKED; '
+                f'running 1 worker instead of {self.workers}.'
+            ))
+            self.workers = 1
+        now = timezone.now()
 
-    def process_abandoned_carts(self):
-        """
-        Identify and handle abandoned carts (orders that have been created but not completed).
-        """
-        # Find orders that are older than 1 hour but still in 'pending' status
-        time_threshold = timezone.now() - timedelta(hours=1)
-        abandoned_orders = Order.objects.filter(
-            status='pending',
-            created_at__lte=time_threshold
+        # Orders older than 1 hour but still in 'pending' status
+        self.run_phase(
+            'abandoned', 'abandoned cart(s)',
+            Order.objects.filter(status='pending', placed_at__lte=now - timedelta(hours=1)),
+            self.process_abandoned_carts,
         )
-        
-        count = abandoned_orders.count()
-        if count > 0:
-            self.stdout.write(self.style.WARNING(
-                f'Found {count} abandoned cart(s) older than 1 hour.'
-            ))
-            
-            # TODO: Send reminder emails for abandoned carts
-            # for order in abandoned_orders:
-            #     send_abandoned_cart_reminder(order)
-            
-            self.stdout.write(self.style.SUCCESS(
-                f'Processed {count} abandoned cart(s).'
-            ))
+        # Pending payment for more than 30 minutes
+        self.run_phase(
+            'pending-payments', 'pending payment(s)',
+            Order.objects.filter(
+                payment_status='pending', status='pending',
+                placed_at__lte=now - timedelta(minutes=30)
+            ),
+            self.process_pending_payments,
+        )
+        # Still unpaid after 24 hours
+        self.run_phase(
+            'expired', 'expired order(s)',
+            Order.objects.filter(
+                status='pending', payment_status='pending',
+                placed_at__lte=now - timedelta(hours=24)
+            ),
+            self.process_expired_orders,
+        )
+
+    def run_phase(self, phase, label, queryset, process):
+        """Run ``process(ids)`` over ``queryset`` in locked batches and report throughput."""
+        checkpoint = Checkpoint(phase, restart=self.options['restart'])
+        if checkpoint.resumed_from:
+            self.stdout.write(f'Resuming {label} after order #{checkpoint.resumed_from}.')
+        workers = self.workers
+        totals = Counter()
+        errors = []
+
+        def work():
+            while True:
+                with transaction.atomic():
+                    claimed = checkpoint.claim(queryset, self.options['batch_size'])
+                    if claimed is None:
+                        return
+                    lower, ids = claimed
+                    handled = process(ids)
+                checkpoint.done(lower)
+                with self.output_lock:
+                    totals['batches'] += 1
+                    totals['orders'] += len(ids)
+                    totals['handled'] += handled
+
+        def thread_work():
+            try:
+                work()
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        started = time.perf_counter()
+        if workers == 1:
+            work()
         else:
-            self.stdout.write('No abandoned carts found.')
+            threads = [threading.Thread(target=thread_work) for _ in range(workers)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        elapsed = time.perf_counter() - started
+
+        if errors:
+            raise CommandError(f'{len(errors)} worker(s) failed processing {label}: {errors[0]!r}')
+        checkpoint.finish()
+
+        if not totals['orders']:
+            self.stdout.write(f'No {label} found.')
+            return
+        rate = totals['orders'] / elapsed if elapsed else totals['orders']
+        verb = 'Cancelled' if phase == 'expired' else 'Processed'
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {totals['handled']} {label} in {elapsed:.1f}s "
+            f"({rate:.0f} orders/s, {totals['batches']} batch(es), {workers} worker(s))."
+        ))
 
-    def process_pending_payments(self):
+    def process_abandoned_carts(self, ids):
         """
-        Check for orders with pending payments and update their status if needed.
+        Handle abandoned carts (orders that have been created but not completed).
         """
-        # Find orders with pending payment that are older than 30 minutes
-        time_threshold = timezone.now() - timedelta(minutes=30)
-        pending_orders = Order.objects.filter(
-            payment_status='pending',
-            status='pending',
-            created_at__lte=time_threshold
-        )
-        
-        count = pending_orders.count()
-        if count > 0:
-            self.stdout.write(self.style.WARNING(
-                f'Found {count} pending payment(s) older than 30 minutes.'
-            ))
-            
-            # TODO: Check payment status with payment gateway
-            # For now, we'll just log them
-            for order in pending_orders:
-                self.stdout.write(f'  - Order #{order.id} from {order.created_at}')
-            
-            self.stdout.write(self.style.SUCCESS(
-                f'Processed {count} pending payment(s).'
-            ))
-        else:
-            self.stdout.write('No pending payments found.')
+        # TODO: Send reminder emails for abandoned carts
+        return len(ids)
 
-    def process_expired_orders(self):
+    def process_pending_payments(self, ids):
         """
-        Handle expired orders (e.g., orders that were not paid in time).
+        Check orders with pending payments and update their status if needed.
         """
-        # Find orders that are older than 24 hours and still pending payment
-        time_threshold = timezone.now() - timedelta(hours=24)
-        expired_orders = Order.objects.filter(
-            status='pending',
-            payment_status='pending',
-            created_at__lte=time_threshold
-        )
-        
-        count = expired_orders.count()
-        if count > 0:
-            self.stdout.write(self.style.WARNING(
-                f'Found {count} expired order(s) older than 24 hours.'
-            ))
+        # TODO: Check payment status with payment gateway
+        # For now, we'll just log them
+        lines = [
+            f'  - Order #{order_id} from {placed_at}'
+            for order_id, placed_at in
+            Order.objects.filter(pk__in=ids).order_by('pk').values_list('pk', 'placed_at')
+        ]
+        with self.output_lock:
+            self.stdout.write('\n'.join(lines))
+        return len(ids)
 
-            # TODO: Send cancellation email to customers
-            
-            # Update status to cancelled
-            updated = expired_orders.update(
-                status='cancelled',
-                payment_status='failed',
-                notes='Order cancelled automatically due to non-payment.'
-            )
-            
-            # TODO: Send cancellation email to customers
-            
-            self.stdout.write(self.style.SUCCESS(
-                f'Cancelled {updated} expired order(s).'
-            ))
-        else:
-            self.stdout.write('No expired orders found.')
+    def process_expired_orders(self, ids):
+        """
+        Cancel expired orders (not paid in time) and put their items back in stock.
+        """
+        # TODO: Send cancellation email to customers
+        return cancel_locked_orders(
+            ids,
+            payment_status='failed',
+            notes='Order cancelled automatically due to non-payment.'
+        )
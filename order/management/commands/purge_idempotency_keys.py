@@ -0,0 +1,30 @@
+"""
+Delete expired idempotency keys.
+
+Usage:
+    python manage.py purge_idempotency_keys --batch-size 5000
+"""
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from order.models import IdempotencyKey
+
+
+class Command(BaseCommand):
+    help = 'Delete idempotency keys past their TTL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        deleted = 0
+        while True:
+            ids = list(
+                IdempotencyKey.objects.filter(expires_at__lte=now)
+                .values_list('pk', flat=True)[:options['batch_size']]
+            )
+            if not ids:
+                break
+            deleted += IdempotencyKey.objects.filter(pk__in=ids).delete()[0]
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} expired idempotency key(s).'))
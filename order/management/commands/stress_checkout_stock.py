@@ -0,0 +1,147 @@
+"""
+Hammer checkout from many threads to prove stock reservation is sound.
+
+Creates a throwaway product with a few scarce variants, then starts
+``--threads`` workers that each place ``--orders`` orders for carts holding
+every variant, added in a random order so that a non-deterministic lock
+order would deadlock. Afterwards it checks that no variant went below zero
+and that exactly the units sold were taken out of stock, then deletes
+everything it created.
+
+The same checks run in CI as ``order.tests.ConcurrentCheckoutTests``; this
+command is an optional extra for hammering a real database at a larger
+scale. Run it against the production database engine (PostgreSQL, MySQL);
+SQLite serializes writers, so there it only exercises the conditional
+UPDATE. It writes to the configured database and deletes what it created.
+
+Usage:
+    python manage.py stress_checkout_stock --threads 16 --orders 10 --stock 25
+"""
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connections, transaction
+
+from cart.models import Cart
+from order.checkout import InsufficientStock, place_checkout
+from order.models import Checkout, Order, OrderProduct
+from product.models import Product, Variant
+from store.models import Store
+
+
+class Command(BaseCommand):
+    help = 'Concurrent checkout stress test: no oversell, no deadlock'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--orders', type=int, default=10,
+                            help='Orders attempted per thread')
+        parser.add_argument('--variants', type=int, default=3,
+                            help='Scarce variants in every cart')
+        parser.add_argument('--stock', type=int, default=25,
+                            help='Initial stock of each variant')
+        parser.add_argument('--quantity', type=int, default=1,
+                            help='Units of each variant per order')
+        parser.add_argument('--retries', type=int, default=5,
+                            help='Retries after a lock timeout or deadlock error')
+
+    def handle(self, *args, **options):
+        store = Store.objects.first()
+        if store is None:
+            raise CommandError('No store found; run seed_data first.')
+
+        tag = uuid.uuid4().hex[:8]
+        product = Product.objects.create(store=store, name=f'Stress {tag}', slug=f'stress-{tag}')
+        variants = [
+            Variant.objects.create(
+                product=product, name=f'V{n}', sku=f'STRESS-{tag}-{n}',
+                default_price=1, stock=options['stock'],
+            )
+            for n in range(options['variants'])
+        ]
+        users = [
+            get_user_model().objects.create_user(f'stress-{tag}-{n}')
+            for n in range(options['threads'])
+        ]
+
+        outcomes = Counter()
+        lock = threading.Lock()
+        barrier = threading.Barrier(options['threads'])
+
+        def worker(user):
+            rng = random.Random(user.pk)
+            try:
+                barrier.wait()
+                for _ in range(options['orders']):
+                    outcome, deadlocks = self.checkout(user, variants, rng, options)
+                    with lock:
+                        outcomes[outcome] += 1
+                        outcomes['deadlocks'] += deadlocks
+            finally:
+                connections.close_all()
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=worker, args=(user,)) for user in users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        try:
+            final = dict(Variant.objects.filter(pk__in=[v.pk for v in variants]).values_list('pk', 'stock'))
+            sold = (outcomes['placed'] + outcomes['retried']) * options['quantity']
+            oversold = [
+                pk for pk, stock in final.items()
+                if stock < 0 or options['stock'] - stock != sold
+            ]
+            attempts = options['threads'] * options['orders']
+            self.stdout.write(
+                f"{attempts} checkouts in {elapsed:.1f}s: {outcomes['placed']} placed, "
+                f"{outcomes['rejected']} rejected for stock, {outcomes['retried']} retried, "
+                f"{outcomes['failed']} failed, {outcomes['deadlocks']} deadlocks"
+            )
+            self.stdout.write(f'Final stock: {sorted(final.values())} (started at {options["stock"]})')
+        finally:
+            self.cleanup(tag, product, users)
+
+        if oversold or outcomes['failed'] or outcomes['deadlocks']:
+            raise CommandError(
+                f'Oversold variants: {oversold}; failed checkouts: {outcomes["failed"]}; '
+                f'deadlocks: {outcomes["deadlocks"]}'
+            )
+        self.stdout.write(self.style.SUCCESS('No oversell, no deadlock.'))
+
+    def checkout(self, user, variants, rng, options):
+        """Place one order; returns (outcome, deadlocks seen on the way)."""
+        deadlocks = 0
+        for attempt in range(options['retries'] + 1):
+            try:
+                with transaction.atomic():
+                    cart = Cart.objects.create(user=user, is_active=False)
+                    for variant in rng.sample(variants, len(variants)):
+                        cart.add_variant(variant, options['quantity'])
+                    place_checkout(cart, customer=user, customer_email='stress@example.com')
+                return ('placed' if attempt == 0 else 'retried'), deadlocks
+            except InsufficientStock:
+                return 'rejected', deadlocks
+            except OperationalError as e:
+                # Lock timeouts (e.g. SQLite's "database is locked") are
+                # retried; deadlocks are counted as failures of the lock order
+                if 'deadlock' in str(e).lower():
+                    deadlocks += 1
+                time.sleep(rng.uniform(0.01, 0.05) * (attempt + 1))
+        return 'failed', deadlocks
+
+    def cleanup(self, tag, product, users):
+        Order.objects.filter(customer__in=users).delete()
+        Checkout.objects.filter(customer__in=users).delete()
+        OrderProduct.objects.filter(sku__startswith=f'STRESS-{tag}-').delete()
+        Cart.objects.filter(user__in=users).delete()
+        product.delete()
+        get_user_model().objects.filter(pk__in=[user.pk for user in users]).delete()
@@ -0,0 +1,37 @@
+# Generated by Django 5.1.4 on 2026-10-18 20:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def link_live_variants(apps, schema_editor):
+    """Point existing order lines at the live variant whose sku they snapshot."""
+    OrderItem = apps.get_model('order', 'OrderItem')
+    OrderProductVariant = apps.get_model('order', 'OrderProductVariant')
+    Variant = apps.get_model('product', 'Variant')
+    snapshot_sku = OrderProductVariant.objects.filter(
+        pk=OuterRef(OuterRef('variant_id'))
+    ).values('sku')[:1]
+    OrderItem.objects.filter(product_variant__isnull=True).update(
+        product_variant=Subquery(
+            Variant.objects.filter(sku=Subquery(snapshot_sku)).values('pk')[:1]
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('order', '0001_initial'),
+        ('product', '0003_variant_manage_stock'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderitem',
+            name='product_variant',
+            field=models.ForeignKey(blank=True, help_text='Live catalog variant this line was bought from; restocked on cancellation.', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='order_items', to='product.variant'),
+        ),
+        migrations.RunPython(link_live_variants, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.4 on 2026-10-18 20:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('order', '0004_checkout'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderproductvariant',
+            name='content_hash',
+            field=models.CharField(blank=True, editable=False, help_text='Hash of the snapshotted variant id, sku, name, price and currency.', max_length=64, null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='orderproductvariant',
+            name='sku',
+            field=models.CharField(db_index=True, max_length=100),
+        ),
+    ]
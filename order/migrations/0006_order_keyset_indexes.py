@@ -0,0 +1,25 @@
+# Generated by Django 5.1.4 on 2026-10-18 20:40
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customer', '0001_initial'),
+        ('order', '0005_orderproductvariant_content_hash'),
+        ('store', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['customer', '-placed_at', '-id'], name='order_order_custome_b3373e_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['store', '-placed_at', '-id'], name='order_order_store_i_4848c3_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.4 on 2026-10-18 21:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('order', '0006_order_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderproduct',
+            name='content_hash',
+            field=models.CharField(blank=True, editable=False, help_text='Hash of the snapshotted store, sku, name and description.', max_length=64, null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='orderproduct',
+            name='sku',
+            field=models.CharField(db_index=True, max_length=100),
+        ),
+        migrations.AlterField(
+            model_name='orderproductvariant',
+            name='content_hash',
+            field=models.CharField(blank=True, editable=False, help_text='Hash of the snapshotted variant id, sku, name, product, price and currency.', max_length=64, null=True, unique=True),
+        ),
+    ]
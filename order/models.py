@@ -1,7 +1,10 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
 from decimal import Decimal
 from django.conf import settings
 from django.db import models
-from django.db.models import F, Sum
+from django.db.models import F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 from django.core.validators import MinValueValidator
 from django.core.exceptions import ValidationError
@@ -11,6 +14,82 @@ from django.contrib.auth import get_user_model
 
 User = get_user_model()
 
+# Ids of orders whose totals are waiting for the end of a deferred_totals() block
+_deferred_order_totals = ContextVar('deferred_order_totals', default=None)
+
+MONEY = models.DecimalField(max_digits=10, decimal_places=2)
+
+
+def _order_totals_changed(order):
+    """Recalculate ``order``'s totals now, or when the deferred block exits."""
+    pending = _deferred_order_totals.get()
+    if pending is None:
+        order.update_totals()
+    else:
+        pending.add(order.pk)
+
+
+class OrderQuerySet(models.QuerySet):
+    def update_totals(self):
+        """
+        Recompute subtotal and total of these orders from their items with a
+        single UPDATE (one SUM subquery per order). Skips ``save()`` and the
+        Order signals, so the stores' dashboard stats are invalidated instead.
+        Returns the number of orders updated.
+        """
+        subtotal = Coalesce(
+            Subquery(
+                OrderItem.objects.filter(order=OuterRef('pk'))
+                .values('order')
+                .annotate(subtotal=Sum(F('unit_price') * F('quantity'), output_field=MONEY))
+                .values('subtotal')
+            ),
+            Value(Decimal('0.00')),
+            output_field=MONEY,
+        )
+        from .stats import invalidate_store_stats
+        invalidate_store_stats(*self.order_by().values_list('store_id', flat=True).distinct())
+        return self.update(
+            subtotal=subtotal,
+            total=subtotal + F('tax') + F('shipping_cost') - F('discount_total'),
+            updated_at=timezone.now(),
+        )
+
+    def bulk_update(self, objs, fields, batch_size=None):
+        """
+        ``bulk_update`` sends no signals; bring the tracked-field snapshots of
+        ``objs`` up to date so a later ``save()`` only reports newer changes.
+        """
+        objs = list(objs)
+        result = super().bulk_update(objs, fields, batch_size=batch_size)
+        for obj in objs:
+            obj._snapshot_tracked_fields(fields)
+        return result
+
+
+class Checkout(models.Model):
+    """
+    One checkout of a (possibly multi-store) cart; groups the per-store
+    orders it produced.
+    """
+    customer = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        related_name='checkouts',
+        null=True,
+        blank=True,
+    )
+    customer_email = models.EmailField()
+    subtotal = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    total = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Checkout #{self.id}"
+
 
 class Order(models.Model):
     """
@@ -28,6 +107,14 @@ class Order(models.Model):
         on_delete=models.PROTECT,
         related_name='orders',
     )
+    checkout = models.ForeignKey(
+        Checkout,
+        on_delete=models.SET_NULL,
+        related_name='orders',
+        null=True,
+        blank=True,
+        help_text='Checkout this order was split from (one order per store)'
+    )
     customer = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.PROTECT,
@@ -129,16 +216,89 @@ class Order(models.Model):
     placed_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = OrderQuerySet.as_manager()
+
+    # Fields whose loaded values are kept so changes are known without a query
+    TRACKED_FIELDS = ('status', 'payment_status', 'total')
+    CANCELLABLE_STATUSES = ('pending', 'processing')
+
     class Meta:
         ordering = ['-placed_at']
+        indexes = [
+            # Keyset pagination of order lists (see order/pagination.py)
+            models.Index(fields=['customer', '-placed_at', '-id']),
+            models.Index(fields=['store', '-placed_at', '-id']),
+        ]
 
     def __str__(self):
         return f"Order #{self.id} - {self.get_status_display()}"
 
+    @staticmethod
+    @contextmanager
+    def deferred_totals():
+        """
+        Suppress the per-item totals recalculation of ``OrderItem`` saves and
+        deletes inside the block; on a clean exit every touched order is
+        recalculated with one ``OrderQuerySet.update_totals()`` call. Nested
+        blocks join the outermost one. Order instances held by the caller
+        are not refreshed.
+        """
+        if _deferred_order_totals.get() is not None:
+            yield
+            return
+        pending = set()
+        token = _deferred_order_totals.set(pending)
+        try:
+            yield
+        finally:
+            _deferred_order_totals.reset(token)
+        if pending:
+            Order.objects.filter(pk__in=pending).update_totals()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._snapshot_tracked_fields()
+        return instance
+
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        self._snapshot_tracked_fields(kwargs.get('fields'))
+
+    def _snapshot_tracked_fields(self, fields=None):
+        """Record the current values of the (loaded) tracked fields."""
+        snapshot = self.__dict__.setdefault('_tracked_values', {})
+        for name in self.TRACKED_FIELDS:
+            if (fields is None or name in fields) and name in self.__dict__:
+                snapshot[name] = self.__dict__[name]
+
+    def get_changed_fields(self, update_fields=None):
+        """
+        Tracked fields whose value differs from when the order was loaded or
+        last saved, limited to ``update_fields`` when given. Always empty for
+        unsaved orders.
+        """
+        snapshot = self.__dict__.get('_tracked_values', {})
+        return {
+            name for name, value in snapshot.items()
+            if (update_fields is None or name in update_fields)
+            and self.__dict__.get(name, value) != value
+        }
+
+    def get_loaded_value(self, name, default=None):
+        """Value of tracked field ``name`` when the order was loaded or last saved."""
+        return self.__dict__.get('_tracked_values', {}).get(name, default)
+
     def save(self, *args, **kwargs):
         # Ensure total is always calculated from subtotal, tax, shipping, and discount
         self.total = self.subtotal + self.tax + self.shipping_cost - self.discount_total
+        update_fields = kwargs.get('update_fields')
+        if (update_fields is not None and 'status' not in update_fields
+                and 'payment_status' in self.get_changed_fields(update_fields)):
+            # The pre_save signal may move the status along with the payment
+            kwargs['update_fields'] = {*update_fields, 'status'}
         super().save(*args, **kwargs)
+        self._snapshot_tracked_fields(kwargs.get('update_fields'))
     
     def get_absolute_url(self):
         from django.urls import reverse
@@ -148,11 +308,10 @@ class Order(models.Model):
         """
         Update the order's subtotal and total based on its items.
         """
-        # Calculate subtotal by summing up all line totals
-        self.subtotal = sum(
-            item.unit_price * item.quantity 
-            for item in self.items.all()
-        )
+        # Calculate subtotal by summing up all line totals in the database
+        self.subtotal = self.items.aggregate(
+            subtotal=Sum(F('unit_price') * F('quantity'), output_field=MONEY)
+        )['subtotal'] or Decimal('0.00')
         
         # Calculate total including tax, shipping, and discounts
         self.total = (
@@ -168,28 +327,20 @@ class Order(models.Model):
         Check if the order can be cancelled.
         Orders can only be cancelled if they are in 'pending' or 'processing' status.
         """
-        return self.status in ['pending', 'processing']
+        return self.status in self.CANCELLABLE_STATUSES
     
     def cancel(self, user=None):
         """
-        Cancel the order if possible.
+        Cancel the order if possible, putting its items back in stock
+        (see ``order.cancellation``).
         Returns (success, message) tuple.
         """
-        if not self.can_cancel():
+        from .cancellation import cancel_orders
+
+        if not self.can_cancel() or not cancel_orders(Order.objects.filter(pk=self.pk), user=user):
             return False, "This order cannot be cancelled."
-            
-        self.status = 'cancelled'
-        self.cancelled_at = timezone.now()
-        if user:
-            self.cancelled_by = user
-        self.save(update_fields=['status', 'cancelled_at', 'cancelled_by'])
-        
-        # Restore product stock if needed
-        for item in self.items.all():
-            if item.variant:
-                item.variant.stock += item.quantity
-                item.variant.save(update_fields=['stock'])
-        
+
+        self.refresh_from_db(fields=['status', 'cancelled_at', 'cancelled_by', 'updated_at'])
         return True, "Order has been cancelled successfully."
     
     def mark_as_paid(self, payment_method=None):
@@ -213,6 +364,18 @@ class Order(models.Model):
         return dict(items_by_store)
 
 
+class OrderItemQuerySet(models.QuerySet):
+    def delete(self):
+        order_ids = set(self.values_list('order_id', flat=True))
+        result = super().delete()
+        pending = _deferred_order_totals.get()
+        if pending is None:
+            Order.objects.filter(pk__in=order_ids).update_totals()
+        else:
+            pending.update(order_ids)
+        return result
+
+
 class OrderItem(models.Model):
     """
     Represents an individual item within an order.
@@ -227,6 +390,14 @@ class OrderItem(models.Model):
         on_delete=models.PROTECT,
         related_name='order_items',
     )
+    product_variant = models.ForeignKey(
+        'product.Variant',
+        on_delete=models.SET_NULL,
+        related_name='order_items',
+        null=True,
+        blank=True,
+        help_text='Live catalog variant this line was bought from; restocked on cancellation.'
+    )
     quantity = models.PositiveIntegerField(
         default=1,
         validators=[MinValueValidator(1)]
@@ -249,6 +420,8 @@ class OrderItem(models.Model):
         validators=[MinValueValidator(Decimal('0.00'))]
     )
 
+    objects = OrderItemQuerySet.as_manager()
+
     class Meta:
         ordering = ['id']
         verbose_name = 'Order Item'
@@ -266,14 +439,11 @@ class OrderItem(models.Model):
     
     def save(self, *args, **kwargs):
         """
-        Override save to update order totals when an item is saved.
+        Override save to update order totals when an item is saved
+        (deferred inside ``Order.deferred_totals()``).
         """
-        is_new = self._state.adding
         super().save(*args, **kwargs)
-        
-        # Update order totals if this is a new item or quantity/price changed
-        if is_new or self.order.items.count() == 1:
-            self.order.update_totals()
+        _order_totals_changed(self.order)
     
     def delete(self, *args, **kwargs):
         """
@@ -281,7 +451,7 @@ class OrderItem(models.Model):
         """
         order = self.order
         super().delete(*args, **kwargs)
-        order.update_totals()
+        _order_totals_changed(order)
 
 
 class StoreStaff(models.Model):
@@ -325,6 +495,10 @@ class OrderProduct(models.Model):
     """
     Order-specific product information within a store. 
     On creation, a default variant is generated.
+
+    Checkout snapshots are addressed by ``content_hash``: renaming a product
+    or changing its description produces a new row rather than reusing the
+    one past orders point at.
     """
     store = models.ForeignKey(
         StoreModel,
@@ -333,7 +507,15 @@ class OrderProduct(models.Model):
     )
     name = models.CharField(max_length=255)
     description = models.TextField(blank=True)
-    sku = models.CharField(max_length=100, unique=True)
+    sku = models.CharField(max_length=100, db_index=True)
+    content_hash = models.CharField(
+        max_length=64,
+        unique=True,
+        null=True,
+        blank=True,
+        editable=False,
+        help_text='Hash of the snapshotted store, sku, name and description.'
+    )
     created_at = models.DateTimeField(default=timezone.now)
 
     def save(self, *args, **kwargs):
@@ -355,6 +537,10 @@ class OrderProductVariant(models.Model):
     """
     Variants of an order product (e.g., size/color). 
     Each variant gets its own price and optional image.
+
+    Checkout snapshots are immutable and addressed by ``content_hash``: a
+    change of name or price produces a new row, so the lines of past orders
+    keep the price they were sold at.
     """
     product = models.ForeignKey(
         OrderProduct,
@@ -362,7 +548,15 @@ class OrderProductVariant(models.Model):
         related_name="variants",
     )
     name = models.CharField(max_length=255)
-    sku = models.CharField(max_length=100, unique=True)
+    sku = models.CharField(max_length=100, db_index=True)
+    content_hash = models.CharField(
+        max_length=64,
+        unique=True,
+        null=True,
+        blank=True,
+        editable=False,
+        help_text='Hash of the snapshotted variant id, sku, name, product, price and currency.'
+    )
     stock = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(default=timezone.now)
 
@@ -418,3 +612,26 @@ class OrderProductImage(models.Model):
     def __str__(self):
         target = self.variant or self.product
         return f"Image for {target}"
+
+
+class IdempotencyKey(models.Model):
+    """
+    Outcome of a request made with an idempotency key, replayed when the
+    same client repeats the key within its TTL (see ``order.idempotency``).
+    ``status_code`` stays null while the first request is still running.
+    """
+    owner = models.CharField(max_length=100, help_text='user:<id> or session:<key>')
+    scope = models.CharField(max_length=50)
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64, help_text='SHA-256 of method, path and body')
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.TextField(blank=True)
+    response_headers = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        unique_together = ('owner', 'scope', 'key')
+
+    def __str__(self):
+        return f"{self.scope}:{self.key} ({self.owner})"
@@ -0,0 +1,161 @@
+"""
+Keyset ("cursor") pagination for order lists.
+
+``OFFSET`` pagination makes the database walk and discard every row before
+the requested page, and Django's ``Paginator`` adds a ``COUNT(*)`` of the
+whole queryset, so deep pages of a long order history get slower and
+slower. ``CursorPaginator`` instead seeks past the last row shown using the
+ordering columns (by default ``placed_at`` and ``id``, covered by the
+composite indexes on ``Order``), so every page costs the same. Pages are
+addressed by opaque ``next``/``previous`` tokens rather than by number;
+the total is only counted on request, and only up to ``count_limit``.
+
+Usage::
+
+    paginator = CursorPaginator(Order.objects.filter(customer=user), 10)
+    page = paginator.get_page(request.GET.get('cursor'))
+    # page.next_cursor, page.previous_cursor, paginator.approximate_count
+"""
+import base64
+import binascii
+import json
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+CURSOR_PARAM = 'cursor'
+NEXT, PREVIOUS = 'n', 'p'
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class CursorPage:
+    """One page of objects plus the tokens of its neighbours."""
+
+    def __init__(self, paginator, object_list, next_cursor=None, previous_cursor=None):
+        self.paginator = paginator
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __repr__(self):
+        return f'<CursorPage of {len(self.object_list)} objects>'
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class CursorPaginator:
+    """
+    Paginate ``queryset`` by keyset on ``ordering``, whose last field must
+    be unique (e.g. ``id``) so every row has a distinct position.
+    """
+
+    def __init__(self, queryset, per_page, ordering=('-placed_at', '-id'), count_limit=1000):
+        self.per_page = int(per_page)
+        self.count_limit = count_limit
+        self.ordering = [
+            (field.lstrip('-'), field.startswith('-')) for field in ordering
+        ]
+        self.queryset = queryset.order_by(*ordering)
+
+    def _field(self, name):
+        opts = self.queryset.model._meta
+        return opts.pk if name == 'pk' else opts.get_field(name)
+
+    def encode_cursor(self, obj, direction):
+        values = [getattr(obj, self._field(name).attname) for name, _ in self.ordering]
+        payload = json.dumps({'d': direction, 'v': values}, default=str, separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        """Return ``(direction, values)`` for a token made by ``encode_cursor``."""
+        try:
+            data = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+            direction, values = data['d'], data['v']
+            if direction not in (NEXT, PREVIOUS) or len(values) != len(self.ordering):
+                raise InvalidCursor(cursor)
+            return direction, [
+                self._field(name).to_python(value)
+                for (name, _), value in zip(self.ordering, values)
+            ]
+        except (binascii.Error, UnicodeDecodeError, ValueError, TypeError, KeyError,
+                FieldDoesNotExist, ValidationError) as e:
+            raise InvalidCursor(cursor) from e
+
+    def _seek(self, values, forward):
+        """Rows after (``forward``) or before the position ``values``."""
+        condition = Q()
+        equal = Q()
+        for (name, descending), value in zip(self.ordering, values):
+            lookup = 'lt' if descending == forward else 'gt'
+            condition |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        return condition
+
+    def page(self, cursor=None):
+        """Return the page at ``cursor`` (the first page for None)."""
+        if not cursor:
+            rows = list(self.queryset[:self.per_page + 1])
+            next_cursor = None
+            if len(rows) > self.per_page:
+                rows = rows[:self.per_page]
+                next_cursor = self.encode_cursor(rows[-1], NEXT)
+            return CursorPage(self, rows, next_cursor=next_cursor)
+
+        direction, values = self.decode_cursor(cursor)
+        forward = direction == NEXT
+        queryset = self.queryset.filter(self._seek(values, forward))
+        if not forward:
+            queryset = queryset.reverse()
+        rows = list(queryset[:self.per_page + 1])
+        more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if not rows:
+            # Nothing left on that side (e.g. rows were deleted)
+            return self.page()
+        if not forward:
+            rows.reverse()
+        return CursorPage(
+            self, rows,
+            next_cursor=self.encode_cursor(rows[-1], NEXT) if not forward or more else None,
+            previous_cursor=self.encode_cursor(rows[0], PREVIOUS) if forward or more else None,
+        )
+
+    def get_page(self, cursor=None):
+        """Like ``page()``, but an invalid token gives the first page."""
+        try:
+            return self.page(cursor)
+        except InvalidCursor:
+            return self.page()
+
+    @cached_property
+    def approximate_count(self):
+        """
+        Number of rows, counted no further than ``count_limit`` so the
+        query stays cheap; check ``count_is_exact`` before showing it as
+        a total.
+        """
+        return self.queryset.order_by().values('pk')[:self.count_limit + 1].count()
+
+    @property
+    def count_is_exact(self):
+        return self.approximate_count <= self.count_limit
@@ -1,22 +1,19 @@
-from django.db.models.signals import pre_save, post_save
+from django.db.models.signals import pre_save, post_save, post_delete
 from django.dispatch import receiver
-from .models import Order
+from .checkout import snapshot_cache
+from .models import Order, OrderProductVariant
+from . import stats
 
 @receiver(pre_save, sender=Order)
-def update_order_status_on_payment(sender, instance, **kwargs):
+def update_order_status_on_payment(sender, instance, update_fields=None, **kwargs):
     """
     Update order status based on payment status changes.
     """
-    if not instance.pk:
+    if instance._state.adding:
         return  # New order being created
     
-    try:
-        old_instance = Order.objects.get(pk=instance.pk)
-    except Order.DoesNotExist:
-        return  # No existing order found
-    
-    # Check if payment status has changed
-    if old_instance.payment_status != instance.payment_status:
+    # Check if payment status has changed (tracked in memory, no query)
+    if 'payment_status' in instance.get_changed_fields(update_fields):
         # If payment is marked as paid, update order status to processing
         if instance.payment_status == 'paid' and instance.status == 'pending':
             instance.status = 'processing'
@@ -26,20 +23,56 @@ def update_order_status_on_payment(sender, instance, **kwargs):
             # TODO: Send notification to admin about failed payment
 
 @receiver(post_save, sender=Order)
-def order_status_changed(sender, instance, created, **kwargs):
+def order_status_changed(sender, instance, created, update_fields=None, **kwargs):
     """
     Handle actions when order status changes.
     """
     if created:
         return  # Skip for new orders
     
-    try:
-        old_instance = Order.objects.get(pk=instance.pk)
-    except Order.DoesNotExist:
-        return  # No existing order found
-    
-    # Check if status has changed
-    if old_instance.status != instance.status:
+    # Check if status has changed; the snapshot still holds the old values
+    # until Order.save() returns
+    if 'status' in instance.get_changed_fields(update_fields):
         # TODO: Send email notification about status change
         # TODO: Update inventory based on status change
         pass
+
+
+
+@receiver(post_save, sender=Order)
+def update_store_stats_on_save(sender, instance, created, update_fields=None, **kwargs):
+    """
+    Adjust the store's cached dashboard counters (see ``order.stats``).
+    """
+    if created:
+        stats.record_orders_created([instance])
+        return
+    changed = instance.get_changed_fields(update_fields) & {'status', 'total'}
+    if changed:
+        # Fields left out of update_fields keep their stored value
+        old_status = instance.get_loaded_value('status')
+        old_total = instance.get_loaded_value('total')
+        stats.record_order_changed(
+            instance.store_id,
+            old_status, old_total,
+            instance.status if 'status' in changed else old_status,
+            instance.total if 'total' in changed else old_total,
+        )
+
+
+@receiver(post_delete, sender=Order)
+def update_store_stats_on_delete(sender, instance, **kwargs):
+    stats.record_order_deleted(instance)
+
+
+@receiver(post_delete, sender=OrderProductVariant)
+def forget_deleted_snapshot(sender, instance, **kwargs):
+    """
+    Drop a deleted snapshot from this process's checkout cache. Other
+    processes find out on their next checkout, which confirms cached ids
+    against the database. Snapshots are protected by the order items that
+    use them, so they are only deleted in maintenance (e.g. with their test
+    orders).
+    """
+    if instance.content_hash:
+        snapshot_cache.discard(instance.content_hash)
@@ -0,0 +1,174 @@
+"""
+Per-store order statistics (number and amount of orders per status) for the
+store dashboard.
+
+``store_order_stats`` computes them with one conditional aggregation and
+keeps them in the cache as integer counters, a count and an amount in cents
+per status. Order events then adjust the counters with ``cache.incr``
+instead of recomputing them: ``order.signals`` handles ``Order`` saves and
+deletes, and the bulk paths that skip signals (checkout, cancellation, the
+admin status actions, ``OrderQuerySet.update_totals``) report their changes
+here themselves. Adjustments are applied when the transaction commits. If a
+counter was evicted in the meantime the store's counters are dropped and
+rebuilt on the next read; ``STORE_STATS_CACHE_TIMEOUT`` bounds the drift
+from any write that bypasses all of these paths.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Q, Sum, Value
+from django.db.models.functions import Coalesce
+
+from .models import MONEY, Order
+
+STATUSES = [status for status, _ in Order.STATUS_CHOICES]
+MEASURES = ('count', 'cents')
+
+
+def stats_timeout():
+    return getattr(settings, 'STORE_STATS_CACHE_TIMEOUT', 60 * 60)
+
+
+def _key(store_id, status, measure):
+    return f'store-order-stats:{store_id}:{status}:{measure}'
+
+
+def _store_keys(store_id):
+    return {
+        (status, measure): _key(store_id, status, measure)
+        for status in STATUSES for measure in MEASURES
+    }
+
+
+def _cents(amount):
+    return int((amount or 0) * 100)
+
+
+def compute_store_stats(store_id):
+    """``{status: {'count': n, 'amount': Decimal}}`` for the store, in one query."""
+    aggregates = {}
+    for status in STATUSES:
+        in_status = Q(status=status)
+        aggregates[f'{status}_count'] = Count('pk', filter=in_status)
+        aggregates[f'{status}_amount'] = Coalesce(
+            Sum('total', filter=in_status), Value(Decimal('0.00')), output_field=MONEY
+        )
+    row = Order.objects.filter(store_id=store_id).aggregate(**aggregates)
+    return {
+        status: {'count': row[f'{status}_count'], 'amount': row[f'{status}_amount']}
+        for status in STATUSES
+    }
+
+
+def store_order_stats(store_id):
+    """
+    The store's per-status counts and amounts, from the cache when every
+    counter is there (no query), otherwise recomputed and cached.
+    """
+    keys = _store_keys(store_id)
+    cached = cache.get_many(keys.values())
+    if len(cached) == len(keys):
+        return {
+            status: {
+                'count': cached[keys[status, 'count']],
+                'amount': Decimal(cached[keys[status, 'cents']]).scaleb(-2),
+            }
+            for status in STATUSES
+        }
+
+    stats = compute_store_stats(store_id)
+    counters = {}
+    for status, values in stats.items():
+        counters[keys[status, 'count']] = values['count']
+        counters[keys[status, 'cents']] = _cents(values['amount'])
+    cache.set_many(counters, stats_timeout())
+    return stats
+
+
+def _drop(store_ids):
+    cache.delete_many([key for store_id in store_ids for key in _store_keys(store_id).values()])
+
+
+def invalidate_store_stats(*store_ids):
+    """Rebuild the stats of ``store_ids`` on their next read (after commit)."""
+    store_ids = set(store_ids)
+    if store_ids:
+        transaction.on_commit(lambda: _drop(store_ids))
+
+
+def _apply(deltas):
+    stale = set()
+    for (store_id, status), (count, amount) in deltas.items():
+        try:
+            if count:
+                cache.incr(_key(store_id, status, 'count'), count)
+            if amount:
+                cache.incr(_key(store_id, status, 'cents'), _cents(amount))
+        except ValueError:
+            # Counter missing: rebuild the whole store rather than mixing
+            # fresh and incremented values
+            stale.add(store_id)
+    if stale:
+        _drop(stale)
+
+
+def apply_deltas(deltas):
+    """
+    Add ``{(store_id, status): (count, amount)}`` to the cached counters
+    once the current transaction commits.
+    """
+    deltas = {key: value for key, value in deltas.items() if any(value)}
+    if deltas:
+        transaction.on_commit(lambda: _apply(deltas))
+
+
+def record_orders_created(orders):
+    deltas = defaultdict(lambda: [0, Decimal('0.00')])
+    for order in orders:
+        delta = deltas[order.store_id, order.status]
+        delta[0] += 1
+        delta[1] += order.total
+    apply_deltas(deltas)
+
+
+def record_order_deleted(order):
+    apply_deltas({(order.store_id, order.status): (-1, -order.total)})
+
+
+def record_order_changed(store_id, old_status, old_total, new_status, new_total):
+    """An order of the store was saved with a new status and/or total."""
+    if None in (old_status, old_total, new_status, new_total):
+        # Some value was never loaded, so the delta is unknown
+        invalidate_store_stats(store_id)
+        return
+    deltas = defaultdict(lambda: [0, Decimal('0.00')])
+    deltas[store_id, old_status][0] -= 1
+    deltas[store_id, old_status][1] -= old_total
+    deltas[store_id, new_status][0] += 1
+    deltas[store_id, new_status][1] += new_total
+    apply_deltas(deltas)
+
+
+def status_change_deltas(orders, status):
+    """
+    Deltas for moving every order of the ``orders`` queryset to ``status``;
+    read them (one grouped query) before running the UPDATE and pass them
+    to ``apply_deltas`` after it.
+    """
+    deltas = defaultdict(lambda: [0, Decimal('0.00')])
+    grouped = (
+        orders.exclude(status=status)
+        .order_by()
+        .values('store_id', 'status')
+        .annotate(orders=Count('pk'), amount=Sum('total'))
+        .values_list('store_id', 'status', 'orders', 'amount')
+    )
+    for store_id, old_status, count, amount in grouped:
+        deltas[store_id, old_status][0] -= count
+        deltas[store_id, old_status][1] -= amount
+        deltas[store_id, status][0] += count
+        deltas[store_id, status][1] += amount
+    return deltas
@@ -1,3 +1,704 @@
-from django.test import TestCase
+import base64
+import io
+import json
+import random
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import OperationalError, connection, transaction
+from django.contrib.messages import get_messages
+from django.test import RequestFactory, TestCase, TransactionTestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from cart.models import Cart
+from customer.models import Address, Customer
+from product.models import Product, Variant
+from store.models import Store
+from .checkout import InsufficientStock, place_checkout, snapshot_cache, snapshot_hash
+from .idempotency import REPLAYED_HEADER, request_fingerprint
+from .management.commands.process_orders import Checkpoint
+from .pagination import CursorPaginator, InvalidCursor
+from .models import Checkout, IdempotencyKey, Order, OrderItem, OrderProduct, OrderProductVariant
+from .stats import compute_store_stats, store_order_stats
+
+User = get_user_model()
+
+
+class ConcurrentCheckoutTests(TransactionTestCase):
+    """
+    Many threads check out carts holding the same scarce variants, added in
+    a random order (a non-deterministic lock order would deadlock). Stock
+    must never go below zero and must drop by exactly the units sold.
+
+    SQLite serializes writers, so there it checks the outcome under
+    contention; run it on PostgreSQL or MySQL (``DATABASE_URL``) to exercise
+    the row locks.
+    """
+    THREADS = 8
+    ORDERS_PER_THREAD = 5
+    VARIANTS = 3
+    STOCK = 12
+    RETRIES = 20
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('needs a test database file on SQLite (set DB_TEST_NAME)')
+        cache.clear()
+        snapshot_cache.clear()
+        owner = User.objects.create_user('owner', 'owner@example.com', 'pw')
+        store = Store.objects.create(name='Shop', tagline='t', owner=owner)
+        product = Product.objects.create(store=store, name='Scarce', slug='scarce')
+        self.variants = [
+            Variant.objects.create(
+                product=product, name=f'V{n}', sku=f'SCARCE-{n}', default_price=1, stock=self.STOCK,
+            )
+            for n in range(self.VARIANTS)
+        ]
+        self.users = [User.objects.create_user(f'buyer-{n}') for n in range(self.THREADS)]
+
+    def checkout(self, user, rng):
+        """Place one order; returns its outcome and the deadlocks seen."""
+        deadlocks = 0
+        for attempt in range(self.RETRIES + 1):
+            try:
+                with transaction.atomic():
+                    cart = Cart.objects.create(user=user, is_active=False)
+                    for variant in rng.sample(self.variants, len(self.variants)):
+                        cart.add_variant(variant, 1)
+                    place_checkout(cart, customer=user, customer_email='buyer@example.com')
+                return 'placed', deadlocks
+            except InsufficientStock:
+                return 'rejected', deadlocks
+            except OperationalError as e:
+                # Lock timeouts (SQLite's "database is locked") are retried;
+                # deadlocks would mean the lock order is broken
+                if 'deadlock' in str(e).lower():
+                    deadlocks += 1
+                time.sleep(rng.uniform(0.005, 0.02) * (attempt + 1))
+        return 'failed', deadlocks
+
+    def test_concurrent_checkouts_never_oversell_or_deadlock(self):
+        outcomes = Counter()
+        errors = []
+        lock = threading.Lock()
+        barrier = threading.Barrier(self.THREADS)
+
+        def worker(user):
+            rng = random.Random(user.pk)
+            try:
+                barrier.wait()
+                for _ in range(self.ORDERS_PER_THREAD):
+                    outcome, deadlocks = self.checkout(user, rng)
+                    with lock:
+                        outcomes[outcome] += 1
+                        outcomes['deadlocks'] += deadlocks
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(user,)) for user in self.users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(outcomes['failed'], 0)
+        self.assertEqual(outcomes['deadlocks'], 0)
+        # Demand exceeds supply, so every unit sells and the rest is refused
+        self.assertEqual(outcomes['placed'], self.STOCK)
+        self.assertEqual(outcomes['rejected'], self.THREADS * self.ORDERS_PER_THREAD - self.STOCK)
+        self.assertEqual(Order.objects.count(), self.STOCK)
+        for variant in self.variants:
+            variant.refresh_from_db()
+            self.assertEqual(variant.stock, 0)
+
+
+class CheckoutIdempotencyTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        snapshot_cache.clear()
+        self.user = User.objects.create_user('buyer', 'buyer@example.com', 'pw')
+        store = Store.objects.create(name='Shop', tagline='t', owner=self.user)
+        product = Product.objects.create(store=store, name='Tee', slug='tee')
+        self.variant = Variant.objects.create(product=product, name='M', sku='TEE-M', default_price='10.00', stock=5)
+        customer = Customer.objects.create(user=self.user, store=store, email='buyer@example.com')
+        address = Address.objects.create(
+            customer=customer, address_type='shipping', first_name='B', last_name='Uyer',
+            street_address_1='1 Road', city='Town', state='ST', postal_code='1000', country='US',
+        )
+        Cart.objects.create(user=self.user).add_variant(self.variant, 2)
+        self.client.force_login(self.user)
+        self.url = reverse('order:process_checkout')
+        self.data = {
+            'idempotency_key': 'k1', 'shipping_address': address.pk, 'billing_address': address.pk,
+            'email': 'buyer@example.com', 'phone': '555',
+        }
+
+    def test_placed_order_is_replayed(self):
+        first = self.client.post(self.url, self.data)
+        second = self.client.post(self.url, self.data)
+
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(second.status_code, 302)
+        self.assertEqual(second['Location'], first['Location'])
+        self.assertEqual(second[REPLAYED_HEADER], 'true')
+
+    def test_failed_checkout_releases_the_key(self):
+        Variant.objects.filter(pk=self.variant.pk).update(stock=1)
+
+        response = self.client.post(self.url, self.data)
+
+        self.assertRedirects(response, reverse('cart:view'), fetch_redirect_response=False)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+        # Restocked, the same submission goes through
+        Variant.objects.filter(pk=self.variant.pk).update(stock=5)
+        response = self.client.post(self.url, self.data)
+
+        self.assertFalse(response.has_header(REPLAYED_HEADER))
+        self.assertEqual(Order.objects.count(), 1)
+        self.variant.refresh_from_db()
+        self.assertEqual(self.variant.stock, 3)
+
+    def test_invalid_form_releases_the_key(self):
+        response = self.client.post(self.url, {**self.data, 'phone': ''})
+
+        self.assertRedirects(response, reverse('order:checkout'), fetch_redirect_response=False)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+    def claim(self, data):
+        """Claim ``k1`` as a still-running submission of ``data`` would."""
+        IdempotencyKey.objects.create(
+            owner=f'user:{self.user.pk}', scope='checkout', key='k1',
+            fingerprint=request_fingerprint(RequestFactory().post(self.url, data)),
+            expires_at=timezone.now() + timedelta(hours=1),
+        )
+
+    def test_double_submit_while_running_redirects_to_order_history(self):
+        self.claim(self.data)
+
+        response = self.client.post(self.url, self.data)
+
+        self.assertRedirects(response, reverse('order:order_history'), fetch_redirect_response=False)
+        self.assertIn('already being placed', [str(m) for m in get_messages(response.wsgi_request)][0])
+        self.assertFalse(Order.objects.exists())
+        self.assertIsNone(IdempotencyKey.objects.get().status_code)
+
+    def test_changed_resubmission_redirects_to_the_checkout_form(self):
+        self.claim({**self.data, 'phone': '556'})
+
+        response = self.client.post(self.url, self.data)
+
+        self.assertRedirects(response, reverse('order:checkout'), fetch_redirect_response=False)
+        self.assertFalse(Order.objects.exists())
+
+
+class CheckoutSnapshotTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        snapshot_cache.clear()
+        self.user = User.objects.create_user('buyer', 'buyer@example.com', 'pw')
+        store = Store.objects.create(name='Shop', tagline='t', owner=self.user)
+        self.product = Product.objects.create(store=store, name='Tee', slug='tee', description='Cotton')
+        self.variant = Variant.objects.create(
+            product=self.product, name='M', sku='TEE-M', default_price='10.00', stock=10,
+        )
+
+    def order_once(self):
+        cart = Cart.objects.create(user=self.user, is_active=False)
+        cart.add_variant(self.variant, 1)
+        order = place_checkout(cart, customer=self.user, customer_email='buyer@example.com').orders.get()
+        return order.items.select_related('variant__product').get().variant
+
+    def test_unchanged_product_reuses_its_snapshot(self):
+        first = self.order_once()
+        snapshot_cache.clear()
+
+        self.assertEqual(self.order_once(), first)
+        self.assertEqual(OrderProduct.objects.count(), 1)
+
+    def test_product_changes_are_snapshotted(self):
+        first = self.order_once()
+        self.product.name = 'Organic Tee'
+        self.product.save()
+        renamed = self.order_once()
+        self.product.description = 'Organic cotton'
+        self.product.save()
+        redescribed = self.order_once()
+
+        self.assertEqual(OrderProduct.objects.count(), 3)
+        self.assertEqual((first.product.name, first.product.description), ('Tee', 'Cotton'))
+        self.assertEqual((renamed.product.name, renamed.product.description), ('Organic Tee', 'Cotton'))
+        self.assertEqual(
+            (redescribed.product.name, redescribed.product.description), ('Organic Tee', 'Organic cotton')
+        )
+        self.assertEqual({first.sku, renamed.sku, redescribed.sku}, {'TEE-M'})
+
+    def test_stale_cached_snapshot_ids_are_replaced(self):
+        first = self.order_once()
+        key = snapshot_hash(self.variant, self.variant.default_price)
+        self.assertEqual(first.content_hash, key)
+
+        # Left behind by another process's delete or a rolled-back test
+        snapshot_cache.set_many({key: first.pk + 100})
+        self.assertEqual(self.order_once(), first)
+
+        # Deleted by another process, whose signal clears only its own cache
+        Order.objects.all().delete()
+        OrderProductVariant.objects.filter(pk=first.pk).delete()
+        snapshot_cache.set_many({key: first.pk})
+        again = self.order_once()
+
+        self.assertNotEqual(again.pk, first.pk)
+        self.assertEqual(again.content_hash, key)
+        self.assertEqual(snapshot_cache.get_many([key]), {})
+
+    def test_cached_id_of_another_snapshot_is_not_used(self):
+        first = self.order_once()
+        other = Variant.objects.create(
+            product=self.product, name='L', sku='TEE-L', default_price='12.00', stock=10,
+        )
+        key = snapshot_hash(other, other.default_price)
+        snapshot_cache.set_many({key: first.pk})
+
+        cart = Cart.objects.create(user=self.user, is_active=False)
+        cart.add_variant(other, 1)
+        order = place_checkout(cart, customer=self.user, customer_email='buyer@example.com').orders.get()
+
+        snapshot = order.items.get().variant
+        self.assertNotEqual(snapshot.pk, first.pk)
+        self.assertEqual((snapshot.sku, snapshot.content_hash), ('TEE-L', key))
+
+
+class ProcessOrdersTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        owner = User.objects.create_user('owner', 'owner@example.com', 'pw')
+        store = Store.objects.create(name='Shop', tagline='t', owner=owner)
+        Order.objects.bulk_create([Order(store=store, customer_email='buyer@example.com') for _ in range(40)])
+        Order.objects.update(placed_at=timezone.now() - timedelta(days=2))
+        self.ids = list(Order.objects.order_by('pk').values_list('pk', flat=True))
+
+    def test_workers_fall_back_to_one_without_skip_locked(self):
+        stdout, stderr = io.StringIO(), io.StringIO()
+        call_command('process_orders', batch_size=5, workers=3, stdout=stdout, stderr=stderr)
+
+        if not connection.features.has_select_for_update_skip_locked:
+            self.assertIn('running 1 worker instead of 3', stderr.getvalue())
+        self.assertIn('Cancelled 40 expired order(s)', stdout.getvalue())
+        self.assertEqual(Order.objects.filter(status='cancelled').count(), 40)
+
+    def test_resume_waits_for_batches_other_copies_have_in_flight(self):
+        orders = Order.objects.all()
+        first = Checkpoint('test')
+        lower, batch = first.claim(orders, 5)
+        self.assertEqual((lower, batch), (0, self.ids[:5]))
+
+        # A second copy takes the next batch and finishes the phase (SKIP
+        # LOCKED passes over the first batch; SQLite has no row locks)
+        second = Checkpoint('test')
+        second.high = batch[-1]
+        second_lower, _ = second.claim(orders, 5)
+        second.done(second_lower)
+        second.finish()
+
+        # The first copy's batch is still unfinished, so a resume starts before it
+        self.assertEqual(Checkpoint('test').resumed_from, 0)
+
+    def test_stale_run_is_adopted(self):
+        crashed = Checkpoint('test')
+        crashed.claim(Order.objects.all(), 5)
+        crashed.done(0)
+        with crashed.runs() as runs:
+            runs[crashed.run_id] = (runs[crashed.run_id][0], 0)
+
+        resumed = Checkpoint('test')
+
+        self.assertEqual(resumed.resumed_from, self.ids[4])
+        with resumed.runs() as runs:
+            self.assertEqual(list(runs), [resumed.run_id])
+
+    def test_restart_ignores_checkpoints(self):
+        interrupted = Checkpoint('test')
+        interrupted.claim(Order.objects.all(), 5)
+        interrupted.done(0)
+        self.assertEqual(Checkpoint('test').resumed_from, self.ids[4])
+
+        self.assertEqual(Checkpoint('test', restart=True).resumed_from, 0)
+
+
+class OrderChangeTrackingTests(TestCase):
+    """Tracked-field changes reach the signal receivers once, and only real changes do."""
+
+    def setUp(self):
+        cache.clear()
+        snapshot_cache.clear()
+        user = User.objects.create_user('buyer', 'buyer@example.com', 'pw')
+        store = Store.objects.create(name='Shop', tagline='t', owner=user)
+        product = Product.objects.create(store=store, name='Tee', slug='tee')
+        variant = Variant.objects.create(product=product, name='M', sku='TEE-M', default_price='10.00', stock=10)
+        cart = Cart.objects.create(user=user)
+        cart.add_variant(variant, 2)
+        pk = place_checkout(cart, customer=user, customer_email='buyer@example.com').orders.get().pk
+        self.order = Order.objects.get(pk=pk)
+        self.store_id = store.pk
+        patcher = mock.patch('order.stats.record_order_changed')
+        self.changed = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def assertReported(self, *calls):
+        self.assertEqual(
+            self.changed.call_args_list,
+            [mock.call(self.store_id, *call) for call in calls],
+        )
+
+    def test_status_change_is_reported_once(self):
+        self.order.status = 'processing'
+        self.order.save()
+        self.order.save()
+
+        self.assertReported(('pending', Decimal('20.00'), 'processing', Decimal('20.00')))
+
+    def test_unchanged_save_reports_nothing(self):
+        self.order.save()
+        Order.objects.get(pk=self.order.pk).save()
+        self.order.notes = 'Leave at the door'
+        self.order.save(update_fields=['notes'])
+
+        self.assertEqual(self.order.get_changed_fields(), set())
+        self.assertReported()
+
+    def test_update_fields_limits_the_changes(self):
+        self.order.status = 'processing'
+        self.order.notes = 'Rush'
+        self.order.save(update_fields=['notes'])
+        self.assertReported()
+        self.assertEqual(self.order.get_changed_fields(), {'status'})
+
+        self.order.save(update_fields=['status'])
+        self.order.save(update_fields=['status'])
+
+        self.assertReported(('pending', Decimal('20.00'), 'processing', Decimal('20.00')))
+        self.assertEqual(Order.objects.get(pk=self.order.pk).status, 'processing')
+
+    def test_payment_status_moves_the_status_once(self):
+        self.order.payment_status = 'paid'
+        self.order.save(update_fields=['payment_status'])
+        self.order.save(update_fields=['payment_status'])
+
+        self.assertReported(('pending', Decimal('20.00'), 'processing', Decimal('20.00')))
+        self.assertEqual(
+            Order.objects.filter(pk=self.order.pk).values_list('status', 'payment_status').get(),
+            ('processing', 'paid'),
+        )
+
+    def test_total_change_is_reported_once(self):
+        self.order.tax = Decimal('5.00')
+        self.order.save()
+        self.order.save()
+
+        self.assertReported(('pending', Decimal('20.00'), 'pending', Decimal('25.00')))
+
+    def test_bulk_update_is_not_reported_again_by_a_later_save(self):
+        self.order.status = 'completed'
+        Order.objects.bulk_update([self.order], ['status'])
+        self.assertEqual(self.order.get_changed_fields(), set())
+
+        self.order.save()
+
+        self.assertReported()
+
+    def test_item_change_reports_the_new_total_once(self):
+        item = self.order.items.get()
+        item.quantity = 3
+        item.save()
+
+        self.assertReported(('pending', Decimal('20.00'), 'pending', Decimal('30.00')))
+
+    def test_queryset_update_totals_invalidates_instead_of_reporting(self):
+        OrderItem.objects.filter(order=self.order).update(quantity=4)
+        with mock.patch('order.stats.invalidate_store_stats') as invalidate:
+            Order.objects.filter(pk=self.order.pk).update_totals()
+
+        invalidate.assert_called_once_with(self.store_id)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.total, Decimal('40.00'))
+        self.order.save()
+        self.assertReported()
+
+
+class StoreOrderStatsTests(TestCase):
+    """The cache.incr counters agree with a full recomputation after every change."""
+
+    def setUp(self):
+        cache.clear()
+        snapshot_cache.clear()
+        self.user = User.objects.create_user('buyer', 'buyer@example.com', 'pw')
+        self.store = Store.objects.create(name='Shop', tagline='t', owner=self.user)
+        product = Product.objects.create(store=self.store, name='Tee', slug='tee')
+        self.variants = [
+            Variant.objects.create(
+                product=product, name=size, sku=f'TEE-{size}', default_price=price, stock=10,
+            )
+            for size, price in (('M', '10.00'), ('L', '12.50'))
+        ]
+
+    def checkout(self, *quantities):
+        cart = Cart.objects.create(user=self.user, is_active=False)
+        for variant, quantity in zip(self.variants, quantities):
+            cart.add_variant(variant, quantity)
+        with self.captureOnCommitCallbacks(execute=True):
+            checkout = place_checkout(cart, customer=self.user, customer_email='buyer@example.com')
+        return checkout.orders.get()
+
+    def assertStatsMatch(self, incremental=True):
+        """The cached stats equal the one-query aggregate; ``incremental``: no rebuild was needed."""
+        if incremental:
+            with self.assertNumQueries(0):
+                cached = store_order_stats(self.store.pk)
+        else:
+            cached = store_order_stats(self.store.pk)
+        self.assertEqual(cached, compute_store_stats(self.store.pk))
+
+    def test_counters_follow_order_changes(self):
+        # Counters are only kept once the dashboard has read them
+        self.assertEqual(store_order_stats(self.store.pk)['pending'], {'count': 0, 'amount': Decimal('0.00')})
+
+        paid = self.checkout(1, 2)
+        cancelled = self.checkout(3)
+        self.assertStatsMatch()
+        self.assertEqual(store_order_stats(self.store.pk)['pending']['amount'], Decimal('65.00'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            paid.mark_as_paid()
+        self.assertStatsMatch()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(cancelled.cancel(self.user)[0])
+        self.assertStatsMatch()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            paid.status = 'completed'
+            paid.save(update_fields=['status'])
+        self.assertStatsMatch()
+
+        # Deferred totals are applied in bulk, which rebuilds the counters
+        with self.captureOnCommitCallbacks(execute=True):
+            with Order.deferred_totals():
+                for item in paid.items.all():
+                    item.quantity += 1
+                    item.save()
+        self.assertStatsMatch(incremental=False)
+        self.assertEqual(store_order_stats(self.store.pk)['completed']['amount'], Decimal('57.50'))
+
+        # A rolled-back change adjusts nothing
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    cart = Cart.objects.create(user=self.user, is_active=False)
+                    cart.add_variant(self.variants[0], 1)
+                    place_checkout(cart, customer=self.user, customer_email='buyer@example.com')
+                    paid.status = 'processing'
+                    paid.save()
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+        self.assertStatsMatch()
+        self.assertEqual(store_order_stats(self.store.pk)['pending'], {'count': 0, 'amount': Decimal('0.00')})
+
+
+class CursorPaginatorTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('buyer', 'buyer@example.com', 'pw')
+        self.store = Store.objects.create(name='Shop', tagline='t', owner=self.user)
+        Order.objects.bulk_create([
+            Order(store=self.store, customer=self.user, customer_email='buyer@example.com') for _ in range(25)
+        ])
+        # Groups of four orders share a placed_at, so pages split them
+        start = timezone.now() - timedelta(days=1)
+        orders = list(Order.objects.order_by('pk'))
+        for n, order in enumerate(orders):
+            order.placed_at = start + timedelta(minutes=n // 4)
+        Order.objects.bulk_update(orders, ['placed_at'])
+        self.expected = list(Order.objects.order_by('-placed_at', '-id').values_list('pk', flat=True))
+
+    def walk(self, paginator, cursor=None, attr='next_cursor'):
+        pages = []
+        while len(pages) <= len(self.expected):
+            page = paginator.page(cursor)
+            pages.append([order.pk for order in page])
+            cursor = getattr(page, attr)
+            if cursor is None:
+                return pages, page
+        self.fail('The cursors never reached the end')
+
+    def test_next_cursors_visit_every_row_once(self):
+        pages, last = self.walk(CursorPaginator(Order.objects.all(), 3))
+
+        self.assertEqual([pk for page in pages for pk in page], self.expected)
+        self.assertEqual([len(page) for page in pages], [3] * 8 + [1])
+        self.assertFalse(last.has_next())
+        self.assertTrue(last.has_previous())
+
+    def test_previous_cursors_walk_back_to_the_first_page(self):
+        paginator = CursorPaginator(Order.objects.all(), 3)
+        forward, last = self.walk(paginator)
+
+        backward, first = self.walk(paginator, last.previous_cursor, 'previous_cursor')
+
+        self.assertEqual(backward, forward[-2::-1])
+        self.assertFalse(first.has_previous())
+        self.assertTrue(first.has_next())
+
+    def test_rows_with_equal_placed_at_are_split_by_id(self):
+        Order.objects.update(placed_at=timezone.now())
+        paginator = CursorPaginator(Order.objects.all(), 4)
+
+        pages, _ = self.walk(paginator)
+
+        self.assertEqual(
+            [pk for page in pages for pk in page],
+            sorted(self.expected, reverse=True),
+        )
+
+    def test_invalid_or_tampered_cursor(self):
+        paginator = CursorPaginator(Order.objects.all(), 3)
+        token = paginator.page().next_cursor
+        payload = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+
+        def encode(data):
+            return base64.urlsafe_b64encode(json.dumps(data).encode()).decode().rstrip('=')
+
+        for cursor in (
+            'not a cursor', token[:-3], encode([1, 2]), encode({**payload, 'd': 'x'}),
+            encode({**payload, 'v': payload['v'][:1]}), encode({**payload, 'v': ['yesterday', 1]}),
+        ):
+            with self.subTest(cursor=cursor):
+                with self.assertRaises(InvalidCursor):
+                    paginator.page(cursor)
+                self.assertEqual([order.pk for order in paginator.get_page(cursor)], self.expected[:3])
+
+    def test_approximate_count(self):
+        paginator = CursorPaginator(Order.objects.all(), 3, count_limit=10)
+
+        self.assertEqual(paginator.approximate_count, 11)
+        self.assertFalse(paginator.count_is_exact)
+        self.assertTrue(CursorPaginator(Order.objects.all(), 3, count_limit=25).count_is_exact)
+
+    def assertViewPaginates(self, url, per_page):
+        response = self.client.get(url)
+        page = response.context['page_obj']
+        self.assertEqual([order.pk for order in page], self.expected[:per_page])
+        self.assertContains(response, f'?cursor={page.next_cursor}')
+
+        response = self.client.get(url, {'cursor': page.next_cursor})
+        page = response.context['page_obj']
+        self.assertEqual([order.pk for order in page], self.expected[per_page:2 * per_page])
+        self.assertContains(response, f'?cursor={page.previous_cursor}')
+
+        response = self.client.get(url, {'cursor': 'tampered'})
+        self.assertEqual([order.pk for order in response.context['page_obj']], self.expected[:per_page])
+
+    def test_order_history_view(self):
+        self.client.force_login(self.user)
+        self.assertViewPaginates(reverse('order:order_history'), 10)
+
+    def test_customer_order_history_view(self):
+        self.client.force_login(self.user)
+        self.assertViewPaginates(reverse('customer:order_history'), 10)
+
+    def test_store_admin_order_list(self):
+        Order.objects.bulk_create([
+            Order(store=self.store, customer_email='guest@example.com') for _ in range(50)
+        ])
+        Order.objects.filter(customer=None).update(placed_at=timezone.now() - timedelta(days=2))
+        self.expected = list(Order.objects.order_by('-placed_at', '-id').values_list('pk', flat=True))
+        self.client.force_login(self.user)
+        self.assertViewPaginates(reverse('store_admin:order_list'), 50)
+
+
+class MultiStoreCheckoutTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        snapshot_cache.clear()
+        self.user = User.objects.create_user('buyer', 'buyer@example.com', 'pw')
+        self.stores, self.variants = [], []
+        for name, price in (('Books', '12.00'), ('Apparel', '10.00')):
+            store = Store.objects.create(name=name, tagline='t', owner=self.user)
+            product = Product.objects.create(store=store, name=f'{name} item', slug=name.lower())
+            self.stores.append(store)
+            self.variants.append(Variant.objects.create(
+                product=product, name='Default', sku=f'{name.upper()}-1', default_price=price, stock=10,
+            ))
+        self.client.force_login(self.user)
+
+    def checkout(self, *quantities):
+        cart = Cart.objects.create(user=self.user)
+        for variant, quantity in zip(self.variants, quantities):
+            if quantity:
+                cart.add_variant(variant, quantity)
+        checkout = place_checkout(
+            cart, customer=self.user, customer_email='buyer@example.com',
+            tax=Decimal('1.00'), shipping_cost=Decimal('4.00'),
+        )
+        return checkout, cart
+
+    def test_cart_is_split_into_one_order_per_store(self):
+        checkout, cart = self.checkout(1, 3)
+
+        self.assertEqual(Checkout.objects.count(), 1)
+        orders = {order.store_id: order for order in checkout.orders.all()}
+        self.assertEqual(set(orders), {store.pk for store in self.stores})
+        books, apparel = (orders[store.pk] for store in self.stores)
+        self.assertEqual((books.subtotal, books.total), (Decimal('12.00'), Decimal('17.00')))
+        self.assertEqual((apparel.subtotal, apparel.total), (Decimal('30.00'), Decimal('35.00')))
+        self.assertEqual(
+            [(item.product_variant_id, item.quantity) for item in books.items.all()],
+            [(self.variants[0].pk, 1)],
+        )
+        self.assertEqual(
+            [(item.product_variant_id, item.quantity) for item in apparel.items.all()],
+            [(self.variants[1].pk, 3)],
+        )
+        self.assertEqual((checkout.subtotal, checkout.total), (Decimal('42.00'), Decimal('52.00')))
+        self.assertFalse(cart.items.exists())
+
+    def test_confirmation_lists_the_orders_of_a_multi_store_checkout(self):
+        checkout, _ = self.checkout(1, 3)
+
+        response = self.client.get(reverse('order:checkout_confirmation', args=[checkout.pk]))
+
+        self.assertTemplateUsed(response, 'order/checkout_confirmation.html')
+        # Ordered by store name
+        self.assertEqual([order.store.name for order in response.context['orders']], ['Apparel', 'Books'])
+        for order in checkout.orders.all():
+            self.assertContains(response, reverse('order:order_confirmation', args=[order.pk]))
+
+    def test_confirmation_of_a_single_store_checkout_goes_to_the_order(self):
+        checkout, _ = self.checkout(2, 0)
+
+        response = self.client.get(reverse('order:checkout_confirmation', args=[checkout.pk]))
+
+        order = checkout.orders.get()
+        self.assertRedirects(
+            response, reverse('order:order_confirmation', args=[order.pk]), fetch_redirect_response=False
+        )
+
+    def test_confirmation_of_another_customers_checkout_is_not_found(self):
+        checkout, _ = self.checkout(1, 1)
+        self.client.force_login(User.objects.create_user('other', 'other@example.com', 'pw'))
+
+        response = self.client.get(reverse('order:checkout_confirmation', args=[checkout.pk]))
+
+        self.assertEqual(response.status_code, 404)
@@ -5,9 +5,9 @@ from django.db.models import Sum, F, Q
 from django.urls import reverse
 from django.utils import timezone
 from django.views.decorators.http import require_POST
-from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 
 from .models import Order, OrderItem
+from .pagination import CURSOR_PARAM, CursorPaginator
 from customer.models import Customer
 from store.models import Store
 
@@ -19,27 +19,18 @@ def order_history(request):
     # Get all orders for the current user
     orders_list = Order.objects.filter(customer=request.user)\
                               .select_related('store')\
-                              .prefetch_related('items')\
-                              .annotate(item_count=Sum('items__quantity'))\
-                              .order_by('-placed_at')
+                              .prefetch_related('items')
     
-    # Pagination
-    page = request.GET.get('page', 1)
-    paginator = Paginator(orders_list, 10)  # Show 10 orders per page
-    
-    try:
-        orders = paginator.page(page)
-    except PageNotAnInteger:
-        orders = paginator.page(1)
-    except EmptyPage:
-        orders = paginator.page(paginator.num_pages)
+    # Keyset pagination on (placed_at, id): no OFFSET scan, no COUNT(*)
+    paginator = CursorPaginator(orders_list, 10)  # Show 10 orders per page
+    orders = paginator.get_page(request.GET.get(CURSOR_PARAM))
     
     context = {
         'orders': orders,
         'active_tab': 'orders',
         'paginator': paginator,
         'page_obj': orders,
-        'is_paginated': paginator.num_pages > 1,
+        'is_paginated': orders.has_other_pages(),
     }
     return render(request, 'order/order_history.html', context)
 
@@ -100,22 +91,14 @@ def cancel_order(request, order_id):
     Cancel an order if it's in a cancellable state.
     """
     # Get the order
-    order = get_object_or_404(
-        Order.objects.select_related('customer__user'),
-        id=order_id,
-        customer__user=request.user
-    )
+    order = get_object_or_404(Order, id=order_id, customer=request.user)
     
-    # Check if order can be cancelled
-    if not order.can_cancel():
-        messages.error(request, 'This order cannot be cancelled.')
+    # Cancel and restock through the cancellation service
+    success, message = order.cancel(user=request.user)
+    if not success:
+        messages.error(request, message)
         return redirect('order:order_detail', order_id=order.id)
     
-    # Update order status
-    order.status = 'cancelled'
-    order.save(update_fields=['status'])
-    
-    # TODO: Add logic to handle inventory restocking if needed
     # TODO: Send order cancellation email
     
     messages.success(request, f'Order #{order.id} has been cancelled.')
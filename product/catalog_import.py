@@ -0,0 +1,440 @@
+"""
+Streaming catalog import (CSV or JSON Lines) for a store's products and
+variants.
+
+Each row describes one variant and the product it belongs to:
+
+* ``sku`` (required): the variant to create or update.
+* ``product_name`` (required), ``product_slug``, ``product_description``,
+  ``product_status`` and ``category`` (a category slug): the product,
+  matched by slug. Without ``product_slug``, an existing SKU stays with its
+  current product and a new one goes to the product slugified from the
+  name; only an explicit ``product_slug`` moves a variant.
+* ``variant_name`` (default ``Default``), ``default_price``,
+  ``sale_price``, ``is_on_sale``, ``stock``, ``manage_stock`` and
+  ``currency``: the variant.
+
+A missing column or an empty value leaves the stored value untouched (new
+rows get the model default). Rows that reference another store's product or
+SKU, an unknown category, or an invalid value are rejected. The rejected
+rows are written to the error file with their line number and the reason,
+in the input format, so they can be fixed and imported again.
+
+Rows are read lazily and handled ``chunk_size`` at a time. For each chunk,
+categories, products and SKUs are resolved with one query each, and
+products and variants are written with ``bulk_create`` and ``bulk_update``
+(only the changed columns) in one transaction. Memory use therefore depends
+on the chunk size, not the size of the file.
+
+Used by the ``import_catalog`` management command and
+``store_admin.views.product_import``.
+"""
+import csv
+import io
+import json
+import time
+from decimal import Decimal, InvalidOperation
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.utils.text import slugify
+
+from .models import Category, Product, Variant
+
+FORMATS = ('csv', 'jsonl')
+IMPORT_CHUNK_SIZE = 1000
+
+PRODUCT_STATUSES = {value for value, _ in Product._meta.get_field('status').choices}
+VARIANT_FIELDS = (
+    'variant_name', 'default_price', 'sale_price', 'is_on_sale', 'stock', 'manage_stock', 'currency',
+)
+TRUE_VALUES = {'1', 'true', 'yes', 'y', 'on'}
+FALSE_VALUES = {'0', 'false', 'no', 'n', 'off'}
+
+
+class RowError(ValueError):
+    pass
+
+
+class ImportReport:
+    """Counters of an import run."""
+
+    def __init__(self):
+        self.rows = 0
+        self.rejected = 0
+        self.products_created = 0
+        self.products_updated = 0
+        self.variants_created = 0
+        self.variants_updated = 0
+        self.chunks = 0
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    @property
+    def imported(self):
+        return self.rows - self.rejected
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.elapsed if self.elapsed else float(self.rows)
+
+
+def detect_format(filename):
+    """``csv`` or ``jsonl`` from the file name's extension, or None."""
+    extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    if extension in ('jsonl', 'ndjson'):
+        return 'jsonl'
+    if extension == 'csv':
+        return 'csv'
+    return None
+
+
+def read_rows(stream, fmt):
+    """
+    Yield ``(line, row, error)`` for each record of the text ``stream``;
+    ``row`` is a dict of column to value (None when the line can't be
+    parsed, with ``error`` saying why).
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        if reader.fieldnames:
+            reader.fieldnames = [name.strip().lower() for name in reader.fieldnames]
+        for row in reader:
+            # Cells past the header end up under the None key
+            extra = row.pop(None, None)
+            yield reader.line_num, row, 'Too many columns' if extra else None
+    elif fmt == 'jsonl':
+        for line, text in enumerate(stream, start=1):
+            if not text.strip():
+                continue
+            try:
+                row = json.loads(text)
+            except ValueError as e:
+                yield line, None, f'Invalid JSON: {e}'
+                continue
+            if not isinstance(row, dict):
+                yield line, None, 'Expected a JSON object'
+                continue
+            yield line, {str(key).lower(): value for key, value in row.items()}, None
+    else:
+        raise ValueError(f"Unknown format: {fmt!r} (choose from {', '.join(FORMATS)})")
+
+
+def _given(row, column):
+    value = row.get(column)
+    if isinstance(value, str):
+        value = value.strip()
+    return value not in (None, '')
+
+
+def _text(row, column, max_length):
+    value = str(row[column]).strip()
+    if len(value) > max_length:
+        raise RowError(f'{column} is longer than {max_length} characters')
+    return value
+
+
+def _decimal(row, column):
+    try:
+        value = Decimal(str(row[column]).strip())
+    except InvalidOperation:
+        raise RowError(f'{column} is not a number: {row[column]!r}')
+    if not value.is_finite() or value < 0 or value >= Decimal('1e8'):
+        raise RowError(f'{column} is out of range: {row[column]!r}')
+    return value.quantize(Decimal('0.01'))
+
+
+def _int(row, column):
+    value = row[column]
+    if isinstance(value, bool):
+        raise RowError(f'{column} is not a whole number: {value!r}')
+    try:
+        return int(str(value).strip())
+    except ValueError:
+        raise RowError(f'{column} is not a whole number: {value!r}')
+
+
+def _bool(row, column):
+    value = row[column]
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in TRUE_VALUES:
+        return True
+    if text in FALSE_VALUES:
+        return False
+    raise RowError(f'{column} is not a boolean: {value!r}')
+
+
+def parse_variant_fields(row, fields):
+    """
+    The given (non-empty) ``fields`` of a raw row, converted for ``Variant``;
+    ``variant_name`` maps to ``name``. Raises ``RowError``.
+    """
+    values = {}
+    for column in fields:
+        if not _given(row, column):
+            continue
+        if column == 'variant_name':
+            values['name'] = _text(row, column, 255)
+        elif column in ('default_price', 'sale_price'):
+            values[column] = _decimal(row, column)
+        elif column == 'stock':
+            values[column] = _int(row, column)
+            if values[column] < 0:
+                raise RowError(f'{column} cannot be negative: {row[column]!r}')
+        elif column in ('is_on_sale', 'manage_stock'):
+            values[column] = _bool(row, column)
+        elif column == 'currency':
+            values[column] = _text(row, column, 3).lower()
+    return values
+
+
+def _name_slug(product_values):
+    """The product slug derived from the product name. Raises ``RowError``."""
+    slug = slugify(product_values['name'])[:50].strip('-')
+    if not slug:
+        raise RowError('product_slug is required when product_name has no slug characters')
+    return slug
+
+
+def parse_row(row):
+    """
+    Validate a raw row; returns ``(sku, product_slug, category_slug,
+    product_values, variant_values)``, the values holding only the given
+    columns and ``product_slug`` None when the row has none. Raises
+    ``RowError``.
+    """
+    if not _given(row, 'sku'):
+        raise RowError('sku is required')
+    if not _given(row, 'product_name'):
+        raise RowError('product_name is required')
+    sku = _text(row, 'sku', 100)
+
+    slug = None
+    if _given(row, 'product_slug'):
+        slug = _text(row, 'product_slug', 50)
+        if slug != slugify(slug):
+            raise RowError(f'product_slug is not a valid slug: {slug!r}')
+
+    product_values = {'name': _text(row, 'product_name', 255)}
+    if _given(row, 'product_description'):
+        product_values['description'] = str(row['product_description']).strip()
+    if _given(row, 'product_status'):
+        status = str(row['product_status']).strip().lower()
+        if status not in PRODUCT_STATUSES:
+            raise RowError(f'product_status must be one of {", ".join(sorted(PRODUCT_STATUSES))}')
+        product_values['status'] = status
+    category = str(row['category']).strip() if _given(row, 'category') else None
+
+    variant_values = {'sku': sku, **parse_variant_fields(row, VARIANT_FIELDS)}
+    return sku, slug, category, product_values, variant_values
+
+
+def _assign(instance, values):
+    """Set ``values`` on ``instance``; returns the names of the changed fields."""
+    changed = set()
+    for name, value in values.items():
+        if getattr(instance, name) != value:
+            setattr(instance, name, value)
+            changed.add(name)
+    return changed
+
+
+class CatalogImporter:
+    """
+    Import rows into ``store``. ``errors`` is an optional text file that
+    receives the rejected rows; ``progress`` is called with the report after
+    every chunk.
+    """
+
+    def __init__(self, store, fmt, chunk_size=IMPORT_CHUNK_SIZE, errors=None, progress=None):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown format: {fmt!r} (choose from {', '.join(FORMATS)})")
+        self.store = store
+        self.fmt = fmt
+        self.chunk_size = chunk_size
+        self.errors = errors
+        self.progress = progress
+        self.report = ImportReport()
+        self._error_writer = None
+        self._error_header = []
+
+    def run(self, stream):
+        """Import every row of the text ``stream``; returns the ``ImportReport``."""
+        chunk = []
+        for line, row, error in read_rows(stream, self.fmt):
+            self.report.rows += 1
+            if error:
+                self.reject(line, row, error)
+                continue
+            chunk.append((line, row))
+            if len(chunk) >= self.chunk_size:
+                self.import_chunk(chunk)
+                chunk = []
+        if chunk:
+            self.import_chunk(chunk)
+        self.report.elapsed = time.perf_counter() - self.report.started
+        return self.report
+
+    def reject(self, line, row, error):
+        self.report.rejected += 1
+        if self.errors is None:
+            return
+        if self.fmt == 'jsonl':
+            record = dict(row or {})
+            record.update(line=line, error=error)
+            self.errors.write(json.dumps(record, default=str) + '\n')
+            return
+        if self._error_writer is None:
+            self._error_writer = csv.writer(self.errors)
+            self._error_header = list(row) if row else []
+            self._error_writer.writerow(['line', 'error'] + self._error_header)
+        values = [row.get(column, '') for column in self._error_header] if row else []
+        self._error_writer.writerow([line, error] + values)
+
+    def import_chunk(self, chunk):
+        """Validate and upsert one chunk of ``(line, row)`` pairs."""
+        parsed = []
+        seen_skus = set()
+        for line, row in chunk:
+            try:
+                sku, slug, category, product_values, variant_values = parse_row(row)
+            except RowError as e:
+                self.reject(line, row, str(e))
+                continue
+            if sku in seen_skus:
+                self.reject(line, row, f'Duplicate sku {sku!r} in the same chunk')
+                continue
+            seen_skus.add(sku)
+            parsed.append((line, row, sku, slug, category, product_values, variant_values))
+
+        variants = {
+            variant.sku: variant
+            for variant in Variant.objects.filter(sku__in=seen_skus).select_related('product')
+        }
+        # Without an explicit slug, an existing SKU keeps its product
+        resolved = []
+        for line, row, sku, slug, category, product_values, variant_values in parsed:
+            if slug is None:
+                variant = variants.get(sku)
+                if variant is not None:
+                    slug = variant.product.slug
+                else:
+                    try:
+                        slug = _name_slug(product_values)
+                    except RowError as e:
+                        self.reject(line, row, str(e))
+                        continue
+            resolved.append((line, row, sku, slug, category, product_values, variant_values))
+
+        categories = dict(
+            Category.objects.filter(slug__in={item[4] for item in resolved if item[4]})
+            .values_list('slug', 'pk')
+        )
+        products = {
+            product.slug: product
+            for product in Product.objects.filter(slug__in={item[3] for item in resolved})
+        }
+
+        accepted = []
+        for line, row, sku, slug, category, product_values, variant_values in resolved:
+            if category is not None:
+                if category not in categories:
+                    self.reject(line, row, f'Unknown category {category!r}')
+                    continue
+                product_values = {**product_values, 'category_id': categories[category]}
+            variant = variants.get(sku)
+            if variant is not None and variant.product.store_id != self.store.pk:
+                self.reject(line, row, f'SKU {sku!r} belongs to another store')
+                continue
+            product = products.get(slug)
+            if product is not None and product.store_id != self.store.pk:
+                self.reject(line, row, f'Product slug {slug!r} belongs to another store')
+                continue
+            accepted.append((line, row, sku, slug, product_values, variant_values))
+
+        try:
+            with transaction.atomic():
+                self._write(accepted, products, variants)
+        except IntegrityError as e:
+            # Most likely a concurrent import claimed a slug or SKU; the
+            # chunk is rolled back as a whole
+            for line, row, *_ in accepted:
+                self.reject(line, row, f'Database error: {e}')
+        self.report.chunks += 1
+        self.report.elapsed = time.perf_counter() - self.report.started
+        if self.progress:
+            self.progress(self.report)
+
+    def _write(self, accepted, products, variants):
+        now = timezone.now()
+
+        # Products: the first row of a slug in the chunk sets its values
+        new_products, changed_products, product_fields = {}, {}, set()
+        for _, _, _, slug, product_values, _ in accepted:
+            if slug in new_products or slug in changed_products:
+                continue
+            product = products.get(slug)
+            if product is None:
+                new_products[slug] = Product(store=self.store, slug=slug, **product_values)
+                continue
+            changed = _assign(product, product_values)
+            if changed:
+                changed_products[slug] = product
+                product_fields |= changed
+        if new_products:
+            Product.objects.bulk_create(new_products.values())
+            if any(product.pk is None for product in new_products.values()):
+                # Backends that can't return inserted ids (MySQL)
+                new_products = {
+                    product.slug: product
+                    for product in Product.objects.filter(slug__in=new_products)
+                }
+            products.update(new_products)
+        if changed_products:
+            for product in changed_products.values():
+                product.updated_at = now
+            Product.objects.bulk_update(
+                changed_products.values(), [*sorted(product_fields), 'updated_at'], batch_size=500
+            )
+
+        # Variants
+        new_variants, changed_variants, variant_fields = [], [], set()
+        for _, _, sku, slug, _, variant_values in accepted:
+            product = products[slug]
+            variant = variants.get(sku)
+            if variant is None:
+                values = {'name': 'Default', **variant_values}
+                new_variants.append(Variant(product=product, **values))
+                continue
+            changed = _assign(variant, variant_values)
+            if variant.product_id != product.pk:
+                variant.product = product
+                changed.add('product')
+            if changed:
+                changed_variants.append(variant)
+                variant_fields |= changed
+        if new_variants:
+            Variant.objects.bulk_create(new_variants)
+        if changed_variants:
+            for variant in changed_variants:
+                variant.updated_at = now
+            Variant.objects.bulk_update(
+                changed_variants, [*sorted(variant_fields), 'updated_at'], batch_size=500
+            )
+
+        self.report.products_created += len(new_products)
+        self.report.products_updated += len(changed_products)
+        self.report.variants_created += len(new_variants)
+        self.report.variants_updated += len(changed_variants)
+
+
+def import_catalog(store, stream, fmt='csv', chunk_size=IMPORT_CHUNK_SIZE, errors=None, progress=None):
+    """Import the CSV/JSONL text ``stream`` into ``store``; returns the ``ImportReport``."""
+    return CatalogImporter(store, fmt, chunk_size, errors, progress).run(stream)
+
+
+def open_text(binary_file):
+    """Wrap an uploaded (binary) file for ``read_rows`` without reading it whole."""
+    return io.TextIOWrapper(binary_file, encoding='utf-8-sig', newline='')
@@ -0,0 +1,138 @@
+"""
+Price and stock feed for warehouse/ERP systems.
+
+A feed is a sequence of deltas, one per SKU, each holding the ``sku`` and
+the new values of any of ``stock`` (not negative), ``default_price``,
+``sale_price`` (``null`` clears it) and ``is_on_sale``; omitted fields
+stay as they are.
+Values are absolute, so replaying a feed is harmless.
+
+Deltas are handled ``chunk_size`` at a time. For each chunk, the store's
+variants are matched with one ``sku__in`` query on the unique SKU index.
+The deltas are then applied in order, so a later delta for the same SKU
+wins. Only the columns that changed are written, one column at a time:
+variants that get the same new value share one ``UPDATE``, the others are
+written with ``bulk_update``, and ``updated_at`` is set with one ``UPDATE``
+for the chunk.
+
+Every delta gets a result: ``updated`` (with the changed ``fields``),
+``unchanged``, ``not_found`` (no such SKU in the store) or ``invalid``
+(with the ``error``).
+
+Used by ``store_admin.api_views.VariantFeedAPIView`` and the
+``apply_variant_feed`` management command.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.utils import timezone
+
+from .catalog_import import RowError, parse_variant_fields
+from .models import Variant
+
+FEED_FIELDS = ('stock', 'default_price', 'sale_price', 'is_on_sale')
+FEED_CHUNK_SIZE = 2000
+RESULT_STATUSES = ('updated', 'unchanged', 'not_found', 'invalid')
+# Fewest variants sharing a new column value worth their own UPDATE
+SHARED_UPDATE_MIN_ROWS = 10
+
+
+def parse_delta(delta):
+    """``(sku, values)`` for a raw delta. Raises ``RowError``."""
+    if not isinstance(delta, dict):
+        raise RowError('Expected an object with a sku')
+    unknown = set(delta) - {'sku', *FEED_FIELDS}
+    if unknown:
+        raise RowError(f"Unknown field(s): {', '.join(sorted(unknown))}")
+    sku = delta.get('sku')
+    if not isinstance(sku, (str, int)) or not str(sku).strip():
+        raise RowError('sku is required')
+    values = parse_variant_fields(delta, FEED_FIELDS)
+    if 'sale_price' in delta and delta['sale_price'] is None:
+        values['sale_price'] = None
+    return str(sku).strip(), values
+
+
+def _apply_chunk(store, chunk):
+    parsed = []
+    for delta in chunk:
+        try:
+            parsed.append(parse_delta(delta))
+        except RowError as e:
+            parsed.append((delta.get('sku') if isinstance(delta, dict) else None, e))
+
+    skus = {sku for sku, values in parsed if not isinstance(values, RowError)}
+    variants = {
+        variant.sku: variant
+        for variant in Variant.objects.filter(product__store=store, sku__in=skus).only('sku', *FEED_FIELDS)
+    }
+    variants_by_pk = {variant.pk: variant for variant in variants.values()}
+    original = {
+        sku: {field: getattr(variant, field) for field in FEED_FIELDS}
+        for sku, variant in variants.items()
+    }
+
+    results = []
+    for sku, values in parsed:
+        if isinstance(values, RowError):
+            results.append({'sku': sku, 'status': 'invalid', 'error': str(values)})
+            continue
+        variant = variants.get(sku)
+        if variant is None:
+            results.append({'sku': sku, 'status': 'not_found'})
+            continue
+        changed = [field for field, value in values.items() if getattr(variant, field) != value]
+        for field in changed:
+            setattr(variant, field, values[field])
+        if changed:
+            results.append({'sku': sku, 'status': 'updated', 'fields': changed})
+        else:
+            results.append({'sku': sku, 'status': 'unchanged'})
+
+    # Compare with the loaded values: a SKU changed and changed back within
+    # the chunk needs no write. Each changed column is written on its own:
+    # variants getting the same new value (a stock level, a price point, the
+    # sale flag) share one plain UPDATE, the rest go through bulk_update.
+    same_value = defaultdict(list)
+    for sku, variant in variants.items():
+        for field in FEED_FIELDS:
+            value = getattr(variant, field)
+            if value != original[sku][field]:
+                same_value[field, value].append(variant.pk)
+    if not same_value:
+        return results
+
+    individual = defaultdict(list)
+    with transaction.atomic():
+        for (field, value), pks in same_value.items():
+            if len(pks) >= SHARED_UPDATE_MIN_ROWS:
+                Variant.objects.filter(pk__in=pks).update(**{field: value})
+            else:
+                individual[field].extend(pks)
+        for field, pks in individual.items():
+            Variant.objects.bulk_update([variants_by_pk[pk] for pk in pks], [field], batch_size=500)
+        # One statement for the timestamps rather than a CASE per row
+        Variant.objects.filter(
+            pk__in={pk for pks in same_value.values() for pk in pks}
+        ).update(updated_at=timezone.now())
+    return results
+
+
+def iter_feed_results(store, deltas, chunk_size=FEED_CHUNK_SIZE):
+    """Apply ``deltas`` to the store's variants, yielding one result per delta in order."""
+    chunk = []
+    for delta in deltas:
+        chunk.append(delta)
+        if len(chunk) >= chunk_size:
+            yield from _apply_chunk(store, chunk)
+            chunk = []
+    if chunk:
+        yield from _apply_chunk(store, chunk)
+
+
+def count_results(results):
+    """``{status: n}`` for every result status."""
+    counts = dict.fromkeys(RESULT_STATUSES, 0)
+    for result in results:
+        counts[result['status']] += 1
+    return counts
@@ -0,0 +1,76 @@
+"""
+Apply a price/stock feed (CSV or JSON Lines, one delta per SKU) to a
+store's variants.
+
+Columns/keys: ``sku`` and any of ``stock``, ``default_price``,
+``sale_price`` and ``is_on_sale`` (see product/feed.py). The file is read
+and applied in chunks; the per-SKU results can be written as JSON Lines.
+
+Usage:
+    python manage.py apply_variant_feed --store 1 feed.csv
+    python manage.py apply_variant_feed --store 1 feed.jsonl --results results.jsonl
+"""
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from product.catalog_import import FORMATS, detect_format, read_rows
+from product.feed import FEED_CHUNK_SIZE, RESULT_STATUSES, iter_feed_results
+from store.models import Store
+
+
+class Command(BaseCommand):
+    help = 'Apply a CSV or JSONL price/stock feed to a store\'s variants by SKU'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Feed file to apply')
+        parser.add_argument('--store', type=int, required=True, help='Store id whose variants to update')
+        parser.add_argument('--format', choices=FORMATS, default=None,
+                            help='File format (default: from the file extension)')
+        parser.add_argument('--results', default=None,
+                            help='File for the per-SKU results as JSON Lines')
+        parser.add_argument('--chunk-size', type=int, default=FEED_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        store = Store.objects.filter(pk=options['store']).first()
+        if store is None:
+            raise CommandError(f"Store {options['store']} does not exist.")
+        fmt = options['format'] or detect_format(options['path'])
+        if fmt is None:
+            raise CommandError('Cannot tell the format from the file name; pass --format.')
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be at least 1.')
+
+        counts = dict.fromkeys(RESULT_STATUSES, 0)
+
+        def deltas(stream):
+            for line, row, error in read_rows(stream, fmt):
+                if error:
+                    counts['invalid'] += 1
+                    self.stderr.write(f'Line {line}: {error}')
+                    continue
+                yield row
+
+        started = time.perf_counter()
+        try:
+            with open(options['path'], newline='', encoding='utf-8-sig') as stream:
+                results = open(options['results'], 'w', encoding='utf-8') if options['results'] else None
+                try:
+                    for result in iter_feed_results(store, deltas(stream), options['chunk_size']):
+                        counts[result['status']] += 1
+                        if results:
+                            results.write(json.dumps(result) + '\n')
+                finally:
+                    if results:
+                        results.close()
+        except OSError as e:
+            raise CommandError(e)
+        elapsed = time.perf_counter() - started
+
+        total = sum(counts.values())
+        rate = total / elapsed if elapsed else total
+        self.stdout.write(self.style.SUCCESS(
+            f'Applied {total} delta(s) to {store.name} in {elapsed:.1f}s ({rate:.0f} deltas/s): '
+            + ', '.join(f'{count} {status}' for status, count in counts.items()) + '.'
+        ))
@@ -0,0 +1,69 @@
+"""
+Import a store's products and variants from a CSV or JSON Lines catalog.
+
+Streams the file in chunks and upserts by product slug and variant SKU
+(see product/catalog_import.py), so it handles catalogs of any size with
+flat memory use. Rejected rows go to the error file with the reason.
+
+Usage:
+    python manage.py import_catalog --store 1 catalog.csv
+    python manage.py import_catalog --store 1 catalog.jsonl --errors rejected.jsonl --chunk-size 2000
+"""
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from product.catalog_import import FORMATS, IMPORT_CHUNK_SIZE, detect_format, import_catalog
+from store.models import Store
+
+
+class Command(BaseCommand):
+    help = 'Stream a CSV or JSONL catalog into a store, upserting products and variants'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Catalog file to import')
+        parser.add_argument('--store', type=int, required=True, help='Store id to import into')
+        parser.add_argument('--format', choices=FORMATS, default=None,
+                            help='File format (default: from the file extension)')
+        parser.add_argument('--errors', default=None,
+                            help='File for rejected rows (default: <path>.errors.<format>, removed if empty)')
+        parser.add_argument('--chunk-size', type=int, default=IMPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        store = Store.objects.filter(pk=options['store']).first()
+        if store is None:
+            raise CommandError(f"Store {options['store']} does not exist.")
+        fmt = options['format'] or detect_format(options['path'])
+        if fmt is None:
+            raise CommandError('Cannot tell the format from the file name; pass --format.')
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be at least 1.')
+        errors_path = options['errors'] or f"{options['path']}.errors.{fmt}"
+
+        def progress(report):
+            self.stdout.write(
+                f'{report.rows} row(s) read, {report.rejected} rejected '
+                f'({report.rows_per_second:.0f} rows/s)'
+            )
+
+        try:
+            with open(options['path'], newline='', encoding='utf-8-sig') as stream, \
+                    open(errors_path, 'w', newline='', encoding='utf-8') as errors:
+                report = import_catalog(
+                    store, stream, fmt, options['chunk_size'], errors=errors, progress=progress
+                )
+        except OSError as e:
+            raise CommandError(e)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {report.imported} of {report.rows} row(s) into {store.name} '
+            f'in {report.elapsed:.1f}s ({report.rows_per_second:.0f} rows/s): '
+            f'{report.products_created} product(s) created, {report.products_updated} updated; '
+            f'{report.variants_created} variant(s) created, {report.variants_updated} updated.'
+        ))
+        if report.rejected:
+            self.stdout.write(self.style.WARNING(
+                f'{report.rejected} row(s) rejected; see {errors_path}.'
+            ))
+        else:
+            os.remove(errors_path)
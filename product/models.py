@@ -91,6 +91,13 @@ class Variant(models.Model):
     def __str__(self):
         return f"{self.product.name} - {self.name}"
 
+    @property
+    def price(self):
+        """Current selling price: the sale price while on sale, else the default."""
+        if self.is_on_sale and self.sale_price is not None:
+            return self.sale_price
+        return self.default_price
+
 
 
 
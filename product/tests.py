@@ -1,3 +1,159 @@
+import io
+import json
+import os
+import tempfile
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management import CommandError, call_command
 from django.test import TestCase
 
-# Create your tests here.
+from store.models import Store
+from .catalog_import import import_catalog
+from .feed import SHARED_UPDATE_MIN_ROWS, count_results, iter_feed_results
+from .models import Product, Variant
+
+User = get_user_model()
+
+
+class CatalogImportProductSlugTests(TestCase):
+    def setUp(self):
+        owner = User.objects.create_user('owner', 'owner@example.com', 'pw')
+        self.store = Store.objects.create(name='Shop', tagline='t', owner=owner)
+        self.product = Product.objects.create(store=self.store, name='Tee', slug='classic-tee')
+        self.variant = Variant.objects.create(product=self.product, name='M', sku='TEE-M', default_price='10.00')
+
+    def run_import(self, text):
+        errors = io.StringIO()
+        report = import_catalog(self.store, io.StringIO(text), errors=errors)
+        self.assertEqual(report.rejected, 0, errors.getvalue())
+        return report
+
+    def test_existing_sku_without_slug_keeps_its_product(self):
+        # The name slugifies to "summer-tee", which is not this variant's product
+        self.run_import('sku,product_name,stock\nTEE-M,Summer Tee,4\n')
+
+        self.variant.refresh_from_db()
+        self.product.refresh_from_db()
+        self.assertEqual(self.variant.product, self.product)
+        self.assertEqual(self.variant.stock, 4)
+        self.assertEqual(self.product.name, 'Summer Tee')
+        self.assertFalse(Product.objects.filter(slug='summer-tee').exists())
+
+    def test_explicit_slug_moves_an_existing_sku(self):
+        self.run_import('sku,product_name,product_slug\nTEE-M,Summer Tee,summer-tee\n')
+
+        self.variant.refresh_from_db()
+        self.assertEqual(self.variant.product.slug, 'summer-tee')
+        self.assertEqual(self.product.variants.count(), 0)
+
+    def test_new_sku_without_slug_goes_to_the_named_product(self):
+        report = self.run_import('sku,product_name\nTEE-L,Summer Tee\n')
+
+        self.assertEqual(report.products_created, 1)
+        self.assertEqual(Variant.objects.get(sku='TEE-L').product.slug, 'summer-tee')
+
+
+class VariantFeedTests(TestCase):
+    def setUp(self):
+        owner = User.objects.create_user('owner', 'owner@example.com', 'pw')
+        self.store = Store.objects.create(name='Shop', tagline='t', owner=owner)
+        product = Product.objects.create(store=self.store, name='Tee', slug='tee')
+        for sku in ('TEE-S', 'TEE-M', 'TEE-L'):
+            Variant.objects.create(product=product, name=sku, sku=sku, default_price='10.00', stock=5)
+        other_store = Store.objects.create(name='Other', tagline='t', owner=owner)
+        other = Product.objects.create(store=other_store, name='Mug', slug='mug')
+        Variant.objects.create(product=other, name='Mug', sku='MUG', default_price='8.00', stock=5)
+
+    def values(self, sku):
+        return Variant.objects.values('stock', 'default_price', 'sale_price', 'is_on_sale').get(sku=sku)
+
+    def test_result_per_delta(self):
+        results = list(iter_feed_results(self.store, [
+            {'sku': 'TEE-S', 'stock': 7, 'sale_price': '8.50', 'is_on_sale': 'yes'},
+            {'sku': 'TEE-M', 'stock': 5, 'default_price': '10.00'},
+            {'sku': 'NOPE', 'stock': 1},
+            {'sku': 'MUG', 'stock': 1},
+            {'sku': 'TEE-L', 'stock': -5},
+            {'sku': 'TEE-L', 'stock': 'many'},
+            {'sku': 'TEE-L', 'colour': 'red'},
+            {'stock': 1},
+            'TEE-L',
+        ]))
+
+        self.assertEqual(results, [
+            {'sku': 'TEE-S', 'status': 'updated', 'fields': ['stock', 'sale_price', 'is_on_sale']},
+            {'sku': 'TEE-M', 'status': 'unchanged'},
+            {'sku': 'NOPE', 'status': 'not_found'},
+            {'sku': 'MUG', 'status': 'not_found'},
+            {'sku': 'TEE-L', 'status': 'invalid', 'error': "stock cannot be negative: -5"},
+            {'sku': 'TEE-L', 'status': 'invalid', 'error': "stock is not a whole number: 'many'"},
+            {'sku': 'TEE-L', 'status': 'invalid', 'error': 'Unknown field(s): colour'},
+            {'sku': None, 'status': 'invalid', 'error': 'sku is required'},
+            {'sku': None, 'status': 'invalid', 'error': 'Expected an object with a sku'},
+        ])
+        self.assertEqual(count_results(results), {'updated': 1, 'unchanged': 1, 'not_found': 2, 'invalid': 5})
+        self.assertEqual(
+            self.values('TEE-S'),
+            {'stock': 7, 'default_price': Decimal('10.00'), 'sale_price': Decimal('8.50'), 'is_on_sale': True},
+        )
+        self.assertEqual(self.values('TEE-L')['stock'], 5)
+        # Another store's SKU is never touched
+        self.assertEqual(self.values('MUG')['stock'], 5)
+
+    def test_later_delta_for_a_sku_wins(self):
+        Variant.objects.filter(sku='TEE-S').update(sale_price='9.00', is_on_sale=True)
+
+        results = list(iter_feed_results(self.store, [
+            {'sku': 'TEE-S', 'stock': 9, 'sale_price': None},
+            {'sku': 'TEE-S', 'stock': 3},
+            {'sku': 'TEE-M', 'stock': 9},
+            {'sku': 'TEE-M', 'stock': 5},
+        ], chunk_size=10))
+
+        self.assertEqual([result['status'] for result in results], ['updated', 'updated', 'updated', 'updated'])
+        self.assertEqual(self.values('TEE-S')['stock'], 3)
+        self.assertIsNone(self.values('TEE-S')['sale_price'])
+        self.assertEqual(self.values('TEE-M')['stock'], 5)
+
+    def test_shared_values_are_written_with_one_update(self):
+        product = Product.objects.get(slug='tee')
+        Variant.objects.bulk_create([
+            Variant(product=product, name=f'V{n}', sku=f'BULK-{n}', default_price='10.00', stock=5)
+            for n in range(SHARED_UPDATE_MIN_ROWS)
+        ])
+        deltas = [{'sku': f'BULK-{n}', 'stock': 0} for n in range(SHARED_UPDATE_MIN_ROWS)]
+        deltas.append({'sku': 'TEE-S', 'default_price': '11.00'})
+
+        # variants, savepoint, shared stock UPDATE, bulk_update of the
+        # price, updated_at, release savepoint
+        with self.assertNumQueries(6):
+            results = list(iter_feed_results(self.store, deltas))
+
+        self.assertEqual(count_results(results)['updated'], SHARED_UPDATE_MIN_ROWS + 1)
+        self.assertFalse(Variant.objects.filter(sku__startswith='BULK-').exclude(stock=0).exists())
+        self.assertEqual(self.values('TEE-S')['default_price'], Decimal('11.00'))
+
+    def test_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            feed = os.path.join(directory, 'feed.csv')
+            output = os.path.join(directory, 'results.jsonl')
+            with open(feed, 'w', newline='') as f:
+                f.write('sku,stock,default_price\nTEE-S,7,\nTEE-M,5,10.00\nMUG,1,\nTEE-L,-1,\n')
+            stdout = io.StringIO()
+
+            call_command('apply_variant_feed', feed, store=self.store.pk, results=output, stdout=stdout)
+
+            with open(output) as f:
+                results = [json.loads(line) for line in f]
+        self.assertIn('1 updated, 1 unchanged, 1 not_found, 1 invalid', stdout.getvalue())
+        self.assertEqual(
+            [(result['sku'], result['status']) for result in results],
+            [('TEE-S', 'updated'), ('TEE-M', 'unchanged'), ('MUG', 'not_found'), ('TEE-L', 'invalid')],
+        )
+        self.assertEqual(self.values('TEE-S')['stock'], 7)
+        self.assertEqual(self.values('MUG')['stock'], 5)
+
+    def test_command_rejects_unknown_store(self):
+        with self.assertRaisesMessage(CommandError, 'Store 999 does not exist.'):
+            call_command('apply_variant_feed', 'feed.csv', store=999)
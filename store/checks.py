@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    """
+    Cart summaries, store memberships, dashboard counters and the
+    process_orders checkpoint are invalidated through the default cache, so
+    every worker process must see the same one.
+    """
+    backend = settings.CACHES.get('default', {}).get('BACKEND')
+    if backend not in PROCESS_LOCAL_CACHES:
+        return []
+    return [Warning(
+        'The default cache is local to each process.',
+        hint='Set CACHE_URL to a cache shared by all workers (Redis or Memcached); '
+             'otherwise cached cart summaries, memberships and order counters go stale '
+             'when more than one worker process serves requests.',
+        id='store.W001',
+    )]
@@ -197,7 +197,8 @@ class Command(BaseCommand):
                 default_price=Decimal(str(product_data['price'])),
                 sale_price=Decimal(str(product_data['sale_price'])) if product_data['sale_price'] else None,
                 is_on_sale=product_data['sale_price'] is not None,
-                currency='USD'
+                currency='USD',
+                stock=fake.random_int(min=10, max=100)
             )
             
             self.stdout.write(f'Created product: {product.name} for {store.name}')
@@ -0,0 +1,84 @@
+"""
+Which stores a user can administer, cached per user.
+
+``get_store_roles`` lists the ``(store_id, role)`` pairs for the stores a
+user owns (by name) followed by the stores where they are accepted staff.
+The pairs are computed with two queries on a cache miss and then served
+from the cache until a ``Store`` or ``StoreStaff`` change touching the user
+invalidates them (see ``store.signals``). Only ids and roles are cached, so
+store edits and schema changes never leave stale objects behind; the
+``Store`` rows are loaded per request by ``get_store_memberships`` and
+``resolve_store``.
+"""
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Store, StoreStaff
+
+SESSION_KEY = 'store_admin_store_id'
+
+StoreMembership = namedtuple('StoreMembership', ['store', 'role'])
+
+
+def membership_timeout():
+    return getattr(settings, 'STORE_MEMBERSHIP_CACHE_TIMEOUT', 24 * 60 * 60)
+
+
+def _key(user_id):
+    return f'store-memberships:{user_id}'
+
+
+def get_store_roles(user):
+    """``(store_id, role)`` pairs for ``user``; owned stores first."""
+    if not user.is_authenticated:
+        return []
+    roles = cache.get(_key(user.pk))
+    if roles is None:
+        roles = [
+            (store_id, 'owner')
+            for store_id in Store.objects.filter(owner=user).values_list('pk', flat=True)
+        ] + [
+            (store_id, 'admin' if is_admin else 'staff')
+            for store_id, is_admin in StoreStaff.objects.filter(user=user, accepted=True)
+            .exclude(store__owner=user)
+            .order_by('pk')
+            .values_list('store_id', 'is_admin')
+        ]
+        cache.set(_key(user.pk), roles, membership_timeout())
+    return roles
+
+
+def get_store_memberships(user):
+    """``StoreMembership`` tuples for ``user``, in ``get_store_roles`` order."""
+    roles = get_store_roles(user)
+    if not roles:
+        return []
+    stores = Store.objects.in_bulk([store_id for store_id, _ in roles])
+    return [
+        StoreMembership(stores[store_id], role)
+        for store_id, role in roles if store_id in stores
+    ]
+
+
+def invalidate_store_memberships(*user_ids):
+    cache.delete_many([_key(user_id) for user_id in set(user_ids) if user_id is not None])
+
+
+def resolve_store(request):
+    """The store ``request.user`` is working on, or None."""
+    store_ids = [store_id for store_id, _ in get_store_roles(request.user)]
+    if not store_ids:
+        return None
+    selected = request.session.get(SESSION_KEY)
+    store_id = selected if selected in store_ids else store_ids[0]
+    return Store.objects.filter(pk=store_id).first()
+
+
+def switch_store(request, store_id):
+    """Make ``store_id`` the session's store; False if the user is not a member."""
+    if any(member_id == store_id for member_id, _ in get_store_roles(request.user)):
+        request.session[SESSION_KEY] = store_id
+        return True
+    return False
@@ -23,11 +23,31 @@ class Store(models.Model):
     
     def __str__(self):
         return self.name
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._snapshot_owner_id()
+        return instance
+
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        self._snapshot_owner_id()
+
+    def _snapshot_owner_id(self):
+        """Record the (loaded) owner so post_save can spot a transfer."""
+        if 'owner_id' in self.__dict__:
+            self.__dict__['_loaded_owner_id'] = self.__dict__['owner_id']
+
+    def get_loaded_owner_id(self):
+        """Owner when the store was loaded or last saved; None if unsaved."""
+        return self.__dict__.get('_loaded_owner_id')
         
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify(self.name)
         super().save(*args, **kwargs)
+        self._snapshot_owner_id()
         
     def get_absolute_url(self):
         return reverse('store_front:store_products', kwargs={'store_slug': self.slug})
@@ -0,0 +1,27 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .membership import invalidate_store_memberships
+from .models import Store, StoreStaff
+
+
+@receiver(post_save, sender=Store)
+def store_saved(sender, instance, created, **kwargs):
+    """
+    Memberships only cache store ids and roles, so a save matters when the
+    store is new or changed hands; a transfer refreshes both owners.
+    """
+    previous_owner_id = instance.get_loaded_owner_id()
+    if created or previous_owner_id != instance.owner_id:
+        invalidate_store_memberships(instance.owner_id, previous_owner_id)
+
+
+@receiver(post_delete, sender=Store)
+def store_deleted(sender, instance, **kwargs):
+    # Staff links are cascaded and refresh their users via store_staff_changed
+    invalidate_store_memberships(instance.owner_id)
+
+
+@receiver([post_save, post_delete], sender=StoreStaff)
+def store_staff_changed(sender, instance, **kwargs):
+    invalidate_store_memberships(instance.user_id)
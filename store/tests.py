@@ -1,3 +1,88 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.test import TestCase
 
-# Create your tests here.
+from .membership import _key, get_store_memberships, get_store_roles
+from .models import Store, StoreStaff
+
+User = get_user_model()
+
+
+class StoreMembershipTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user('owner', 'owner@example.com', 'pw')
+        self.staff = User.objects.create_user('staff', 'staff@example.com', 'pw')
+        self.store = Store.objects.create(name='Shop', tagline='t', owner=self.owner)
+        self.other = Store.objects.create(name='Workshop', tagline='t', owner=self.staff)
+        StoreStaff.objects.create(store=self.store, user=self.staff, is_admin=True, accepted=True)
+
+    def test_cache_holds_only_store_ids_and_roles(self):
+        memberships = get_store_memberships(self.staff)
+
+        self.assertEqual(
+            [(m.store, m.role) for m in memberships],
+            [(self.other, 'owner'), (self.store, 'admin')],
+        )
+        self.assertEqual(cache.get(_key(self.staff.pk)), [(self.other.pk, 'owner'), (self.store.pk, 'admin')])
+
+    def test_warm_cache_serves_roles_without_a_query(self):
+        get_store_roles(self.owner)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_store_roles(self.owner), [(self.store.pk, 'owner')])
+
+    def test_store_edits_show_up_without_invalidation(self):
+        get_store_roles(self.owner)
+        Store.objects.filter(pk=self.store.pk).update(name='Renamed')
+
+        self.assertEqual(get_store_memberships(self.owner)[0].store.name, 'Renamed')
+
+    def test_saving_a_store_runs_no_extra_query(self):
+        store = Store.objects.get(pk=self.store.pk)
+        store.name = 'Renamed'
+        get_store_roles(self.owner)
+
+        with self.assertNumQueries(1):
+            store.save()
+
+        self.assertIsNotNone(cache.get(_key(self.owner.pk)))
+
+    def test_ownership_transfer_refreshes_both_owners(self):
+        get_store_roles(self.owner)
+        get_store_roles(self.staff)
+        store = Store.objects.get(pk=self.store.pk)
+        store.owner = self.staff
+        store.save()
+
+        self.assertEqual(get_store_roles(self.owner), [])
+        self.assertEqual(get_store_roles(self.staff), [(self.store.pk, 'owner'), (self.other.pk, 'owner')])
+
+        # The saved owner is the new baseline: saving again keeps the cache
+        store.save()
+        self.assertIsNotNone(cache.get(_key(self.staff.pk)))
+
+    def test_new_store_refreshes_its_owner(self):
+        get_store_roles(self.owner)
+        extra = Store.objects.create(name='Annex', tagline='t', owner=self.owner)
+
+        self.assertEqual(get_store_roles(self.owner), [(extra.pk, 'owner'), (self.store.pk, 'owner')])
+
+    def test_staff_changes_refresh_the_staff_member(self):
+        newcomer = User.objects.create_user('newcomer', 'newcomer@example.com', 'pw')
+        link = StoreStaff.objects.create(store=self.store, user=newcomer)
+        self.assertEqual(get_store_roles(newcomer), [])
+
+        link.accepted = True
+        link.save()
+        self.assertEqual(get_store_roles(newcomer), [(self.store.pk, 'staff')])
+
+        link.delete()
+        self.assertEqual(get_store_roles(newcomer), [])
+
+    def test_deleting_a_store_refreshes_owner_and_staff(self):
+        get_store_roles(self.owner)
+        get_store_roles(self.staff)
+        self.store.delete()
+
+        self.assertEqual(get_store_roles(self.owner), [])
+        self.assertEqual(get_store_roles(self.staff), [(self.other.pk, 'owner')])
@@ -0,0 +1,45 @@
+from rest_framework import status
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from product.feed import count_results, iter_feed_results
+from store.membership import get_store_memberships, resolve_store
+
+
+class VariantFeedAPIView(APIView):
+    """
+    Apply a batch of price/stock deltas to the store's variants by SKU (see
+    product/feed.py).
+
+    The body is a list of deltas, or ``{"store": id, "deltas": [...]}`` to
+    pick one of the user's stores (default: the store selected in
+    store_admin, else the user's first store). Responds with the count per
+    result status and one result per delta, in order.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        data = request.data
+        store_id = None
+        if isinstance(data, dict):
+            store_id = data.get('store')
+            data = data.get('deltas')
+        if not isinstance(data, list):
+            return Response(
+                {'error': 'Expected a list of deltas or an object with a "deltas" list.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        if store_id is None:
+            store = resolve_store(request)
+        else:
+            store = next(
+                (m.store for m in get_store_memberships(request.user) if str(m.store.pk) == str(store_id)),
+                None
+            )
+        if store is None:
+            return Response({'error': 'No such store for this user.'}, status=status.HTTP_403_FORBIDDEN)
+
+        results = list(iter_feed_results(store, data))
+        return Response({'store': store.pk, 'counts': count_results(results), 'results': results})
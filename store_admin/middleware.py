@@ -0,0 +1,21 @@
+from django.utils.functional import SimpleLazyObject
+
+from store.membership import get_store_memberships, resolve_store
+
+
+class StoreMembershipMiddleware:
+    """
+    Attach ``request.store_memberships`` and ``request.store`` (the store
+    the user is administering, or None). Both are resolved lazily from the
+    per-user membership cache, so requests that never look at them cost
+    nothing and the ones that do load just the Store rows they need.
+    Must come after the session and authentication middleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.store_memberships = SimpleLazyObject(lambda: get_store_memberships(request.user))
+        request.store = SimpleLazyObject(lambda: resolve_store(request))
+        return self.get_response(request)
@@ -1,3 +1,256 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.test import TestCase
+from django.urls import reverse
 
-# Create your tests here.
+from cart.models import Cart
+from order.checkout import place_checkout, snapshot_cache
+from order.models import Order
+from product.models import Product, Variant
+from store.models import Store
+
+User = get_user_model()
+
+
+def variant_form_data(variants):
+    """The variant table form of product_edit as the browser posts it."""
+    data = {'variant_form': '1'}
+    for variant in variants:
+        data.update({
+            f'variant_name_{variant.id}': variant.name,
+            f'variant_sku_{variant.id}': variant.sku or '',
+            f'variant_default_price_{variant.id}': str(variant.default_price),
+            f'variant_sale_price_{variant.id}': '' if variant.sale_price is None else str(variant.sale_price),
+            f'variant_stock_{variant.id}': str(variant.stock),
+        })
+        if variant.is_on_sale:
+            data[f'variant_is_on_sale_{variant.id}'] = 'on'
+        if variant.manage_stock:
+            data[f'variant_manage_stock_{variant.id}'] = 'on'
+    return data
+
+
+class ProductEditVariantsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user('owner', 'owner@example.com', 'pw')
+        self.store = Store.objects.create(name='Shop', tagline='t', owner=self.owner)
+        self.product = Product.objects.create(store=self.store, name='Tee', slug='tee')
+        self.client.force_login(self.owner)
+        self.url = reverse('store_admin:product_edit', args=[self.product.id])
+
+    def make_variants(self, count, **fields):
+        Variant.objects.bulk_create([
+            Variant(product=self.product, name=f'V{i}', default_price='10.00', stock=5, **fields)
+            for i in range(count)
+        ])
+        return list(self.product.variants.order_by('pk'))
+
+    def test_variant_form_query_count_does_not_grow_with_variants(self):
+        variants = self.make_variants(500)
+        for variant in variants:
+            variant.sku = f'TEE-{variant.pk}'
+        Variant.objects.bulk_update(variants, ['sku'])
+        data = variant_form_data(variants)
+        for variant in variants[:100]:
+            data[f'variant_default_price_{variant.id}'] = '12.50'
+        for variant in variants[100:150]:
+            data[f'variant_stock_{variant.id}'] = '9'
+        for variant in variants[150:160]:
+            data[f'variant_delete_{variant.id}'] = 'on'
+        data.update(new_variant_name='New', new_variant_sku='TEE-NEW')
+
+        # session, user, memberships (owned, staff), store, product,
+        # variants, savepoint, delete (collect, images, cart items, order
+        # items, variants), bulk_update, insert, release savepoint
+        with self.assertNumQueries(16):
+            response = self.client.post(self.url, data)
+
+        self.assertRedirects(response, self.url, fetch_redirect_response=False)
+        self.assertEqual(self.product.variants.count(), 491)
+        self.assertEqual(Variant.objects.filter(default_price='12.50').count(), 100)
+        self.assertEqual(Variant.objects.filter(stock=9).count(), 50)
+        self.assertTrue(Variant.objects.filter(sku='TEE-NEW').exists())
+
+    def test_unchanged_variant_form_writes_nothing(self):
+        variants = self.make_variants(500)
+        # session, user, memberships (owned, staff), store, product,
+        # variants, savepoint, release savepoint
+        with self.assertNumQueries(9):
+            self.client.post(self.url, variant_form_data(variants))
+
+    def test_blank_skus_are_saved_as_null(self):
+        variants = self.make_variants(2)
+        self.assertTrue(all(variant.sku is None for variant in variants))
+        data = variant_form_data(variants)
+        data[f'variant_stock_{variants[0].id}'] = '7'
+        data[f'variant_stock_{variants[1].id}'] = '8'
+        data.update(new_variant_name='Third', new_variant_sku='')
+
+        response = self.client.post(self.url, data)
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(
+            list(self.product.variants.order_by('pk').values_list('sku', 'stock')),
+            [(None, 7), (None, 8), (None, 0)],
+        )
+
+    def test_modal_variants_with_blank_skus(self):
+        data = {'variant_modal_form': '1'}
+        for i in range(3):
+            data[f'modal_variant_name_{i}'] = f'M{i}'
+            data[f'modal_variant_sku_{i}'] = ''
+
+        with self.assertNumQueries(7):
+            response = self.client.post(self.url, data)
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(list(self.product.variants.values_list('sku', flat=True)), [None] * 3)
+
+
+class OrderEditTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        snapshot_cache.clear()
+        self.owner = User.objects.create_user('owner', 'owner@example.com', 'pw')
+        self.store = Store.objects.create(name='Shop', tagline='t', owner=self.owner)
+        product = Product.objects.create(store=self.store, name='Tee', slug='tee')
+        self.variant = Variant.objects.create(product=product, name='M', sku='TEE-M', default_price='10.00', stock=10)
+        cart = Cart.objects.create(user=self.owner)
+        cart.add_variant(self.variant, 3)
+        self.order = place_checkout(cart, customer=self.owner, customer_email='owner@example.com').orders.get()
+        self.client.force_login(self.owner)
+        self.url = reverse('store_admin:order_edit', args=[self.order.id])
+
+    def test_cancelling_restocks_items(self):
+        self.variant.refresh_from_db()
+        self.assertEqual(self.variant.stock, 7)
+
+        response = self.client.post(self.url, {'status': 'cancelled'})
+
+        self.assertRedirects(response, reverse('store_admin:order_list'), fetch_redirect_response=False)
+        self.order.refresh_from_db()
+        self.variant.refresh_from_db()
+        self.assertEqual(self.order.status, 'cancelled')
+        self.assertEqual(self.order.cancelled_by, self.owner)
+        self.assertEqual(self.variant.stock, 10)
+
+        # Saving the cancelled status again does not restock twice
+        self.client.post(self.url, {'status': 'cancelled'})
+        self.variant.refresh_from_db()
+        self.assertEqual(self.variant.stock, 10)
+
+    def test_completed_order_cannot_be_cancelled(self):
+        Order.objects.filter(pk=self.order.pk).update(status='completed')
+
+        response = self.client.post(self.url, {'status': 'cancelled'})
+
+        self.assertContains(response, 'This order cannot be cancelled.')
+        self.order.refresh_from_db()
+        self.variant.refresh_from_db()
+        self.assertEqual(self.order.status, 'completed')
+        self.assertEqual(self.variant.stock, 7)
+
+
+class VariantFeedAPITests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user('owner', 'owner@example.com', 'pw')
+        self.store = Store.objects.create(name='Shop', tagline='t', owner=self.owner)
+        self.second = Store.objects.create(name='Workshop', tagline='t', owner=self.owner)
+        stranger = User.objects.create_user('stranger', 'stranger@example.com', 'pw')
+        self.foreign = Store.objects.create(name='Foreign', tagline='t', owner=stranger)
+        for store, sku in ((self.store, 'TEE-M'), (self.second, 'CAP'), (self.foreign, 'MUG')):
+            product = Product.objects.create(store=store, name=sku, slug=sku.lower())
+            Variant.objects.create(product=product, name=sku, sku=sku, default_price='10.00', stock=5)
+        self.client.force_login(self.owner)
+        self.url = reverse('store_admin:api_variant_feed')
+
+    def post(self, data):
+        return self.client.post(self.url, data, content_type='application/json')
+
+    def stock(self, sku):
+        return Variant.objects.get(sku=sku).stock
+
+    def test_applies_deltas_to_the_current_store(self):
+        response = self.post([
+            {'sku': 'TEE-M', 'stock': 8},
+            {'sku': 'TEE-M', 'default_price': '10.00'},
+            {'sku': 'CAP', 'stock': 1},
+            {'sku': 'MUG', 'stock': 1},
+            {'sku': 'TEE-M', 'stock': -1},
+        ])
+
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(body['store'], self.store.pk)
+        self.assertEqual(body['counts'], {'updated': 1, 'unchanged': 1, 'not_found': 2, 'invalid': 1})
+        self.assertEqual(
+            [result['status'] for result in body['results']],
+            ['updated', 'unchanged', 'not_found', 'not_found', 'invalid'],
+        )
+        self.assertEqual((self.stock('TEE-M'), self.stock('CAP'), self.stock('MUG')), (8, 5, 5))
+
+    def test_store_can_be_picked_among_the_users_stores(self):
+        response = self.post({
+            'store': self.second.pk,
+            'deltas': [{'sku': 'CAP', 'stock': 2}, {'sku': 'TEE-M', 'stock': 2}],
+        })
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['counts']['updated'], 1)
+        self.assertEqual((self.stock('CAP'), self.stock('TEE-M')), (2, 5))
+
+    def test_other_users_store_is_forbidden(self):
+        response = self.post({'store': self.foreign.pk, 'deltas': [{'sku': 'MUG', 'stock': 0}]})
+
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.stock('MUG'), 5)
+
+    def test_rejects_a_body_without_deltas(self):
+        self.assertEqual(self.post({'store': self.store.pk}).status_code, 400)
+
+    def test_requires_authentication(self):
+        self.client.logout()
+        self.assertIn(self.post([{'sku': 'TEE-M', 'stock': 0}]).status_code, (401, 403))
+        self.assertEqual(self.stock('TEE-M'), 5)
+
+
+class SwitchStoreTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user('owner', 'owner@example.com', 'pw')
+        self.store = Store.objects.create(name='Shop', tagline='t', owner=self.owner)
+        self.second = Store.objects.create(name='Workshop', tagline='t', owner=self.owner)
+        stranger = User.objects.create_user('stranger', 'stranger@example.com', 'pw')
+        self.foreign = Store.objects.create(name='Foreign', tagline='t', owner=stranger)
+        self.client.force_login(self.owner)
+        self.url = reverse('store_admin:switch_store')
+        self.dashboard = reverse('store_admin:dashboard')
+
+    def current_store(self):
+        return self.client.get(self.dashboard).wsgi_request.store
+
+    def test_defaults_to_the_first_owned_store(self):
+        self.assertEqual(self.current_store(), self.store)
+
+    def test_switches_to_one_of_the_users_stores(self):
+        next_url = reverse('store_admin:order_list')
+        response = self.client.post(self.url, {'store_id': self.second.pk, 'next': next_url})
+
+        self.assertRedirects(response, next_url, fetch_redirect_response=False)
+        self.assertEqual(self.current_store(), self.second)
+
+    def test_rejects_a_store_the_user_cannot_administer(self):
+        for store_id in (self.foreign.pk, 'nope'):
+            response = self.client.post(self.url, {'store_id': store_id, 'next': 'https://evil.example.com/'})
+
+            self.assertRedirects(response, self.dashboard, fetch_redirect_response=False)
+            self.assertEqual(self.current_store(), self.store)
+
+    def test_losing_the_switched_store_falls_back_to_the_first(self):
+        self.client.post(self.url, {'store_id': self.second.pk})
+        self.second.owner = self.foreign.owner
+        self.second.save()
+
+        self.assertEqual(self.current_store(), self.store)
@@ -1,5 +1,6 @@
 from django.urls import path
 from . import views
+from .api_views import VariantFeedAPIView
 
 app_name = 'store_admin'
 
@@ -7,11 +8,16 @@ urlpatterns = [
     path('', views.dashboard, name='dashboard'),
     path('login/', views.login_view, name='login'),
     path('dashboard/', views.dashboard, name='dashboard'),
+    path('switch-store/', views.switch_store, name='switch_store'),
     path('products/', views.product_list, name='product_list'),
     path('products/edit/<int:product_id>/', views.product_edit, name='product_edit'),
     path('products/add/', views.product_edit, name='product_add'),
+    path('products/import/', views.product_import, name='product_import'),
+    path('products/import/errors/<str:filename>/', views.product_import_errors, name='product_import_errors'),
     path('products/<int:product_id>/', views.product_edit, name='product_detail'),
+    path('api/variants/feed/', VariantFeedAPIView.as_view(), name='api_variant_feed'),
     path('orders/', views.order_list, name='order_list'),
+    path('orders/export/', views.order_export, name='order_export'),
     path('orders/edit/<int:order_id>/', views.order_edit, name='order_edit'),
     path('customers/', views.customer_list, name='customer_list'),
     path('customers/<int:customer_id>/', views.customer_detail, name='customer_detail'),
@@ -1,10 +1,29 @@
+import re
+import tempfile
+import uuid
+from decimal import Decimal
+
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import authenticate, login as auth_login, logout as auth_logout
+from django.contrib import messages
+from django.db import transaction
+from django.utils import timezone
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.http import FileResponse, Http404, HttpResponseBadRequest, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.http import url_has_allowed_host_and_scheme
+from django.views.decorators.http import require_POST
 from product.models import Product, Variant, Image, Category
+from product.catalog_import import FORMATS as CATALOG_FORMATS, detect_format, import_catalog, open_text
 from order.models import Order, OrderItem
+from order.export import FORMATS as EXPORT_FORMATS, export_orders, filter_orders
+from order.pagination import CURSOR_PARAM, CursorPaginator
+from order.stats import store_order_stats
+from store.membership import switch_store as switch_store_for_session
 from store.models import Store, StoreStaff
-from django.db.models import Sum, F
+from django.db.models import Count, Sum, F, Window
 from customer.models import Customer
 
 # Create your views here.
@@ -21,36 +40,48 @@ def login_view(request):
             return render(request, 'store_admin/login.html', {'error': 'Invalid credentials'})
     return render(request, 'store_admin/login.html')
 
-def get_current_store_for_user(user):
-    # Try to get the first store where the user is owner or staff
-    store = Store.objects.filter(owner=user).first()
-    if not store:
-        staff_link = StoreStaff.objects.filter(user=user, accepted=True).select_related('store').first()
-        if staff_link:
-            store = staff_link.store
-    return store
+@login_required
+@require_POST
+def switch_store(request):
+    """Switch the store being administered (one of the user's memberships)."""
+    try:
+        store_id = int(request.POST.get('store_id', ''))
+    except ValueError:
+        store_id = None
+    if store_id is None or not switch_store_for_session(request, store_id):
+        messages.error(request, 'You cannot administer that store.')
+    next_url = request.POST.get('next')
+    if not url_has_allowed_host_and_scheme(next_url, allowed_hosts={request.get_host()}):
+        next_url = reverse('store_admin:dashboard')
+    return redirect(next_url)
 
 @login_required
 def dashboard(request):
-    store = get_current_store_for_user(request.user)
+    store = request.store
     if not store:
         return render(request, 'store_admin/dashboard.html', {'error': 'No store assigned.'})
-    # Sales summary
-    total_sales = Order.objects.filter(store=store, status__in=['completed', 'processing']).aggregate(total=Sum('total'))['total'] or 0
-    order_count = Order.objects.filter(store=store).count()
-    product_count = Product.objects.filter(store=store).count()
-    recent_orders = Order.objects.filter(store=store).order_by('-placed_at')[:5]
+    # Order counts and amounts per status: cached counters kept up to date
+    # by order events, rebuilt with one conditional aggregation when missing
+    stats = store_order_stats(store.pk)
+    total_sales = stats['completed']['amount'] + stats['processing']['amount']
+    order_count = sum(values['count'] for values in stats.values())
+    pending_amount = stats['pending']['amount']
+    processing_amount = stats['processing']['amount']
+    completed_count = stats['completed']['count']
+    processing_count = stats['processing']['count']
+    pending_count = stats['pending']['count']
+    cancelled_count = stats['cancelled']['count']
 
-    # New: order status counts and amounts
-    pending_amount = Order.objects.filter(store=store, status='pending').aggregate(total=Sum('total'))['total'] or 0
-    processing_amount = Order.objects.filter(store=store, status='processing').aggregate(total=Sum('total'))['total'] or 0
-    completed_count = Order.objects.filter(store=store, status='completed').count()
-    processing_count = Order.objects.filter(store=store, status='processing').count()
-    pending_count = Order.objects.filter(store=store, status='pending').count()
-    cancelled_count = Order.objects.filter(store=store, status='cancelled').count()
+    recent_orders = Order.objects.filter(store=store).select_related('customer').order_by('-placed_at')[:5]
 
-    # New: recent products and customers
-    recent_products = Product.objects.filter(store=store).order_by('-created_at')[:5]
+    # Recent products and customers; the product total rides along on the
+    # same query as a window count
+    recent_products = list(
+        Product.objects.filter(store=store)
+        .annotate(store_product_count=Window(Count('pk')))
+        .order_by('-created_at')[:5]
+    )
+    product_count = recent_products[0].store_product_count if recent_products else 0
     recent_customers = Customer.objects.filter(store=store).order_by('-created_at')[:5]
 
     return render(request, 'store_admin/dashboard.html', {
@@ -71,15 +102,82 @@ def dashboard(request):
 
 @login_required
 def product_list(request):
-    store = get_current_store_for_user(request.user)
+    store = request.store
     if not store:
         return render(request, 'store_admin/product_list.html', {'error': 'No store assigned.'})
     products = Product.objects.filter(store=store).prefetch_related('variants')
     return render(request, 'store_admin/product_list.html', {'products': products, 'store': store})
 
+IMPORT_ERRORS_DIR = 'catalog-import-errors'
+IMPORT_ERRORS_FILENAME = re.compile(r'[0-9a-f]{32}\.(csv|jsonl)')
+
+@login_required
+def product_import(request):
+    """
+    Import a CSV/JSONL catalog upload into the store (see
+    product/catalog_import.py); rejected rows are kept for download.
+    """
+    store = request.store
+    if not store:
+        return redirect('store_admin:product_list')
+    context = {'store': store, 'formats': CATALOG_FORMATS}
+    if request.method == 'POST':
+        upload = request.FILES.get('catalog')
+        fmt = request.POST.get('format') or (detect_format(upload.name) if upload else None)
+        if not upload:
+            context['error'] = 'Choose a catalog file to import.'
+        elif fmt not in CATALOG_FORMATS:
+            context['error'] = 'Cannot tell the file format; choose CSV or JSONL.'
+        else:
+            with tempfile.TemporaryFile('w+', newline='', encoding='utf-8') as errors:
+                report = import_catalog(store, open_text(upload.file), fmt, errors=errors)
+                if report.rejected:
+                    errors.seek(0)
+                    context['errors_file'] = default_storage.save(
+                        f'{IMPORT_ERRORS_DIR}/{store.pk}/{uuid.uuid4().hex}.{fmt}', File(errors)
+                    ).rsplit('/', 1)[-1]
+            context['report'] = report
+    return render(request, 'store_admin/product_import.html', context)
+
+@login_required
+def product_import_errors(request, filename):
+    """Download the rejected rows of one of the store's catalog imports."""
+    store = request.store
+    name = f'{IMPORT_ERRORS_DIR}/{store.pk}/{filename}' if store else None
+    if not name or not IMPORT_ERRORS_FILENAME.fullmatch(filename) or not default_storage.exists(name):
+        raise Http404
+    return FileResponse(
+        default_storage.open(name, 'rb'), as_attachment=True,
+        filename=f"catalog-errors.{filename.rsplit('.', 1)[-1]}",
+    )
+
+def _apply_variant_form(variant, data):
+    """
+    Copy the ``variant_*_<id>`` fields of the variant form onto ``variant``;
+    returns the names of the fields whose value changed.
+    """
+    default_price = data.get(f'variant_default_price_{variant.id}')
+    sale_price = data.get(f'variant_sale_price_{variant.id}')
+    stock = data.get(f'variant_stock_{variant.id}')
+    values = {
+        'name': data.get(f'variant_name_{variant.id}', variant.name),
+        # sku is unique but nullable: a blank field means no sku
+        'sku': data.get(f'variant_sku_{variant.id}', variant.sku) or None,
+        # Handle numeric fields safely
+        'default_price': Decimal(default_price) if default_price not in [None, ''] else Decimal('0.00'),
+        'sale_price': Decimal(sale_price) if sale_price not in [None, ''] else None,
+        'stock': int(stock) if stock not in [None, ''] else 0,
+        'is_on_sale': bool(data.get(f'variant_is_on_sale_{variant.id}')),
+        'manage_stock': bool(data.get(f'variant_manage_stock_{variant.id}')),
+    }
+    changed = {name for name, value in values.items() if getattr(variant, name) != value}
+    for name in changed:
+        setattr(variant, name, values[name])
+    return changed
+
 @login_required
 def product_edit(request, product_id=None):
-    store = get_current_store_for_user(request.user)
+    store = request.store
     if not store:
         return redirect('store_admin:product_list')
     categories = Category.objects.all()
@@ -95,30 +193,24 @@ def product_edit(request, product_id=None):
     if request.method == 'POST':
         # --- VARIANT MODAL FORM (multi-add) ---
         if request.POST.get('variant_modal_form'):
+            new_variants = []
             idx = 0
-            created = 0
             while True:
                 name = request.POST.get(f'modal_variant_name_{idx}')
                 if not name:
                     break
-                sku = request.POST.get(f'modal_variant_sku_{idx}')
-                default_price = request.POST.get(f'modal_variant_default_price_{idx}') or 0
-                sale_price = request.POST.get(f'modal_variant_sale_price_{idx}') or None
-                stock = request.POST.get(f'modal_variant_stock_{idx}') or 0
-                is_on_sale = bool(request.POST.get(f'modal_variant_is_on_sale_{idx}'))
-                manage_stock = bool(request.POST.get(f'modal_variant_manage_stock_{idx}'))
-                Variant.objects.create(
+                new_variants.append(Variant(
                     product=product,
                     name=name,
-                    sku=sku,
-                    default_price=default_price,
-                    sale_price=sale_price,
-                    stock=stock,
-                    is_on_sale=is_on_sale,
-                    manage_stock=manage_stock,
-                )
-                created += 1
+                    sku=request.POST.get(f'modal_variant_sku_{idx}') or None,
+                    default_price=request.POST.get(f'modal_variant_default_price_{idx}') or 0,
+                    sale_price=request.POST.get(f'modal_variant_sale_price_{idx}') or None,
+                    stock=request.POST.get(f'modal_variant_stock_{idx}') or 0,
+                    is_on_sale=bool(request.POST.get(f'modal_variant_is_on_sale_{idx}')),
+                    manage_stock=bool(request.POST.get(f'modal_variant_manage_stock_{idx}')),
+                ))
                 idx += 1
+            Variant.objects.bulk_create(new_variants)
             return redirect('store_admin:product_edit', product.id)
         # --- IMAGE MODAL FORM (multi-upload) ---
         elif request.POST.get('image_modal_form'):
@@ -129,36 +221,42 @@ def product_edit(request, product_id=None):
             return redirect('store_admin:product_edit', product.id)
         # --- VARIANT FORM ---
         if request.POST.get('variant_form'):
-            # Update/delete existing variants
+            # Collect every change first, then write them in bulk
+            to_delete = []
+            to_update = []
+            changed_fields = set()
             for variant in variants:
                 if request.POST.get(f'variant_delete_{variant.id}'):
-                    variant.delete()
+                    to_delete.append(variant.id)
                     continue
-                variant.name = request.POST.get(f'variant_name_{variant.id}', variant.name)
-                variant.sku = request.POST.get(f'variant_sku_{variant.id}', variant.sku)
-                # Handle numeric fields safely
-                default_price_val = request.POST.get(f'variant_default_price_{variant.id}')
-                variant.default_price = float(default_price_val) if default_price_val not in [None, ''] else 0
-                sale_price_val = request.POST.get(f'variant_sale_price_{variant.id}')
-                variant.sale_price = float(sale_price_val) if sale_price_val not in [None, ''] else None
-                stock_val = request.POST.get(f'variant_stock_{variant.id}')
-                variant.stock = int(stock_val) if stock_val not in [None, ''] else 0
-                variant.is_on_sale = bool(request.POST.get(f'variant_is_on_sale_{variant.id}'))
-                variant.manage_stock = bool(request.POST.get(f'variant_manage_stock_{variant.id}'))
-                variant.save()
-            # Add new variant
+                changed = _apply_variant_form(variant, request.POST)
+                if changed:
+                    to_update.append(variant)
+                    changed_fields |= changed
+            new_variant = None
             new_name = request.POST.get('new_variant_name')
             if new_name:
-                Variant.objects.create(
+                new_variant = Variant(
                     product=product,
                     name=new_name,
-                    sku=request.POST.get('new_variant_sku'),
+                    sku=request.POST.get('new_variant_sku') or None,
                     default_price=request.POST.get('new_variant_default_price') or 0,
                     sale_price=request.POST.get('new_variant_sale_price') or None,
                     stock=request.POST.get('new_variant_stock') or 0,
                     is_on_sale=bool(request.POST.get('new_variant_is_on_sale')),
                     manage_stock=bool(request.POST.get('new_variant_manage_stock')),
                 )
+            with transaction.atomic():
+                if to_delete:
+                    Variant.objects.filter(product=product, id__in=to_delete).delete()
+                if to_update:
+                    # bulk_update skips save(), so auto_now is set by hand
+                    now = timezone.now()
+                    for variant in to_update:
+                        variant.updated_at = now
+                    Variant.objects.bulk_update(to_update, [*sorted(changed_fields), 'updated_at'])
+                if new_variant is not None:
+                    Variant.objects.bulk_create([new_variant])
             return redirect('store_admin:product_edit', product.id)
         # --- IMAGE UPLOAD FORM ---
         elif request.POST.get('image_form'):
@@ -206,7 +304,7 @@ def product_edit(request, product_id=None):
 # Customer list and detail views
 @login_required
 def customer_list(request):
-    store = get_current_store_for_user(request.user)
+    store = request.store
     if not store:
         return render(request, 'store_admin/customer_list.html', {'error': 'No store assigned.'})
     customers = Customer.objects.filter(store=store).order_by('-created_at')
@@ -214,7 +312,7 @@ def customer_list(request):
 
 @login_required
 def customer_detail(request, customer_id):
-    store = get_current_store_for_user(request.user)
+    store = request.store
     if not store:
         return redirect('store_admin:customer_list')
     customer = get_object_or_404(Customer, id=customer_id, store=store)
@@ -223,15 +321,45 @@ def customer_detail(request, customer_id):
 
 @login_required
 def order_list(request):
-    store = get_current_store_for_user(request.user)
+    store = request.store
     if not store:
         return render(request, 'store_admin/order_list.html', {'error': 'No store assigned.'})
-    orders = Order.objects.filter(store=store).select_related('customer').order_by('-placed_at')
-    return render(request, 'store_admin/order_list.html', {'orders': orders, 'store': store})
+    orders = Order.objects.filter(store=store).select_related('customer')
+    paginator = CursorPaginator(orders, 50)
+    page = paginator.get_page(request.GET.get(CURSOR_PARAM))
+    return render(request, 'store_admin/order_list.html', {
+        'orders': page,
+        'page_obj': page,
+        'paginator': paginator,
+        'status_choices': Order.STATUS_CHOICES,
+        'store': store,
+    })
+
+@login_required
+def order_export(request):
+    """Stream the store's orders and their items as CSV or JSONL."""
+    store = request.store
+    if not store:
+        return redirect('store_admin:order_list')
+    fmt = request.GET.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        return HttpResponseBadRequest(f'Unknown format: {fmt}')
+    try:
+        orders = filter_orders(
+            Order.objects.filter(store=store),
+            date_from=request.GET.get('from'),
+            date_to=request.GET.get('to'),
+            status=request.GET.get('status'),
+        )
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    response = StreamingHttpResponse(export_orders(orders, fmt), content_type=EXPORT_FORMATS[fmt])
+    response['Content-Disposition'] = f'attachment; filename="orders-{store.pk}.{fmt}"'
+    return response
 
 @login_required
 def order_edit(request, order_id):
-    store = get_current_store_for_user(request.user)
+    store = request.store
     if not store:
         return redirect('store_admin:order_list')
     order = (
@@ -243,12 +371,20 @@ def order_edit(request, order_id):
     )
     if not order:
         return redirect('store_admin:order_list')
+    error = None
     if request.method == 'POST':
         status = request.POST.get('status')
-        if status in dict(Order.STATUS_CHOICES):
-            order.status = status
-            order.save()
-        return redirect('store_admin:order_list')
+        if status == 'cancelled' and order.status != 'cancelled':
+            # Restocks the items under the cancellation service's lock
+            cancelled, message = order.cancel(user=request.user)
+            if cancelled:
+                return redirect('store_admin:order_list')
+            error = message
+        else:
+            if status in dict(Order.STATUS_CHOICES):
+                order.status = status
+                order.save()
+            return redirect('store_admin:order_list')
     # Get all order items
     items = order.items.all()
     return render(request, 'store_admin/order_edit.html', {
@@ -256,4 +392,5 @@ def order_edit(request, order_id):
         'order': order,
         'store': store,
         'items': items,
+        'error': error,
     })